@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+'''
+    Bulk task creation benchmark
+
+    Times the real Tasks.new_task, awaited once per task as a client
+    looping on POST /tasks gets, against the real Tasks.new_task_bulk.
+    Validation, the storage executor, the cache and the existence
+    filter are the ones mango runs, only riak and memcached are fakes
+    with a fixed round trip time, riak stores on the storage executor
+    and memcached calls on the cache executor like in production.
+
+    Reported per path: time, tasks/s and memcached calls made.
+
+    usage: python -m bench.bench_bulk [tasks] [riak_rtt_ms] [memcached_rtt_ms] [concurrency]
+'''
+
+
+__author__ = 'Jean Chassoul'
+
+
+import sys
+import time
+from contextlib import contextmanager
+from tornado import gen
+from tornado.ioloop import IOLoop
+from mango.system import tasks
+from mango.tools import cache as cache_module
+from mango.tools import exists
+from mango.tools.cache import Cache
+
+
+class FakeMemcached(object):
+    '''
+        Memcached client look-alike, one round trip per call
+    '''
+    calls = 0
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            FakeMemcached.calls += 1
+            time.sleep(self.rtt)
+            return ({} if method == 'get_multi' else None)
+        return call
+
+
+class FakePool(object):
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+
+    @contextmanager
+    def reserve(self):
+        yield FakeMemcached(self.rtt)
+
+
+class BenchCache(Cache):
+    pool = None
+
+
+class BenchTasks(tasks.Tasks):
+    '''
+        Tasks system over the fakes
+    '''
+    kvalue = None
+
+    def __init__(self, cache, concurrency):
+        self.cache = cache
+        self.settings = {'bulk_concurrency': concurrency}
+
+
+def fake_task_map(rtt):
+    '''
+        One riak map store round trip
+    '''
+    def store(*args):
+        time.sleep(rtt)
+    return store
+
+
+def structs(count):
+    return [{'account': 'bench', 'subject': 'task {0}'.format(x), 'watchers': ['bot']}
+            for x in range(count)]
+
+
+@gen.coroutine
+def serial(system, count):
+    for struct in structs(count):
+        yield system.new_task(struct)
+
+
+@gen.coroutine
+def bulk(system, count):
+    results = yield system.new_task_bulk(structs(count))
+    assert all(x['status'] == 201 for x in results)
+
+
+def run(name, coroutine):
+    FakeMemcached.calls = 0
+    start = time.perf_counter()
+    IOLoop.current().run_sync(coroutine)
+    return name, time.perf_counter() - start, FakeMemcached.calls
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    riak_rtt = (float(sys.argv[2]) if len(sys.argv) > 2 else 2.0) / 1000
+    memcached_rtt = (float(sys.argv[3]) if len(sys.argv) > 3 else 0.3) / 1000
+    concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else 16
+    cache_module._settings['servers'] = ['fake']
+    cache = BenchCache()
+    cache.pool = FakePool(memcached_rtt)
+    exists.cache = cache
+    tasks.TaskMap = fake_task_map(riak_rtt)
+    system = BenchTasks(cache, concurrency)
+    results = [
+        run('serial', lambda: serial(system, count)),
+        run('bulk', lambda: bulk(system, count)),
+    ]
+    for name, elapsed, calls in results:
+        print('{0:>8}: {1} tasks in {2:.2f}s, {3:.0f} tasks/s, {4} memcached calls'.format(
+            name, count, elapsed, count / elapsed, calls))
+    print('speedup: {0:.1f}x'.format(results[0][1] / results[1][1]))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+'''
+    PATCH modify benchmark
+
+    Compare the old per-key reload/update loop against update_struct,
+    one fetch and one map update, on a fake riak map with a fixed
+    round trip time, counting riak round trips and latency.
+
+    usage: python -m bench.bench_modify [patches] [rtt_ms]
+'''
+
+
+__author__ = 'Jean Chassoul'
+
+
+import sys
+import time
+import ujson as json
+from collections import defaultdict
+from mango.system import update_struct
+
+
+class FakeRegister(object):
+    value = None
+
+    def assign(self, value):
+        self.value = value
+
+
+class FakeSet(object):
+
+    def __init__(self):
+        self.value = frozenset()
+
+    def add(self, thing):
+        self.value = self.value | {thing}
+
+
+class FakeMap(object):
+    '''
+        Riak map look-alike, every reload and update is a round trip
+    '''
+
+    def __init__(self, rtt):
+        self.rtt = rtt
+        self.round_trips = 0
+        self.registers = defaultdict(FakeRegister)
+        self.sets = defaultdict(FakeSet)
+
+    def reload(self):
+        self.round_trips += 1
+        time.sleep(self.rtt)
+        return self
+
+    def update(self):
+        self.round_trips += 1
+        time.sleep(self.rtt)
+        return self
+
+
+def legacy_modify(task, struct, ignore):
+    '''
+        The old modify_task loop
+    '''
+    for key in struct:
+        if key not in ignore:
+            if type(struct.get(key)) == list:
+                task.reload()
+                old_value = task.registers['{0}'.format(key)].value
+                if old_value:
+                    old_list = json.loads(old_value.replace("'", '"'))
+                    for thing in struct.get(key):
+                        old_list.append(thing)
+                    task.registers['{0}'.format(key)].assign(str(old_list))
+                else:
+                    new_list = []
+                    for thing in struct.get(key):
+                        new_list.append(thing)
+                    task.registers['{0}'.format(key)].assign(str(new_list))
+            else:
+                task.registers['{0}'.format(key)].assign(str(struct.get(key)))
+            task.update()
+    return True
+
+
+# a 10 field PATCH, 3 of them lists
+PATCH = {
+    'subject': 'bench',
+    'description': 'a task under benchmark',
+    'status': 'now',
+    'duration': '3600',
+    'last_update_by': 'bench',
+    'last_update_at': '1500000000',
+    'checked': 'True',
+    'assign': ['bench'],
+    'comments': ['one more comment'],
+    'history': ['moved to now'],
+}
+
+IGNORE_ME = ("_yz_id", "_yz_rk", "_yz_rt", "_yz_rb")
+
+
+def run(modify, patches, rtt):
+    round_trips = 0
+    latencies = []
+    for _ in range(patches):
+        task = FakeMap(rtt)
+        start = time.perf_counter()
+        modify(task, PATCH, IGNORE_ME)
+        latencies.append((time.perf_counter() - start) * 1000)
+        round_trips += task.round_trips
+    return round_trips / float(patches), sum(latencies) / len(latencies)
+
+
+if __name__ == '__main__':
+    patches = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rtt = (float(sys.argv[2]) if len(sys.argv) > 2 else 1.0) / 1000.0
+    for name, modify in (('legacy', legacy_modify), ('batched', update_struct)):
+        trips, latency = run(modify, patches, rtt)
+        print('{0:>8}: round_trips/patch={1:.1f} latency={2:.2f}ms'.format(
+            name, trips, latency))
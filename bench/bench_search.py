@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+'''
+    Search client benchmark
+
+    Compare the old callback + gen.sleep polling loop against awaiting
+    the fetch future directly, on a fake search backend with a seeded
+    random latency, both paths see the same latencies.
+
+    Reported per path, medians over runs: poll timers scheduled by the
+    lookups (backend timers left out), event loop iterations, p50 and
+    p99 latency (with the p99 range over runs) and total time.
+
+    Polling wakes the loop less often, completions pile up until the
+    next 2.1ms poll and resume together, that is the latency it adds.
+    Awaiting the future resumes each lookup as its response lands, more
+    loop iterations but no poll timers and no added latency.
+
+    usage: python bench/bench_search.py [requests] [concurrency] [runs]
+'''
+
+
+__author__ = 'Jean Chassoul'
+
+
+import sys
+import time
+import random
+import asyncio
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.concurrent import Future
+
+
+class FakeResponse(object):
+    '''
+        Fake http response
+    '''
+    error = None
+    code = 200
+    body = b'{"response":{"numFound":1,"docs":[{"uuid_register":"x"}]}}'
+
+
+class FakeClient(object):
+    '''
+        Fake search backend, answers after 0.5 to 3 ms
+    '''
+    timers = 0
+
+    def fetch(self, url, callback=None, **kwargs):
+        future = Future()
+        delay = random.uniform(0.0005, 0.003)
+        self.timers += 1
+
+        def done():
+            if callback:
+                callback(FakeResponse())
+            future.set_result(FakeResponse())
+        IOLoop.current().call_later(delay, done)
+        return future
+
+
+http_client = FakeClient()
+
+
+@gen.coroutine
+def polling_lookup():
+    '''
+        The old way, fire and poll
+    '''
+    got_response = []
+
+    def handle_request(response):
+        got_response.append(response)
+    http_client.fetch('fake', callback=handle_request)
+    while len(got_response) == 0:
+        yield gen.sleep(0.0021)
+    return got_response[0]
+
+
+@gen.coroutine
+def future_lookup():
+    '''
+        The new way, await the fetch future
+    '''
+    response = yield http_client.fetch('fake')
+    return response
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def count_wakeups(loop):
+    '''
+        Wrap the asyncio loop to count wakeups and scheduled timers
+    '''
+    counter = {'wakeups': 0, 'timers': 0}
+    run_once = loop._run_once
+    call_at = loop.call_at
+
+    def _run_once():
+        counter['wakeups'] += 1
+        run_once()
+
+    def _call_at(*args, **kwargs):
+        counter['timers'] += 1
+        return call_at(*args, **kwargs)
+    loop._run_once = _run_once
+    loop.call_at = _call_at
+    return counter
+
+
+def median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def run(lookup, requests, concurrency, seed):
+    random.seed(seed)
+    http_client.timers = 0
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    counter = count_wakeups(loop)
+    latencies = []
+
+    @gen.coroutine
+    def worker(n):
+        for _ in range(n):
+            start = time.perf_counter()
+            yield lookup()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    @gen.coroutine
+    def main():
+        yield [worker(requests // concurrency) for _ in range(concurrency)]
+
+    start = time.perf_counter()
+    IOLoop.current().run_sync(main)
+    elapsed = time.perf_counter() - start
+    loop.close()
+    return {
+        'wakeups': counter['wakeups'],
+        'polls': counter['timers'] - http_client.timers,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'elapsed': elapsed,
+    }
+
+
+if __name__ == '__main__':
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    results = dict((name, []) for name in ('polling', 'future'))
+    for seed in range(runs):
+        # interleaved, same seed, both paths share machine noise and latencies
+        for name, lookup in (('polling', polling_lookup), ('future', future_lookup)):
+            results[name].append(run(lookup, requests, concurrency, seed))
+    for name, stats in results.items():
+        p99 = [x['p99'] for x in stats]
+        print('{0:>8}: polls={1} loop_iterations={2} p50={3:.2f}ms '
+              'p99={4:.2f}ms ({5:.2f}-{6:.2f}) total={7:.2f}s'.format(
+                  name, median([x['polls'] for x in stats]),
+                  median([x['wakeups'] for x in stats]),
+                  median([x['p50'] for x in stats]), median(p99), min(p99), max(p99),
+                  median([x['elapsed'] for x in stats])))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+'''
+    Serialization benchmark
+
+    Per resource, compare to_primitive plus the None dropping dict
+    comprehension against the compiled single pass clean_structure,
+    and the stdlib response encoder against ujson bytes.
+
+    usage: python -m bench.bench_serialize [rounds]
+'''
+
+
+__author__ = 'Jean Chassoul'
+
+
+import sys
+import time
+from tornado.escape import json_encode
+from mango.schemas.tasks import Task
+from mango.schemas.teams import Team
+from mango.schemas.accounts import Users, Orgs
+from mango.tools import clean_structure, encode_json
+
+
+RESOURCES = (
+    ('tasks', Task, {
+        'account': 'alice', 'subject': 'write the report', 'description': 'due friday',
+        'watchers': ['bob', 'carol'], 'labels': {'kind': 'report'},
+        'start_time': 1500000000, 'deadline': 1500086400,
+    }),
+    ('teams', Team, {
+        'account': 'acme', 'status': 'active', 'name': 'ops', 'permissions': 'write',
+        'members': ['alice', 'bob'], 'created_by': 'alice',
+    }),
+    ('users', Users, {
+        'account': 'alice', 'email': 'alice@example.com', 'password': 'secret',
+        'created_by': 'example.com', 'labels': {'team': 'ops'},
+    }),
+    ('orgs', Orgs, {
+        'account': 'acme', 'email': 'ops@example.com', 'created_by': 'alice',
+        'members': ['alice', 'bob'], 'owners': ['alice'],
+    }),
+)
+
+
+def old_clean(struct):
+    struct = struct.to_primitive()
+    return {key: struct[key] for key in struct if struct[key] is not None}
+
+
+def timed(rounds, function, argument):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function(argument)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for name, model, struct in RESOURCES:
+        event = model(struct)
+        event.validate()
+        message = clean_structure(event)
+        assert message == old_clean(event)
+        clean = (timed(rounds, old_clean, event), timed(rounds, clean_structure, event))
+        encode = (timed(rounds, lambda x: json_encode(x).encode('utf-8'), message),
+                  timed(rounds, encode_json, message))
+        print('{0:>6}: clean {1:.1f}us -> {2:.1f}us ({3:.1f}x), '
+              'encode {4:.1f}us -> {5:.1f}us ({6:.1f}x)'.format(
+                  name, clean[0], clean[1], clean[0] / clean[1],
+                  encode[0], encode[1], encode[0] / encode[1]))
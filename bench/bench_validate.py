@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+'''
+    Payload validation benchmark
+
+    Per resource, compare building the schematics model, validate and
+    clean_structure against the compiled validator on the same valid
+    payload, as new_* and new_task_bulk run them.
+
+    usage: python -m bench.bench_validate [rounds]
+'''
+
+
+__author__ = 'Jean Chassoul'
+
+
+import sys
+import time
+from mango.schemas.tasks import Task, TASK_VALIDATOR
+from mango.schemas.teams import Team, TEAM_VALIDATOR
+from mango.schemas.accounts import Users, Orgs, USER_VALIDATOR, ORG_VALIDATOR
+from mango.tools import clean_structure
+
+
+RESOURCES = (
+    ('tasks', Task, TASK_VALIDATOR, {
+        'account': 'alice', 'subject': 'write the report', 'description': 'due friday',
+        'watchers': ['bob', 'carol'], 'labels': {'kind': 'report'}, 'status': 'now',
+        'start_time': 1500000000,
+    }),
+    ('teams', Team, TEAM_VALIDATOR, {
+        'account': 'acme', 'status': 'active', 'name': 'ops', 'permissions': 'write',
+        'members': ['alice', 'bob'], 'created_by': 'alice',
+    }),
+    ('users', Users, USER_VALIDATOR, {
+        'account': 'alice', 'email': 'alice@example.com', 'password': 'secret',
+        'created_by': 'example.com', 'labels': {'team': 'ops'},
+    }),
+    ('orgs', Orgs, ORG_VALIDATOR, {
+        'account': 'acme', 'email': 'ops@example.com', 'created_by': 'alice',
+        'members': ['alice', 'bob'], 'owners': ['alice'],
+    }),
+)
+
+
+def model_clean(model, struct):
+    event = model(struct)
+    event.validate()
+    return clean_structure(event)
+
+
+def timed(rounds, function):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for name, model, validator, struct in RESOURCES:
+        fast = validator.clean(struct)
+        slow = model_clean(model, struct)
+        fast.pop('uuid'), slow.pop('uuid')
+        assert fast == slow
+        before = timed(rounds, lambda: model_clean(model, struct))
+        after = timed(rounds, lambda: validator.clean(struct))
+        print('{0:>6}: {1:.1f}us -> {2:.1f}us ({3:.1f}x), {4} fast {5} slow'.format(
+            name, before, after, before / after, validator.fast, validator.slow))
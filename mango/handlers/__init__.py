@@ -7,15 +7,73 @@ __author__ = 'Jean Chassoul'
 
 
 import logging
-import ujson as json
+from collections import OrderedDict
 from tornado import gen
 from tornado import web
-from tornado import httpclient as _http_client
+from schematics.types import compound
+from schematics import types
+from mango.tools import clean_response, validate_uuid4, make_etag, encode_json
+from mango.tools.search import IGNORE_ME, SearchError
+from mango.tools.search import get_search_item, search_item
 
 
-_curl_client = 'tornado.curl_httpclient.CurlAsyncHTTPClient'
-_http_client.AsyncHTTPClient.configure(_curl_client)
-http_client = _http_client.AsyncHTTPClient()
+# preflight headers, the same for every resource
+CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'HEAD, GET, POST, PATCH, DELETE, OPTIONS'),
+    ('Access-Control-Allow-Headers', ''.join((
+        'Accept-Language,',
+        'DNT,Keep-Alive,User-Agent,X-Requested-With,',
+        'If-Modified-Since,Cache-Control,Content-Type,',
+        'Content-Range,Range,Date,Etag'))),
+    ('Content-Type', 'application/json; charset=UTF-8'),
+)
+
+# python type of the primitive every field type serializes to
+PRIMITIVES = (
+    (types.TimestampType, float),
+    (types.BooleanType, bool),
+    (types.IntType, int),
+    (types.FloatType, float),
+    (types.NumberType, int),
+    (compound.ListType, list),
+    (compound.CompoundType, dict),
+)
+
+
+def field_primitive(field):
+    for field_type, primitive in PRIMITIVES:
+        if isinstance(field, field_type):
+            return primitive
+    return str
+
+
+def resource_options(model, description, parameters=None, short=False):
+    '''
+        OPTIONS bodies of a resource, built once from its model
+
+        Returns the collection and single item payloads as bytes,
+        parameters overrides the described type of some fields.
+    '''
+    described = {}
+    for name, field in model._fields.items():
+        primitive = field_primitive(field)
+        described[name] = (primitive.__name__ if short else str(primitive))
+    described.update(parameters or {})
+    collection = {
+        'Allow': ['HEAD', 'GET', 'POST', 'PATCH', 'DELETE', 'OPTIONS'],
+        'POST': {
+            'description': description,
+            'parameters': OrderedDict(sorted(described.items(), key=lambda t: t[0])),
+        },
+    }
+    item = {
+        'Allow': ['HEAD', 'GET', 'PATCH', 'DELETE', 'OPTIONS'],
+    }
+    return {
+        'collection': encode_json(collection),
+        'item': encode_json(item),
+    }
 
 
 # This is mango's base handler all mango's other handlers are childs of this dude
@@ -34,10 +92,27 @@ class BaseHandler(web.RequestHandler):
         super(BaseHandler, self).initialize(**kwargs)
         # System database
         self.db = self.settings.get('db')
+        # Riak key-value client
+        self.kvalue = self.settings.get('kvalue')
+        # Two tier cache
+        self.cache = self.settings.get('cache')
+        # Search backend host
+        self.solr = self.settings.get('solr')
         # Page settings
         self.page_size = self.settings.get('page_size')
         # Application domain
         self.domain = self.settings.get('domain')
+        # Etag of the cached response, when there is one
+        self.etag = None
+
+    def get_username_token(self):
+        '''
+            Frontend username from the request token, False without one
+
+            There is no frontend token yet, handlers fall back on the
+            account query argument.
+        '''
+        return False
 
     def set_default_headers(self):
         '''
@@ -46,49 +121,169 @@ class BaseHandler(web.RequestHandler):
         self.set_header("Access-Control-Allow-Origin",
                         self.settings.get('domain', '*'))
 
+    def write(self, chunk):
+        '''
+            Dicts go out as ujson bytes, skipping the stdlib encoder
+        '''
+        if isinstance(chunk, dict):
+            try:
+                chunk = encode_json(chunk)
+            except (TypeError, OverflowError):
+                # not plain json, tornado knows what to do
+                return super(BaseHandler, self).write(chunk)
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        return super(BaseHandler, self).write(chunk)
+
+    def finish_options(self, options, single=False):
+        '''
+            Finish a preflight with precomputed headers and body
+        '''
+        for name, value in CORS_HEADERS:
+            self.set_header(name, value)
+        self.set_status(200)
+        self.finish(options['item'] if single else options['collection'])
+
+    def finish_tagged(self, message):
+        '''
+            Finish a GET or HEAD with a strong etag, 304 on If-None-Match
+
+            Cached responses bring their etag, the others are hashed
+            here. Errors and not found answers go out untagged.
+        '''
+        if (self.get_status() != 200 or not isinstance(message, dict)
+                or message.get('error') or message.get('message') == 'not found'):
+            self.finish(message)
+            return
+        self.set_header('Etag', self.etag or make_etag(message))
+        if self.check_etag_header():
+            # the client copy is current, skip the body entirely
+            self.set_status(304)
+            self.finish()
+            return
+        self.finish(message)
+
+    def get_query_ids(self):
+        '''
+            Valid uuid4 list of the ids query argument, None without it
+
+            Raises ValueError on invalid uuids or more than a page of them.
+        '''
+        ids = self.request.arguments.get('ids', [None])[0]
+        if not ids:
+            return None
+        ids = list(OrderedDict.fromkeys(x for x in ids.decode('utf-8').split(',') if x))
+        if not ids or len(ids) > self.page_size:
+            raise ValueError('send between 1 and {0} ids'.format(self.page_size))
+        invalid = [x for x in ids if not validate_uuid4(x)]
+        if invalid:
+            raise ValueError('invalid ids {0}'.format(','.join(invalid)))
+        return ids
+
     @gen.coroutine
-    def check_account_type(self, account):
+    def get_cached(self, prefix, uuid, fetch, visible, account, exists=None):
         '''
-            check account type
+            Read-through cache get of a single resource
+
+            Entries are keyed by uuid only, visible checks that account
+            may read a cached one, fetch applies the account itself.
+            Concurrent misses of one account share a single fetch, hot
+            keys are refreshed in the background before and after expiry
+            by readers that can see them, so the shared entry never gets
+            reloaded through another account's view.
+            Uuids the exists filter rules out and recent not found
+            answers never reach the backend. Search errors are neither
+            cached nor remembered as not found, they come back as an
+            error message, see cached_status.
+        '''
+        not_found = {'message': 'not found'}
+        resource = prefix.rstrip(':')
+        reader = (account.decode('utf-8') if isinstance(account, bytes) else account)
+        if exists is not None:
+            might_exist = yield exists.might_exist(uuid)
+            if not might_exist:
+                return not_found
+        absent = yield self.cache.is_absent(resource, uuid, reader)
+        if absent:
+            return not_found
+        key = '{0}{1}'.format(prefix, uuid)
+        try:
+            message, self.etag = yield self.cache.read_tagged(
+                key, lambda: fetch(account, uuid), make_etag,
+                keep=lambda x: bool(x) and x.get('message') != 'not found',
+                flight='{0}|{1}'.format(key, account),
+                refresh=lambda x: visible(x, account))
+        except SearchError as error:
+            logging.warning(error)
+            return {'message': 'search unavailable', 'error': str(error)}
+        if not message or message.get('message') == 'not found':
+            yield self.cache.set_absent(resource, uuid, reader)
+            return not_found
+        if not visible(message, account):
+            self.etag = None
+            return not_found
+        return message
+
+    def cached_status(self, message):
+        '''
+            Status of a get_cached answer, 502 when search failed
+        '''
+        return (502 if message.get('error') else 200)
+
+    @gen.coroutine
+    def get_batch(self, prefix, fetch, visible, account, ids):
+        '''
+            Get resources by id, cache first, misses in one backend call
+        '''
+        cached = yield self.cache.get_multi(ids, key_prefix=prefix)
+        cached = dict(
+            (key, value) for key, value in cached.items() if visible(value, account))
+        missing = [x for x in ids if x not in cached]
+        found = {}
+        if missing:
+            settling = yield self.cache.settling(missing, key_prefix=prefix)
+            found = yield fetch(account, missing)
+            fresh = dict((k, v) for k, v in found.items() if k not in settling)
+            recent = dict((k, v) for k, v in found.items() if k in settling)
+            # the search index may still hold the copies of before a write
+            yield [self.cache.set_multi(fresh, key_prefix=prefix),
+                   self.cache.set_multi(recent, self.cache.settle_ttl, key_prefix=prefix)]
+        results = []
+        for key in ids:
+            stuff = cached.get(key, found.get(key))
+            if stuff is not None:
+                results.append(stuff)
+        return {
+            'count': len(results),
+            'results': results,
+            'missing': [x for x in ids if x not in cached and x not in found],
+        }
+
+    @gen.coroutine
+    def get_account_doc(self, query, filter_query):
+        '''
+            Get account document from the search index
         '''
         search_index = 'mango_account_index'
-        query = 'account_register:{0}'.format(account.decode('utf-8'))
-        filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
         # format and build url
-        url = "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}".format(
-            self.solr, search_index, query, filter_query
-        )
-        got_response = []
+        url = get_search_item(self.solr, search_index, query, filter_query)
         # response message
-        message = {'message': 'not found'}
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
+        message = {}
         try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            stuff = got_response[0]
-            if stuff['response']['numFound']:
-                response_doc = stuff['response']['docs'][0]
-                IGNORE_ME = ["_yz_id","_yz_rk","_yz_rt","_yz_rb"]
-                message = dict(
-                    (key.split('_register')[0], value)
-                    for (key, value) in response_doc.items()
-                    if key not in IGNORE_ME
-                )
-        except Exception as error:
+            response_doc = yield search_item(url)
+            if response_doc:
+                message = clean_response(response_doc, IGNORE_ME)
+        except SearchError as error:
             logging.warning(error)
+        return message
+
+    @gen.coroutine
+    def check_account_type(self, account):
+        '''
+            check account type
+        '''
+        query = 'account_register:{0}'.format(account.decode('utf-8'))
+        filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
+        message = yield self.get_account_doc(query, filter_query)
         return message.get('account_type', 'not found')
 
     @gen.coroutine
@@ -96,42 +291,9 @@ class BaseHandler(web.RequestHandler):
         '''
             Get valid account uuid
         '''
-        search_index = 'mango_account_index'
         query = 'account_register:{0}'.format(account.decode('utf-8'))
         filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
-        # parse and build url
-        url = get_search_item(self.solr, search_index, query, filter_query)
-        got_response = []
-        # clean response message
-        message = {}
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
-        try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            stuff = got_response[0]
-            if stuff['response']['numFound']:
-                response_doc = stuff['response']['docs'][0]
-                IGNORE_ME = ["_yz_id","_yz_rk","_yz_rt","_yz_rb"]
-                message = dict(
-                    (key.split('_register')[0], value)
-                    for (key, value) in response_doc.items()
-                    if key not in IGNORE_ME
-                )
-        except Exception as error:
-            logging.warning(error)
+        message = yield self.get_account_doc(query, filter_query)
         return message.get('uuid', 'not found')
 
     @gen.coroutine
@@ -139,44 +301,9 @@ class BaseHandler(web.RequestHandler):
         '''
             Get valid account uuid
         '''
-        search_index = 'mango_account_index'
-        query = 'password_register:{0}'.format(password.decode('utf-8'))
-        filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
-        # parse and build url
-        url = "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}".format(
-            self.solr, search_index, query, filter_query
-        ).replace(' ', '')
-        got_response = []
-        # clean response message
-        message = {}
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
-        try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            stuff = got_response[0]
-            if stuff['response']['numFound']:
-                response_doc = stuff['response']['docs'][0]
-                IGNORE_ME = ["_yz_id","_yz_rk","_yz_rt","_yz_rb"]
-                message = dict(
-                    (key.split('_register')[0], value)
-                    for (key, value) in response_doc.items()
-                    if key not in IGNORE_ME
-                )
-        except Exception as error:
-            logging.warning(error)
+        query = 'password_register:{0}'.format(password.decode('utf-8')).replace(' ', '')
+        filter_query = 'account_register:{0}'.format(account.decode('utf-8')).replace(' ', '')
+        message = yield self.get_account_doc(query, filter_query)
         return message.get('uuid', 'not found')
 
     @gen.coroutine
@@ -184,42 +311,7 @@ class BaseHandler(web.RequestHandler):
         '''
             Get account labels
         '''
-        search_index = 'mango_account_index'
         query = 'account_register:{0}'.format(account)
         filter_query = 'account_register:{0}'.format(account)
-        # parse and build url
-        url = "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}".format(
-            self.solr, search_index, query, filter_query
-        )
-        got_response = []
-        # response message
-        message = {}
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
-        try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            stuff = got_response[0]
-            if stuff['response']['numFound']:
-                response_doc = stuff['response']['docs'][0]
-                IGNORE_ME = ["_yz_id","_yz_rk","_yz_rt","_yz_rb"]
-                message = dict(
-                    (key.split('_register')[0], value)
-                    for (key, value) in response_doc.items()
-                    if key not in IGNORE_ME
-                )
-        except Exception as error:
-            logging.warning(error)
+        message = yield self.get_account_doc(query, filter_query)
         return message.get('labels', [])
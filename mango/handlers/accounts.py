@@ -10,9 +10,23 @@ import logging
 from tornado import gen
 from mango.schemas import accounts as models
 from mango.system import accounts
-from mango.tools import str2bool, check_json
-from mango.handlers import BaseHandler
-from collections import OrderedDict
+from mango.system.accounts import user_visible
+from mango.tools import str2bool, check_json, owned_by, validate_uuid4
+from mango.tools.exists import filters
+from mango.handlers import BaseHandler, resource_options
+
+
+# OPTIONS payloads, computed once at import
+USER_OPTIONS = resource_options(models.Users, 'Create a new user account', {
+    'labels': 'list/object',
+    'orgs': 'list/object',
+    'teams': 'list/object',
+}, short=True)
+ORG_OPTIONS = resource_options(models.Orgs, 'Create (ORG)', {
+    'labels': 'array/string',
+    'members': 'array/string',
+    'teams': 'array/kv/string',
+})
 
 
 class UsersHandler(accounts.Accounts, BaseHandler):
@@ -33,7 +47,8 @@ class UsersHandler(accounts.Accounts, BaseHandler):
         '''
         # request query arguments
         query_args = self.request.arguments
-        username = False  # TODO: get the username from a front-end token!
+        # get the current frontend username from token
+        username = self.get_username_token()
         # if the user don't provide an account use the username as last resort
         account = (query_args.get('account', [username])[0]
                    if not account else account)
@@ -42,6 +57,8 @@ class UsersHandler(accounts.Accounts, BaseHandler):
         logging.info('Why? what are u checking? {0}'.format(checked))
         # getting pagination ready
         page_num = int(query_args.get('page', [page_num])[0])
+        # opaque cursor for deep pagination
+        cursor = query_args.get('cursor', [None])[0]
         # rage against the state machine
         status = 'all'  # TODO: Why 'all' ?
         # init message on error
@@ -56,14 +73,17 @@ class UsersHandler(accounts.Accounts, BaseHandler):
                                                end,
                                                lapse,
                                                status,
-                                               page_num)
+                                               page_num,
+                                               cursor=cursor)
             self.set_status(200)
         else:
             user_uuid = user_uuid.rstrip('/')
-            message = yield self.get_user(account, user_uuid)
-            self.set_status(200)
+            # read-through cache, backend only on a miss
+            message = yield self.get_cached('users:', user_uuid, self.get_user,
+                                            user_visible, account)
+            self.set_status(self.cached_status(message))
         # so long and thanks for all the fish
-        self.finish(message)
+        self.finish_tagged(message)
 
     @gen.coroutine
     def get(self,
@@ -78,7 +98,8 @@ class UsersHandler(accounts.Accounts, BaseHandler):
         '''
         # request query arguments
         query_args = self.request.arguments
-        username = False  # TODO: get the username from a front-end token!
+        # get the current frontend username from token
+        username = self.get_username_token()
         # if the user don't provide an account use the username as last resort
         account = (query_args.get('account', [username])[0]
                    if not account else account)
@@ -87,6 +108,15 @@ class UsersHandler(accounts.Accounts, BaseHandler):
         logging.info('Why? what are u checking? {0}'.format(checked))
         # getting pagination ready
         page_num = int(query_args.get('page', [page_num])[0])
+        # opaque cursor for deep pagination
+        cursor = query_args.get('cursor', [None])[0]
+        # batch of ids, one backend call for the cache misses
+        try:
+            ids = self.get_query_ids()
+        except ValueError as error:
+            self.set_status(400)
+            self.finish({'message': str(error)})
+            return
         # rage against the state machine
         status = 'all'  # TODO: Why 'all' ?
         # init message on error
@@ -94,21 +124,28 @@ class UsersHandler(accounts.Accounts, BaseHandler):
         # init status that match with our message
         self.set_status(400)
         # check if we're list processing
-        if not user_uuid:
+        if not user_uuid and ids:
+            message = yield self.get_batch('users:', self.get_user_batch,
+                                          user_visible, account, ids)
+            self.set_status(200)
+        elif not user_uuid:
             # TODO: missing account, start, end, lapse and status support!
             message = yield self.get_user_list(account,
                                                start,
                                                end,
                                                lapse,
                                                status,
-                                               page_num)
+                                               page_num,
+                                               cursor=cursor)
             self.set_status(200)
         else:
             user_uuid = user_uuid.rstrip('/')
-            message = yield self.get_user(account, user_uuid)
-            self.set_status(200)
+            # read-through cache, backend only on a miss
+            message = yield self.get_cached('users:', user_uuid, self.get_user,
+                                            user_visible, account)
+            self.set_status(self.cached_status(message))
         # so long and thanks for all the fish
-        self.finish(message)
+        self.finish_tagged(message)
 
     @gen.coroutine
     def post(self):
@@ -169,58 +206,11 @@ class UsersHandler(accounts.Accounts, BaseHandler):
         self.set_status(204)
         self.finish()
 
-    @gen.coroutine
     def options(self, user_uuid=None):
         '''
             Resource options
         '''
-        self.set_header('Access-Control-Allow-Origin', '*')
-        self.set_header('Access-Control-Allow-Methods',
-                        'HEAD, GET, POST, PATCH, DELETE, OPTIONS')
-        self.set_header('Access-Control-Allow-Headers',
-                        ''.join(
-                            ('Accept-Language,',
-                             'DNT,Keep-Alive,User-Agent,X-Requested-With,',
-                             'If-Modified-Since,Cache-Control,Content-Type,',
-                             'Content-Range,Range,Date,Etag')))
-        # allowed http methods
-        message = {
-            'Allow': ['HEAD', 'GET', 'POST', 'PATCH', 'DELETE', 'OPTIONS']
-        }
-        # resource parameters
-        parameters = {}
-        # mock your stuff
-        stuff = False
-        while not stuff:
-            try:
-                stuff = models.Users.get_mock_object().to_primitive()
-            except Exception as error:
-                logging.warning(error)
-                pass
-        for k, v in stuff.items():
-            if v is None:
-                parameters[k] = str(type('none'))[1:-1].split(' ')[1][1:-1]
-            else:
-                parameters[k] = str(type(v))[1:-1].split(' ')[1][1:-1]
-        # after automatic madness return description and parameters
-        parameters['labels'] = 'list/object'
-        parameters['orgs'] = 'list/object'
-        parameters['teams'] = 'list/object'
-        # end of manual cleaning
-        POST = {
-            "description": "Create a new user account",
-            "parameters": OrderedDict(
-                sorted(parameters.items(), key=lambda t: t[0]))
-        }
-        # filter single resource
-        if not user_uuid:
-            message['POST'] = POST
-        else:
-            message['Allow'].remove('POST')
-            message['Allow'].append('PATCH')
-            message['Allow'].append('DELETE')
-        self.set_status(200)
-        self.finish(message)
+        self.finish_options(USER_OPTIONS, single=bool(user_uuid))
 
 
 class OrgsHandler(accounts.Accounts, BaseHandler):
@@ -249,6 +239,8 @@ class OrgsHandler(accounts.Accounts, BaseHandler):
         checked = str2bool(str(query_args.get('checked', [False])[0]))
         # getting pagination ready
         page_num = int(query_args.get('page', [page_num])[0])
+        # opaque cursor for deep pagination
+        cursor = query_args.get('cursor', [None])[0]
         # rage against the finite state machine
         status = 'all'
         # init message on error
@@ -257,29 +249,26 @@ class OrgsHandler(accounts.Accounts, BaseHandler):
         self.set_status(400)
         # check if we're list processing
         if not org_uuid:
-            message = yield self.get_account_list(account,
-                                                  start,
-                                                  end,
-                                                  lapse,
-                                                  status,
-                                                  page_num)
+            message = yield self.get_org_list(account,
+                                              start,
+                                              end,
+                                              lapse,
+                                              status,
+                                              page_num,
+                                              cursor=cursor)
             self.set_status(200)
+        # malformed uuid, rejected before any lookup
+        elif not validate_uuid4(org_uuid.rstrip('/')):
+            message = {'message': 'invalid uuid'}
         # single org received
         else:
-            # first try to get stuff from cache
             org_uuid = org_uuid.rstrip('/')
-            # get cache data
-            message = self.cache.get('orgs:{0}'.format(org_uuid))
-            if message is not None:
-                logging.info('orgs:{0} done retrieving!'.format(org_uuid))
-                self.set_status(200)
-            else:
-                message = yield self.get_account(account, org_uuid)
-                if self.cache.add('orgs:{0}'.format(org_uuid), message, 1):
-                    logging.info('new cache entry {0}'.format(str(org_uuid)))
-                    self.set_status(200)
+            # read-through cache, backend only on a miss
+            message = yield self.get_cached('orgs:', org_uuid, self.get_org,
+                                            owned_by, account, filters['orgs'])
+            self.set_status(self.cached_status(message))
         # so long and thanks for all the fish
-        self.finish(message)
+        self.finish_tagged(message)
 
     @gen.coroutine
     def get(self,
@@ -302,6 +291,15 @@ class OrgsHandler(accounts.Accounts, BaseHandler):
         checked = str2bool(str(query_args.get('checked', [False])[0]))
         # getting pagination ready
         page_num = int(query_args.get('page', [page_num])[0])
+        # opaque cursor for deep pagination
+        cursor = query_args.get('cursor', [None])[0]
+        # batch of ids, one backend call for the cache misses
+        try:
+            ids = self.get_query_ids()
+        except ValueError as error:
+            self.set_status(400)
+            self.finish({'message': str(error)})
+            return
         # rage against the finite state machine
         status = 'all'
         # init message on error
@@ -309,30 +307,31 @@ class OrgsHandler(accounts.Accounts, BaseHandler):
         # init status that match with our message
         self.set_status(400)
         # check if we're list processing
-        if not org_uuid:
+        if not org_uuid and ids:
+            message = yield self.get_batch('orgs:', self.get_org_batch,
+                                          owned_by, account, ids)
+            self.set_status(200)
+        elif not org_uuid:
             message = yield self.get_org_list(account,
                                               start,
                                               end,
                                               lapse,
                                               status,
-                                              page_num)
+                                              page_num,
+                                              cursor=cursor)
             self.set_status(200)
+        # malformed uuid, rejected before any lookup
+        elif not validate_uuid4(org_uuid.rstrip('/')):
+            message = {'message': 'invalid uuid'}
         # single org received
         else:
-            # first try to get stuff from cache
             org_uuid = org_uuid.rstrip('/')
-            # get cache data
-            message = self.cache.get('orgs:{0}'.format(org_uuid))
-            if message is not None:
-                logging.info('cache orgs:{0} done retrieving!'.format(org_uuid))
-                self.set_status(200)
-            else:
-                message = yield self.get_org(account, org_uuid)
-                if self.cache.add('orgs:{0}'.format(org_uuid), message, 1):
-                    logging.info('new cache entry {0}'.format(str(org_uuid)))
-                    self.set_status(200)
+            # read-through cache, backend only on a miss
+            message = yield self.get_cached('orgs:', org_uuid, self.get_org,
+                                            owned_by, account, filters['orgs'])
+            self.set_status(self.cached_status(message))
         # so long and thanks for all the fish
-        self.finish(message)
+        self.finish_tagged(message)
 
     @gen.coroutine
     def post(self):
@@ -389,10 +388,8 @@ class OrgsHandler(accounts.Accounts, BaseHandler):
         # remove query string flag
         remove = self.request.arguments.get('remove', False)
         if not remove :
-            result = self.cache.delete('org:{0}'.format(org_uuid))
             result = yield self.modify_account(account, org_uuid, struct)
         else:
-            result = self.cache.delete('org:{0}'.format(org_uuid))
             result = yield self.modify_remove(account, org_uuid, struct)
         if not result:
             self.set_status(400)
@@ -420,50 +417,8 @@ class OrgsHandler(accounts.Accounts, BaseHandler):
         self.set_status(204)
         self.finish()
 
-    @gen.coroutine
     def options(self, org_uuid=None):
         '''
             Resource options
         '''
-        self.set_header('Access-Control-Allow-Origin', '*')
-        self.set_header('Access-Control-Allow-Methods', 'HEAD, GET, POST, PATCH, DELETE, OPTIONS')
-        self.set_header('Access-Control-Allow-Headers', ''.join(('Accept-Language,',
-                        'DNT,Keep-Alive,User-Agent,X-Requested-With,',
-                        'If-Modified-Since,Cache-Control,Content-Type,',
-                        'Content-Range,Range,Date,Etag')))
-        # allowed http methods
-        message = {
-            'Allow': ['HEAD', 'GET', 'POST', 'PATCH', 'DELETE', 'OPTIONS']
-        }
-        # resource parameters
-        parameters = {}
-        # mock your stuff
-        stuff = False
-        while not stuff:
-            try:
-                stuff = models.Org.get_mock_object().to_primitive()
-            except Exception as error:
-                pass
-        for k, v in stuff.items():
-            if v is None:
-                parameters[k] = str(type('none'))
-            else:
-                parameters[k] = str(type(v))
-        # after automatic madness return description and parameters
-        parameters['labels'] = 'array/string'
-        parameters['members'] = 'array/string'
-        parameters['teams'] = 'array/kv/string'
-        # end of manual cleaning
-        POST = {
-            "description": "Create (ORG)",
-            "parameters": OrderedDict(sorted(parameters.items(), key=lambda t: t[0]))
-        }
-        # filter single resource
-        if not org_uuid:
-            message['POST'] = POST
-        else:
-            message['Allow'].remove('POST')
-            message['Allow'].append('PATCH')
-            message['Allow'].append('DELETE')
-        self.set_status(200)
-        self.finish(message)
+        self.finish_options(ORG_OPTIONS, single=bool(org_uuid))
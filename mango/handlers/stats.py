@@ -0,0 +1,39 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+from tornado import gen
+from mango.tools import storage
+from mango.tools.http import http_client
+from mango.tools.cache import cache
+from mango.tools.exists import filters
+from mango.tools.metrics import loop_lag
+from mango.handlers import BaseHandler
+
+
+class Handler(BaseHandler):
+    '''
+        System stats handler
+    '''
+
+    @gen.coroutine
+    def get(self):
+        '''
+            Get system stats
+        '''
+        message = {
+            'http': http_client.stats(),
+            'storage': storage.stats(),
+            'loop_lag': loop_lag.stats(),
+            'cache': cache.stats(),
+            'exists': dict((name, x.stats()) for name, x in filters.items()),
+        }
+        node_health = self.settings.get('node_health')
+        if node_health:
+            message['riak'] = node_health.stats()
+        self.set_status(200)
+        self.finish(message)
@@ -12,13 +12,20 @@ __author__ = 'Team Machine'
 import uuid
 import logging
 import ujson as json
+from collections import OrderedDict
 from tornado import gen
 from tornado import web
 from mango.schemas import tasks as models
 from mango.system import tasks
-from mango.tools import str2bool, check_json
-from mango.handlers import BaseHandler
-from collections import OrderedDict
+from mango.system.tasks import task_visible
+from mango.tools import str2bool, check_json, check_bulk, validate_uuid4
+from mango.tools.search import SearchError
+from mango.tools.exists import filters
+from mango.handlers import BaseHandler, resource_options
+
+
+# OPTIONS payloads, computed once at import
+TASK_OPTIONS = resource_options(models.Task, 'Create task', {'labels': 'array/string'})
 
 
 class Handler(tasks.Tasks, BaseHandler):
@@ -47,6 +54,8 @@ class Handler(tasks.Tasks, BaseHandler):
         checked = str2bool(str(query_args.get('checked', [False])[0]))
         # getting pagination ready
         page_num = int(query_args.get('page', [page_num])[0])
+        # opaque cursor for deep pagination
+        cursor = query_args.get('cursor', [None])[0]
         # rage against the finite state machine
         status = 'all'
         # init message on error
@@ -60,24 +69,21 @@ class Handler(tasks.Tasks, BaseHandler):
                                                end,
                                                lapse,
                                                status,
-                                               page_num)
+                                               page_num,
+                                               cursor=cursor)
             self.set_status(200)
+        # malformed uuid, rejected before any lookup
+        elif not validate_uuid4(task_uuid.rstrip('/')):
+            message = {'message': 'invalid uuid'}
         # single task received
         else:
-            # first try to get stuff from cache
             task_uuid = task_uuid.rstrip('/')
-            # get cache data
-            message = self.cache.get('tasks:{0}'.format(task_uuid))
-            if message is not None:
-                logging.info('tasks:{0} done retrieving!'.format(task_uuid))
-                self.set_status(200)
-            else:
-                message = yield self.get_task(account, task_uuid)
-                if self.cache.add('tasks:{0}'.format(task_uuid), message, 1):
-                    logging.info('new cache entry {0}'.format(str(task_uuid)))
-                    self.set_status(200)
+            # read-through cache, backend only on a miss
+            message = yield self.get_cached('tasks:', task_uuid, self.get_task,
+                                            task_visible, account, filters['tasks'])
+            self.set_status(self.cached_status(message))
         # so long and thanks for all the fish
-        self.finish(message)
+        self.finish_tagged(message)
 
     @gen.coroutine
     def get(self,
@@ -100,9 +106,18 @@ class Handler(tasks.Tasks, BaseHandler):
         checked = str2bool(str(query_args.get('checked', [False])[0]))
         # getting pagination ready
         page_num = int(query_args.get('page', [page_num])[0])
-
-        search = (query_args.get('search', [search])[0] if not search else search)
-        
+        # opaque cursor for deep pagination
+        cursor = query_args.get('cursor', [None])[0]
+        # batch of ids, one backend call for the cache misses
+        try:
+            ids = self.get_query_ids()
+        except ValueError as error:
+            self.set_status(400)
+            self.finish({'message': str(error)})
+            return
+        # quick search terms and the fields it returns
+        search = query_args.get('search', [None])[0]
+        fields = query_args.get('fields', [None])[0]
         # rage against the finite state machine
         status = 'all'
         # init message on error
@@ -110,7 +125,11 @@ class Handler(tasks.Tasks, BaseHandler):
         # init status that match with our message
         self.set_status(400)
         # check if we're list processing
-        if not task_uuid and search:
+        if not task_uuid and ids:
+            message = yield self.get_batch('tasks:', self.get_task_batch,
+                                          task_visible, account, ids)
+            self.set_status(200)
+        elif not task_uuid and search:
             message = yield self.quick_search(account, start, end, lapse, status, page_num, fields, search)
             self.set_status(200)
         elif not task_uuid:
@@ -119,24 +138,21 @@ class Handler(tasks.Tasks, BaseHandler):
                                                end,
                                                lapse,
                                                status,
-                                               page_num)
+                                               page_num,
+                                               cursor=cursor)
             self.set_status(200)
+        # malformed uuid, rejected before any lookup
+        elif not validate_uuid4(task_uuid.rstrip('/')):
+            message = {'message': 'invalid uuid'}
         # single task received
         else:
-            # first try to get stuff from cache
             task_uuid = task_uuid.rstrip('/')
-            # get cache data
-            message = self.cache.get('tasks:{0}'.format(task_uuid))
-            if message is not None:
-                logging.info('tasks:{0} done retrieving!'.format(task_uuid))
-                self.set_status(200)
-            else:
-                message = yield self.get_task(account, task_uuid)
-                if self.cache.add('tasks:{0}'.format(task_uuid), message, 1):
-                    logging.info('new cache entry {0}'.format(str(task_uuid)))
-                    self.set_status(200)
+            # read-through cache, backend only on a miss
+            message = yield self.get_cached('tasks:', task_uuid, self.get_task,
+                                            task_visible, account, filters['tasks'])
+            self.set_status(self.cached_status(message))
         # so long and thanks for all the fish
-        self.finish(message)
+        self.finish_tagged(message)
 
     @gen.coroutine
     def post(self):
@@ -220,43 +236,115 @@ class Handler(tasks.Tasks, BaseHandler):
         self.set_status(204)
         self.finish()
 
-    @gen.coroutine
     def options(self, task_uuid=None):
         '''
             Resource options
         '''
-        self.set_header('Access-Control-Allow-Origin', '*')
-        self.set_header('Access-Control-Allow-Methods', 'HEAD, GET, POST, PATCH, DELETE, OPTIONS')
-        self.set_header('Access-Control-Allow-Headers', ''.join(('Accept-Language,',
-                        'DNT,Keep-Alive,User-Agent,X-Requested-With,',
-                        'If-Modified-Since,Cache-Control,Content-Type,',
-                        'Content-Range,Range,Date,Etag')))
-        # allowed http methods
+        self.finish_options(TASK_OPTIONS, single=bool(task_uuid))
+
+
+class BulkHandler(tasks.Tasks, BaseHandler):
+    '''
+        HTTP bulk request handlers
+    '''
+
+    @gen.coroutine
+    def post(self):
+        '''
+            Create tasks in bulk, JSON array or NDJSON body
+        '''
+        try:
+            structs = yield check_bulk(self.request.body)
+        except ValueError as error:
+            self.set_status(400)
+            self.finish({'JSON': False, 'message': str(error)})
+            return
+        max_items = self.settings.get('bulk_max_items', 5000)
+        if not structs or len(structs) > max_items:
+            self.set_status(400 if not structs else 413)
+            self.finish({'message': 'send between 1 and {0} tasks'.format(max_items)})
+            return
+        results = yield self.new_task_bulk(structs)
+        created = sum(1 for x in results if x['status'] == 201)
         message = {
-            'Allow': ['HEAD', 'GET', 'POST', 'PATCH', 'DELETE', 'OPTIONS']
+            'count': len(results),
+            'created': created,
+            'results': results,
         }
-        # resource parameters
-        parameters = {}
-        # mock your stuff
-        stuff = models.Task.get_mock_object().to_primitive()
-        for k, v in stuff.items():
-            if v is None:
-                parameters[k] = str(type('none'))
-            else:
-                parameters[k] = str(type(v))
-        # after automatic madness return description and parameters
-        parameters['labels'] = 'array/string'
-        # end of manual cleaning
-        POST = {
-            "description": "Create task",
-            "parameters": OrderedDict(sorted(parameters.items(), key=lambda t: t[0]))
+        if created == len(results):
+            self.set_status(201)
+        elif created:
+            # some of them made it, check every result
+            self.set_status(207)
+        else:
+            statuses = set(x['status'] for x in results)
+            self.set_status(statuses.pop() if len(statuses) == 1 else 500)
+        self.finish(message)
+
+    @gen.coroutine
+    def patch(self):
+        '''
+            Modify tasks in bulk
+
+            Body: {"uuids": [...]} or {"query": "status_register:new"},
+            plus the "changes" to apply, ?remove=1 removes list values.
+        '''
+        try:
+            struct = yield check_json(self.request.body)
+        except ValueError:
+            struct = None
+        if not isinstance(struct, dict) or not isinstance(struct.get('changes'), dict):
+            self.set_status(400)
+            self.finish({'JSON': False, 'message': 'changes required'})
+            return
+        account = self.request.arguments.get('account', [None])[0]
+        if not account:
+            # if not account we try to get the account from struct
+            account = struct.get('account', None)
+        if isinstance(account, bytes):
+            account = account.decode('utf-8')
+        uuids = struct.get('uuids')
+        query = struct.get('query')
+        max_items = self.settings.get('bulk_max_items', 5000)
+        if not account or bool(uuids) == bool(query):
+            self.set_status(400)
+            self.finish({'message': 'account and one of uuids or query required'})
+            return
+        if uuids and (not isinstance(uuids, list) or len(uuids) > max_items or
+                      not all(isinstance(x, str) and validate_uuid4(x) for x in uuids)):
+            too_many = isinstance(uuids, list) and len(uuids) > max_items
+            self.set_status(413 if too_many else 400)
+            self.finish({'message': 'send between 1 and {0} valid uuids'.format(max_items)})
+            return
+        if uuids:
+            # one update per task, repeated uuids would race on the same key
+            uuids = list(OrderedDict.fromkeys(uuids))
+        # remove query string flag
+        remove = self.request.arguments.get('remove', False)
+        try:
+            results = yield self.modify_task_bulk(account, struct['changes'],
+                                                  uuids=uuids, query=query,
+                                                  remove=remove)
+        except (ValueError, TypeError) as error:
+            self.set_status(400)
+            self.finish({'message': str(error)})
+            return
+        except SearchError as error:
+            self.set_status(502)
+            self.finish({'message': str(error)})
+            return
+        updated = sum(1 for x in results if x['status'] == 200)
+        message = {
+            'count': len(results),
+            'updated': updated,
+            'results': results,
         }
-        # filter single resource
-        if not task_uuid:
-            message['POST'] = POST
+        if updated == len(results):
+            self.set_status(200)
+        elif updated:
+            # some of them made it, check every result
+            self.set_status(207)
         else:
-            message['Allow'].remove('POST')
-            message['Allow'].append('PATCH')
-            message['Allow'].append('DELETE')
-        self.set_status(200)
+            statuses = set(x['status'] for x in results)
+            self.set_status(statuses.pop() if len(statuses) == 1 else 500)
         self.finish(message)
@@ -16,9 +16,12 @@ from tornado import gen
 from tornado import web
 from mango.schemas import teams as models
 from mango.system import teams
-from mango.tools import str2bool, check_json
-from mango.handlers import BaseHandler
-from collections import OrderedDict
+from mango.tools import str2bool, check_json, owned_by
+from mango.handlers import BaseHandler, resource_options
+
+
+# OPTIONS payloads, computed once at import
+TEAM_OPTIONS = resource_options(models.Team, 'Create team', {'labels': 'array/string'})
 
 
 class Handler(teams.Teams, BaseHandler):
@@ -48,6 +51,8 @@ class Handler(teams.Teams, BaseHandler):
         checked = str2bool(str(query_args.get('checked', [False])[0]))
         # getting pagination ready
         page_num = int(query_args.get('page', [page_num])[0])
+        # opaque cursor for deep pagination
+        cursor = query_args.get('cursor', [None])[0]
         # rage against the finite state machine
         status = 'all'
         # init message on error
@@ -61,24 +66,18 @@ class Handler(teams.Teams, BaseHandler):
                                                end,
                                                lapse,
                                                status,
-                                               page_num)
+                                               page_num,
+                                               cursor=cursor)
             self.set_status(200)
         # single team received
         else:
-            # first try to get stuff from cache
             team_uuid = team_uuid.rstrip('/')
-            # get cache data
-            message = self.cache.get('teams:{0}'.format(team_uuid))
-            if message is not None:
-                logging.info('teams:{0} done retrieving!'.format(team_uuid))
-                self.set_status(200)
-            else:
-                message = yield self.get_team(account, team_uuid)
-                if self.cache.add('teams:{0}'.format(team_uuid), message, 1):
-                    logging.info('new cache entry {0}'.format(str(team_uuid)))
-                    self.set_status(200)
+            # read-through cache, backend only on a miss
+            message = yield self.get_cached('teams:', team_uuid, self.get_team,
+                                            owned_by, account)
+            self.set_status(self.cached_status(message))
         # so long and thanks for all the fish
-        self.finish(message)
+        self.finish_tagged(message)
 
     @gen.coroutine
     def get(self,
@@ -102,6 +101,15 @@ class Handler(teams.Teams, BaseHandler):
         checked = str2bool(str(query_args.get('checked', [False])[0]))
         # getting pagination ready
         page_num = int(query_args.get('page', [page_num])[0])
+        # opaque cursor for deep pagination
+        cursor = query_args.get('cursor', [None])[0]
+        # batch of ids, one backend call for the cache misses
+        try:
+            ids = self.get_query_ids()
+        except ValueError as error:
+            self.set_status(400)
+            self.finish({'message': str(error)})
+            return
         # rage against the finite state machine
         status = 'all'
         # init message on error
@@ -109,30 +117,28 @@ class Handler(teams.Teams, BaseHandler):
         # init status that match with our message
         self.set_status(400)
         # check if we're list processing
-        if not team_uuid:
+        if not team_uuid and ids:
+            message = yield self.get_batch('teams:', self.get_team_batch,
+                                          owned_by, account, ids)
+            self.set_status(200)
+        elif not team_uuid:
             message = yield self.get_team_list(account,
                                                start,
                                                end,
                                                lapse,
                                                status,
-                                               page_num)
+                                               page_num,
+                                               cursor=cursor)
             self.set_status(200)
         # single team received
         elif team_uuid:
-            # first try to get stuff from cache
             team_uuid = team_uuid.rstrip('/')
-            # get cache data
-            message = self.cache.get('teams:{0}'.format(team_uuid))
-            if message is not None:
-                logging.info('teams:{0} done retrieving!'.format(team_uuid))
-                self.set_status(200)
-            else:
-                message = yield self.get_team(account, team_uuid)
-                if self.cache.add('teams:{0}'.format(team_uuid), message, 1):
-                    logging.info('new cache entry {0}'.format(str(team_uuid)))
-                    self.set_status(200)
+            # read-through cache, backend only on a miss
+            message = yield self.get_cached('teams:', team_uuid, self.get_team,
+                                            owned_by, account)
+            self.set_status(self.cached_status(message))
         # so long and thanks for all the fish
-        self.finish(message)
+        self.finish_tagged(message)
 
     @gen.coroutine
     def post(self, org_uuid):
@@ -229,43 +235,8 @@ class Handler(teams.Teams, BaseHandler):
         self.set_status(204)
         self.finish()
 
-    @gen.coroutine
     def options(self, org_uuid=None, team_uuid=None):
         '''
             Resource options
         '''
-        self.set_header('Access-Control-Allow-Origin', '*')
-        self.set_header('Access-Control-Allow-Methods', 'HEAD, GET, POST, PATCH, DELETE, OPTIONS')
-        self.set_header('Access-Control-Allow-Headers', ''.join(('Accept-Language,',
-                        'DNT,Keep-Alive,User-Agent,X-Requested-With,',
-                        'If-Modified-Since,Cache-Control,Content-Type,',
-                        'Content-Range,Range,Date,Etag')))
-        # allowed http methods
-        message = {
-            'Allow': ['HEAD', 'GET', 'POST', 'PATCH', 'DELETE', 'OPTIONS']
-        }
-        # resource parameters
-        parameters = {}
-        # mock your stuff
-        stuff = models.Team.get_mock_object().to_primitive()
-        for k, v in stuff.items():
-            if v is None:
-                parameters[k] = str(type('none'))
-            else:
-                parameters[k] = str(type(v))
-        # after automatic madness return description and parameters
-        parameters['labels'] = 'array/string'
-        # end of manual cleaning
-        POST = {
-            "description": "Create team",
-            "parameters": OrderedDict(sorted(parameters.items(), key=lambda t: t[0]))
-        }
-        # filter single resource
-        if not team_uuid:
-            message['POST'] = POST
-        else:
-            message['Allow'].remove('POST')
-            message['Allow'].append('PATCH')
-            message['Allow'].append('DELETE')
-        self.set_status(200)
-        self.finish(message)
+        self.finish_options(TEAM_OPTIONS, single=bool(team_uuid))
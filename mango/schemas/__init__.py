@@ -7,9 +7,12 @@ __author__ = 'Jean Chassoul'
 
 
 import arrow
+import ujson as json
+from riak.datatypes import Map
 from schematics import models
 from schematics import types
 from schematics.types import compound
+from mango.tools.buckets import get_bucket
 
 
 class Email(models.Model):
@@ -67,3 +70,50 @@ class BaseResult(models.Model):
     count = types.IntType()
     page = types.IntType()
     results = compound.ListType(types.StringType())
+
+
+class BaseMap(object):
+    '''
+        Riak map wrapper over a fetched snapshot
+
+        Reads come from the last stored or fetched state of the map,
+        nothing is fetched behind your back, call refresh() for that.
+        Subclasses set the MapCodec of their schema.
+    '''
+    codec = None
+
+    def __init__(
+        self,
+        client,
+        bucket_name,
+        bucket_type,
+        search_index,
+        struct,
+        snapshot=True
+    ):
+        # search_index binding is verified once at startup
+        bucket = get_bucket(client, bucket_type, bucket_name)
+        self.map = self.codec.encode(Map(bucket, None), struct)
+        # store returns the body, our first snapshot, unless asked not to
+        self.map.store(return_body=snapshot)
+
+    def refresh(self):
+        '''
+            Fetch the map again
+        '''
+        self.map.reload()
+        return self
+
+    @property
+    def uuid(self):
+        return self.map.registers['uuid'].value
+
+    @property
+    def account(self):
+        return self.map.registers['account'].value
+
+    def to_dict(self):
+        return self.codec.decode(self.map.value)
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
@@ -9,7 +9,16 @@ __author__ = 'Jean Chassoul'
 import uuid
 from schematics import types
 from schematics.types import compound
-from mango.schemas import RequiredBase
+from mango.schemas import RequiredBase, BaseMap
+from mango.schemas.codecs import MapCodec
+from mango.schemas.validators import Validator
+
+
+# list fields stored as riak map sets, indexed by search as <field>_set
+ACCOUNT_SETS = ('members', 'owners', 'teams')
+
+# ordered lists with repeats, riak map sets of time prefixed entries
+ACCOUNT_LOGS = ('history',)
 
 
 class BaseAccount(RequiredBase):
@@ -56,3 +65,18 @@ class Orgs(BaseAccount):
     members = compound.ListType(types.StringType())
     owners = compound.ListType(types.StringType())
     teams = compound.ListType(types.DictType(types.StringType))
+
+
+# riak map codec generated from the Orgs schema
+ACCOUNT_CODEC = MapCodec(Orgs, ACCOUNT_SETS, ACCOUNT_LOGS)
+
+# payload validation compiled from the account schemas
+USER_VALIDATOR = Validator(Users)
+ORG_VALIDATOR = Validator(Orgs)
+
+
+class AccountMap(BaseMap):
+    '''
+        (ORG) account map structure
+    '''
+    codec = ACCOUNT_CODEC
@@ -0,0 +1,260 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+import time
+import uuid
+import ujson as json
+from schematics import types
+from schematics.types import compound
+from mango.system import set_element, set_things
+
+
+def encode_text(value):
+    return '' if value is None else str(value)
+
+
+def encode_number(value):
+    '''
+        Timestamps and numbers go in as plain numbers
+    '''
+    if value is None or value == '':
+        return ''
+    if hasattr(value, 'timestamp'):
+        value = value.timestamp()
+    return str(value)
+
+
+def encode_boolean(value):
+    if value is None or value == '':
+        return ''
+    if isinstance(value, str):
+        value = (value.lower() == 'true')
+    return 'true' if value else 'false'
+
+
+def encode_document(value):
+    if value is None or value == '':
+        return ''
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, sort_keys=True)
+
+
+def decode_text(value):
+    return value if value else None
+
+
+def decode_number(value):
+    if not value:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else number
+
+
+def decode_boolean(value):
+    if not value:
+        return None
+    return value.lower() == 'true'
+
+
+def decode_document(value):
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        pass
+    # old registers hold python reprs of lists and dicts
+    try:
+        return json.loads(value.replace("'", '"'))
+    except ValueError:
+        return value
+
+
+def field_codec(field):
+    '''
+        Register encoder and decoder of a schematics field
+    '''
+    if isinstance(field, (types.TimestampType, types.NumberType)):
+        return encode_number, decode_number
+    if isinstance(field, types.BooleanType):
+        return encode_boolean, decode_boolean
+    if isinstance(field, compound.CompoundType):
+        return encode_document, decode_document
+    return encode_text, decode_text
+
+
+def merge_legacy(legacy, elements):
+    '''
+        Set elements after the ones of a pre-set register, no repeats
+    '''
+    if not isinstance(legacy, list):
+        return elements
+    merged = []
+    seen = set()
+    for thing in legacy + elements:
+        key = set_element(thing)
+        if key not in seen:
+            seen.add(key)
+            merged.append(thing)
+    return merged
+
+
+def merge_log(legacy, entries):
+    '''
+        Log entries after the ones of a pre-set register, repeats kept
+    '''
+    if not isinstance(legacy, list):
+        return entries
+    return legacy + entries
+
+
+def entry_prefix(at):
+    '''
+        Sortable log entry prefix, microseconds then a random tie breaker
+    '''
+    return '{0:016d}:{1}'.format(at, uuid.uuid4().hex[:8])
+
+
+def element_codec(field):
+    '''
+        Set element encoder and decoder of a schematics list field
+    '''
+    if isinstance(field.field, compound.CompoundType):
+        return set_element, json.loads
+    return encode_text, decode_text
+
+
+class MapCodec(object):
+    '''
+        Riak map codec built once from a schematics model
+
+        Every field gets its encoder and decoder up front, encode and
+        decode walk the precomputed tables once with no reflection.
+        List fields named in sets are riak sets, the rest registers.
+        List fields named in logs keep order and repeats, they are riak
+        sets too with every element prefixed by its append time, so an
+        append needs no read, decoding sorts and strips the prefixes.
+        Objects stored before a field became a set still have it in a
+        register, decoding reads it first and merges the set in.
+    '''
+
+    def __init__(self, model, sets=(), logs=()):
+        fields = model._fields
+        for name in tuple(sets) + tuple(logs):
+            if not isinstance(fields.get(name), compound.ListType):
+                raise ValueError('{0}.{1} is not a list field'.format(
+                    model.__name__, name))
+        self.model = model
+        self.registers = tuple(
+            (name,) + field_codec(field)
+            for name, field in fields.items() if name not in sets and name not in logs)
+        self.sets = tuple(
+            (name,) + element_codec(fields[name]) for name in sets)
+        self.logs = tuple(
+            (name,) + element_codec(fields[name]) for name in logs)
+        self.set_names = tuple(sets)
+        self.log_names = tuple(logs)
+        self.names = frozenset(fields)
+        self._registers = dict((x[0], x) for x in self.registers)
+        self._sets = dict((x[0], x) for x in self.sets)
+        self._logs = dict((x[0], x) for x in self.logs)
+
+    def encode(self, riak_map, struct):
+        '''
+            Stage every field of struct on a riak map
+        '''
+        for name, encode, _ in self.registers:
+            riak_map.registers[name].assign(encode(struct.get(name)))
+        for name, encode, _ in self.sets:
+            for thing in set_things(struct.get(name)):
+                riak_map.sets[name].add(encode(thing))
+        for name, _, _ in self.logs:
+            for entry in self.encode_entries(name, struct.get(name)):
+                riak_map.sets[name].add(entry)
+        return riak_map
+
+    def encode_value(self, name, value):
+        '''
+            Register value of a single field
+        '''
+        codec = self._registers.get(name)
+        return codec[1](value) if codec else encode_document(value)
+
+    def encode_element(self, name, thing):
+        '''
+            Set element of a single field
+        '''
+        codec = self._sets.get(name)
+        return codec[1](thing) if codec else set_element(thing)
+
+    def encode_entries(self, name, things, at=None):
+        '''
+            Log set elements of things, in order from at microseconds
+        '''
+        codec = self._logs.get(name)
+        encode = (codec[1] if codec else set_element)
+        at = (int(time.time() * 1000000) if at is None else at)
+        return ['{0}:{1}'.format(entry_prefix(at + index), encode(thing))
+                for index, thing in enumerate(set_things(things))]
+
+    def decode_entry(self, name, entry):
+        '''
+            Python value of a single log set element
+        '''
+        codec = self._logs.get(name)
+        thing = entry.split(':', 2)[2]
+        return codec[2](thing) if codec else thing
+
+    def decode_value(self, name, value):
+        '''
+            Python value of a single register
+        '''
+        codec = self._registers.get(name)
+        return codec[2](value) if codec else decode_document(value)
+
+    def decode(self, value):
+        '''
+            Python dict of a riak map value, empty registers left out
+        '''
+        struct = {}
+        for name, _, decode in self.registers:
+            thing = decode(value.get((name, 'register')))
+            if thing is not None:
+                struct[name] = thing
+        for name, _, decode in self.sets:
+            struct[name] = merge_legacy(
+                decode_document(value.get((name, 'register'))),
+                [decode(x) for x in sorted(value.get((name, 'set'), ()))])
+        for name, _, _ in self.logs:
+            struct[name] = merge_log(
+                decode_document(value.get((name, 'register'))),
+                [self.decode_entry(name, x) for x in sorted(value.get((name, 'set'), ()))])
+        return struct
+
+    def decode_doc(self, doc):
+        '''
+            Python dict of a search document, empty registers left out
+        '''
+        struct = {}
+        for name, _, decode in self.registers:
+            thing = decode(doc.get(name + '_register'))
+            if thing is not None:
+                struct[name] = thing
+        for name, _, decode in self.sets:
+            struct[name] = merge_legacy(
+                decode_document(doc.get(name + '_register')),
+                [decode(x) for x in doc.get(name + '_set', ())])
+        for name, _, _ in self.logs:
+            struct[name] = merge_log(
+                decode_document(doc.get(name + '_register')),
+                [self.decode_entry(name, x) for x in sorted(doc.get(name + '_set', ()))])
+        return struct
@@ -0,0 +1,174 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+import re
+from schematics import types
+from schematics.types import compound
+from schematics.undefined import Undefined
+from mango.tools import clean_structure
+
+
+# canonical uuids are their own primitive
+UUID = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\Z')
+
+
+class Slow(Exception):
+    '''
+        The fast path can't decide, the model has to
+    '''
+
+
+def plain(field):
+    '''
+        No validators beyond the ones of its type, no length limits
+    '''
+    # lists add check_length to the validate_ methods of their type
+    builtin = len(field._validators) + isinstance(field, compound.ListType)
+    return (len(field.validators) == builtin
+            and not getattr(field, 'regex', None)
+            and getattr(field, 'min_length', None) is None
+            and getattr(field, 'max_length', None) is None
+            and getattr(field, 'min_size', None) is None
+            and getattr(field, 'max_size', None) is None)
+
+
+def plain_string(field):
+    return type(field) is types.StringType and plain(field) and field.choices is None
+
+
+def field_check(field):
+    '''
+        Primitive value of a field from a plain json value, raises Slow
+
+        Strings, booleans, canonical uuids and string lists and dicts
+        are checked inline, other types run their own validate chain.
+        Anything holding models goes to the model.
+    '''
+    choices = (frozenset(field.choices) if field.choices is not None else None)
+
+    def in_choices(value):
+        if choices is not None and value not in choices:
+            raise Slow()
+        return value
+
+    if type(field) is types.StringType and plain(field):
+        def check(value):
+            if type(value) is not str:
+                raise Slow()
+            return in_choices(value)
+    elif type(field) is types.BooleanType and plain(field):
+        def check(value):
+            if type(value) is not bool:
+                raise Slow()
+            return in_choices(value)
+    elif type(field) is types.UUIDType and plain(field):
+        def check(value):
+            if type(value) is not str or UUID.match(value) is None:
+                raise Slow()
+            return in_choices(value)
+    elif (type(field) is compound.ListType and plain(field)
+          and plain_string(field.field) and choices is None):
+        def check(value):
+            if type(value) is not list or not all(type(x) is str for x in value):
+                raise Slow()
+            return list(value)
+    elif (type(field) is compound.DictType and plain(field)
+          and plain_string(field.field) and choices is None):
+        def check(value):
+            if type(value) is not dict or not all(
+                    type(k) is str and type(v) is str for k, v in value.items()):
+                raise Slow()
+            return dict(value)
+    elif isinstance(field, compound.CompoundType):
+        def check(value):
+            # nested models validate with the context of their parent
+            raise Slow()
+    else:
+        def check(value):
+            try:
+                return field.to_primitive(field.validate(value))
+            except Exception:
+                raise Slow()
+    return check
+
+
+def default_value(field):
+    '''
+        Primitive default of a field, a callable for dynamic defaults
+    '''
+    def convert(value):
+        return (None if value is None else field.to_primitive(field.validate(value)))
+    if field._default is Undefined:
+        return None
+    if callable(field._default):
+        return lambda: convert(field.default)
+    value = convert(field._default)
+    return lambda: value
+
+
+class Validator(object):
+    '''
+        Model validation compiled once from the schema
+
+        clean(struct) gives what clean_structure of the validated model
+        would, checking types, choices and required fields on the plain
+        dict. Payloads the fast path can't vouch for, invalid ones
+        included, go through the model, so errors are the schematics
+        DataError exactly as before.
+    '''
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = tuple(
+            (name, field.required, field_check(field), default_value(field))
+            for name, field in model._fields.items())
+        self.names = frozenset(model._fields)
+        # model level validate_<field> methods need the model
+        self.enabled = not getattr(model, '_validator_functions', None)
+        self.fast = 0
+        self.slow = 0
+
+    def clean(self, struct):
+        '''
+            Validated primitive dict of struct, nulls dropped
+        '''
+        if self.enabled and isinstance(struct, dict):
+            try:
+                message = self._fast(struct)
+                self.fast += 1
+                return message
+            except Slow:
+                pass
+        self.slow += 1
+        event = self.model(struct)
+        event.validate()
+        return clean_structure(event)
+
+    def _fast(self, struct):
+        if not self.names.issuperset(struct):
+            # rogue fields
+            raise Slow()
+        message = {}
+        for name, required, check, default in self.fields:
+            if name in struct:
+                value = struct[name]
+                if value is None:
+                    if required:
+                        raise Slow()
+                    continue
+                value = check(value)
+            elif default is not None:
+                value = default()
+            else:
+                value = None
+            if value is None:
+                if required:
+                    raise Slow()
+                continue
+            message[name] = value
+        return message
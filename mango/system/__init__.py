@@ -2,9 +2,154 @@
 # to match the schemas and handlers directory pattern, but.. that's that.
 
 
-def update_struct():
-    pass
+import ujson as json
 
 
-def remove_struct():
-    pass
+def set_element(thing):
+    '''
+        Riak set elements are strings, objects go in as sorted json
+    '''
+    if isinstance(thing, str):
+        return thing
+    return json.dumps(thing, sort_keys=True)
+
+
+def set_things(value):
+    '''
+        Elements of a set key, a lone value is a one element list
+    '''
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    # never iterate a string into its characters
+    return [value]
+
+
+class PlainCodec(object):
+    '''
+        Register and set element encoding for maps without a schema codec
+    '''
+
+    def __init__(self, sets=()):
+        self.set_names = tuple(sets)
+        self.log_names = ()
+
+    def encode_value(self, name, value):
+        return str(value)
+
+    def encode_element(self, name, thing):
+        return set_element(thing)
+
+    def decode_value(self, name, value):
+        return json.loads(value.replace("'", '"')) if value else None
+
+
+def update_struct(item, struct, ignore, sets=(), codec=None):
+    '''
+        Stage every change of struct on a riak map and send one update
+
+        Costs at most one fetch, only when a list register needs its
+        old value, and a single map update carrying all the changes.
+        Keys in sets and logs are riak map sets and need no prior read,
+        log values are appended after the current entries.
+    '''
+    codec = codec or PlainCodec(sets)
+    sets = codec.set_names
+    logs = codec.log_names
+    keys = [key for key in struct if key not in ignore]
+    if not keys:
+        return False
+    if any(type(struct.get(key)) == list and key not in sets and key not in logs
+           for key in keys):
+        item.reload()
+    for key in keys:
+        value = struct.get(key)
+        if key in sets:
+            for thing in set_things(value):
+                item.sets[key].add(codec.encode_element(key, thing))
+        elif key in logs:
+            for entry in codec.encode_entries(key, value):
+                item.sets[key].add(entry)
+        elif type(value) == list:
+            old_list = codec.decode_value(key, item.registers[key].value) or []
+            item.registers[key].assign(codec.encode_value(key, old_list + value))
+        else:
+            item.registers[key].assign(codec.encode_value(key, value))
+    item.update()
+    return True
+
+
+def remove_struct(item, struct, ignore, sets=(), codec=None):
+    '''
+        Remove the list values of struct from a riak map in one update
+
+        Removals need the map context, so one fetch and one update.
+        Log keys lose every entry holding one of the values. Set and
+        log keys are also removed from what is left of their register
+        on objects stored before they were sets.
+    '''
+    codec = codec or PlainCodec(sets)
+    sets = codec.set_names
+    logs = codec.log_names
+    keys = [key for key in struct
+            if key not in ignore and (type(struct.get(key)) == list or
+                                      (key in sets + logs and struct.get(key) is not None))]
+    if not keys:
+        return False
+    item.reload()
+    for key in keys:
+        value = struct.get(key)
+        if key in sets or key in logs:
+            value = set_things(value)
+            current = item.sets[key].value
+            if key in logs:
+                doomed = sorted(x for x in current if codec.decode_entry(key, x) in value)
+            else:
+                doomed = [x for x in (codec.encode_element(key, y) for y in value)
+                          if x in current]
+            for thing in doomed:
+                item.sets[key].discard(thing)
+            legacy = item.registers[key].value
+            if legacy:
+                old_list = codec.decode_value(key, legacy)
+                if isinstance(old_list, list):
+                    new_list = [x for x in old_list if x not in value]
+                    if new_list != old_list:
+                        item.registers[key].assign(codec.encode_value(key, new_list))
+        else:
+            old_list = codec.decode_value(key, item.registers[key].value)
+            if old_list:
+                new_list = [x for x in old_list if x not in value]
+                item.registers[key].assign(codec.encode_value(key, new_list))
+    item.update()
+    return True
+
+
+def backfill_struct(item, sets=(), codec=None):
+    '''
+        Move set and log keys still stored as registers into their sets
+
+        One fetch and, only when a register held values, one update.
+        Registers are emptied so the values live in the sets alone,
+        old log entries sort before every entry appended since.
+    '''
+    codec = codec or PlainCodec(sets)
+    item.reload()
+    moved = False
+    for key in codec.set_names + codec.log_names:
+        legacy = item.registers[key].value
+        if not legacy:
+            continue
+        things = set_things(codec.decode_value(key, legacy))
+        if key in codec.log_names:
+            entries = codec.encode_entries(key, things, at=0)
+        else:
+            entries = [codec.encode_element(key, x) for x in things]
+        for entry in entries:
+            item.sets[key].add(entry)
+        item.registers[key].assign('')
+        moved = True
+    if moved:
+        item.update()
+    return moved
@@ -7,17 +7,55 @@ __author__ = 'Jean Chassoul'
 
 
 import riak
+import time
+import arrow
 import logging
+import ujson as json
 from tornado import gen
+from riak.datatypes import Map
 from schematics.types import compound
+from mango.system import update_struct
 from mango.schemas import accounts
+from mango.schemas.accounts import AccountMap, ACCOUNT_CODEC, USER_VALIDATOR, ORG_VALIDATOR
 from mango.schemas import BaseResult
-from mango.tools import clean_structure
-from tornado import httpclient as _http_client
+from mango.tools.cursor import encode_cursor, decode_cursor
+from mango.tools.buckets import get_bucket
+from mango.tools.exists import filters
+from mango.tools.storage import multiget_data, run_storage
+from mango.tools.http import http_client
+from mango.tools.search import IGNORE_ME, SearchError
+from mango.tools.search import get_search_item, get_search_page, get_search_batch
+from mango.tools.search import search_item, search_list, search_page
 
-curl_client = 'tornado.curl_httpclient.CurlAsyncHTTPClient'
-_http_client.AsyncHTTPClient.configure(curl_client)
-http_client = _http_client.AsyncHTTPClient()
+
+# seconds the cached user count and page continuations stay valid
+USER_INDEX_TTL = 30
+
+# cached 2i walk state of the user list
+_user_index = {
+    'count': None,
+    'count_at': 0,
+    'pages': {},
+    'pages_at': 0,
+    'page_size': None,
+}
+
+
+def count_user_index(bucket):
+    '''
+        Walk the user 2i keys and count them, blocking
+    '''
+    count = 0
+    for keys in bucket.stream_index("account_type_bin", 'user'):
+        count += len(keys)
+    return count
+
+
+def user_visible(user, account):
+    '''
+        Users are not scoped by account (yet), same as get_user
+    '''
+    return True
 
 
 class UserResult(BaseResult):
@@ -38,13 +76,11 @@ class Accounts(object):
             New user event
         '''
         bucket_name = 'accounts'
-        bucket = self.db.bucket(bucket_name)
+        bucket = get_bucket(self.db, 'default', bucket_name)
         try:
             struct['created_by'] = self.settings['domain']
             struct['status'] = 'new'
-            event = accounts.Users(struct)
-            event.validate()
-            event = clean_structure(event)
+            event = USER_VALIDATOR.clean(struct)
         except Exception as error:
             raise error
         try:
@@ -55,7 +91,7 @@ class Accounts(object):
             user.add_index("account_bin", event["account"])
             user.add_index("account_type_bin", event["account_type"])
             user.add_index("email_bin", event["email"])
-            user.store()
+            yield run_storage(user.store)
         except Exception as error:
             logging.error(error)
             message = str(error)
@@ -67,9 +103,9 @@ class Accounts(object):
             Get user
         '''
         bucket_name = 'accounts'
-        bucket = self.db.bucket(bucket_name)
-        results = bucket.get_index("uuid_bin", user_uuid)
-        message = [y.data for y in (bucket.get(x) for x in results)]
+        bucket = get_bucket(self.db, 'default', bucket_name)
+        results = yield run_storage(bucket.get_index, "uuid_bin", user_uuid)
+        message = yield run_storage(multiget_data, bucket, results)
         if message:
             message = message[0]
         else:
@@ -82,9 +118,9 @@ class Accounts(object):
             Get uuid from username account
         '''
         bucket_name = 'accounts'
-        bucket = self.db.bucket(bucket_name)
-        results = bucket.get_index("account_bin", username)
-        message = [y.data for y in (bucket.get(x) for x in results)]
+        bucket = get_bucket(self.db, 'default', bucket_name)
+        results = yield run_storage(bucket.get_index, "account_bin", username)
+        message = yield run_storage(multiget_data, bucket, results)
         if message:
             message = message[0]
         else:
@@ -92,7 +128,63 @@ class Accounts(object):
         return message['uuid']
 
     @gen.coroutine
-    def get_user_list(self, account, start, end, lapse, status, page_num):
+    def user_index_count(self, bucket):
+        '''
+            Total user count, cached for a while instead of walked per page
+        '''
+        now = time.time()
+        if (_user_index['count'] is None or
+                now - _user_index['count_at'] > USER_INDEX_TTL):
+            _user_index['count'] = yield run_storage(count_user_index, bucket)
+            _user_index['count_at'] = now
+        return _user_index['count']
+
+    @gen.coroutine
+    def user_index_continuation(self, bucket, page_num, page_size):
+        '''
+            2i continuation where page_num starts, or False past the end
+
+            Continuations of pages already served are remembered, jumping
+            to an unknown page costs one keys-only 2i read from the
+            nearest known page. _user_index is only touched on the
+            IOLoop, the 2i read runs on the storage executor.
+        '''
+        page_num = max(1, page_num)
+        now = time.time()
+        pages = _user_index['pages']
+        if (now - _user_index['pages_at'] > USER_INDEX_TTL or
+                _user_index['page_size'] != page_size):
+            pages.clear()
+            pages[1] = None
+            _user_index['pages_at'] = now
+            _user_index['page_size'] = page_size
+        if page_num in pages:
+            return pages[page_num]
+        known = max(x for x in pages if x < page_num)
+        if known > 1 and not pages[known]:
+            return False
+        page = yield run_storage(bucket.get_index, "account_type_bin", 'user',
+                                 max_results=page_size * (page_num - known),
+                                 continuation=pages[known])
+        continuation = (page.continuation if page.continuation else False)
+        if _user_index['page_size'] == page_size:
+            pages[page_num] = continuation
+        return continuation
+
+    @gen.coroutine
+    def get_user_batch(self, account, uuids):
+        '''
+            Get users by uuid in one parallel multiget, {uuid: user}
+
+            User objects are keyed by uuid, no index lookup needed.
+        '''
+        bucket_name = 'accounts'
+        bucket = get_bucket(self.db, 'default', bucket_name)
+        users = yield run_storage(multiget_data, bucket, uuids)
+        return dict((user.get('uuid'), user) for user in users)
+
+    @gen.coroutine
+    def get_user_list(self, account, start, end, lapse, status, page_num, cursor=None):
         '''
             Get user account list
         '''
@@ -108,26 +200,36 @@ class Accounts(object):
         # filter_query = '(({0})AND({1})AND({2}))'.format(filter_account, filter_status, filter_account_type)
         # TODO: cool but WTF with account, start, end, lapse and status?
 
-        result = []
+        page_num = max(1, int(page_num))
+        page_size = self.settings['page_size']
         message = {
             'count': 0,
             'page': page_num,
-            'results': result}
-        upper_limit = 480000 * 3
-        logging.info("upper_limit not being used! {} why?".format(upper_limit))
-        page_num = int(page_num)
-        page_size = self.settings['page_size']
-        start_num = page_size * (page_num - 1)
-        end_num = start_num + page_size
+            'cursor': None,
+            'results': []}
         bucket_name = 'accounts'
-        bucket = self.db.bucket(bucket_name)
-        query = bucket.stream_index("account_type_bin", 'user')
-        for x in query:
-            for y in x:
-                result.append(y)
-        message['count'] = len(result)
-        message['results'] = [
-            y.data for y in (bucket.get(x) for x in result[start_num:end_num])]
+        bucket = get_bucket(self.db, 'default', bucket_name)
+        if cursor:
+            # walk the 2i with the continuation wrapped in our cursor
+            try:
+                continuation = decode_cursor('riak', cursor)
+            except ValueError as error:
+                logging.warning(error)
+                return message
+        else:
+            continuation = yield self.user_index_continuation(bucket, page_num, page_size)
+        message['count'] = yield self.user_index_count(bucket)
+        if continuation is False:
+            # past the last page
+            return message
+        page = yield run_storage(bucket.get_index, "account_type_bin", 'user',
+                                 max_results=page_size,
+                                 continuation=continuation)
+        if not cursor and _user_index['page_size'] == page_size:
+            _user_index['pages'][page_num + 1] = (
+                page.continuation if page.continuation else False)
+        message['cursor'] = encode_cursor('riak', page.continuation)
+        message['results'] = yield run_storage(multiget_data, bucket, page.results)
         return message
 
     @gen.coroutine
@@ -151,60 +253,26 @@ class Accounts(object):
             filter_query = 'account_register:{0}'.format(account)
             logging.warning(filter_query)
         # search query url
-        url = "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}".format(
-            self.solr, search_index, query, filter_query
-        )
+        url = get_search_item(self.solr, search_index, query, filter_query)
         logging.warning(url)
         # pretty please, ignore this list of fields from database.
         IGNORE_ME = ("_yz_id","_yz_rk","_yz_rt","_yz_rb","checked","keywords")
-        # got callback response?
-        got_response = []
         # your message truly
         message = {'update_complete':False}
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
         try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            response = got_response[0].get('response')['docs'][0]
+            response = yield search_item(url)
             riak_key = str(response['_yz_rk'])
-            bucket = self.kvalue.bucket_type(bucket_type).bucket('{0}'.format(bucket_name))
-            bucket.set_properties({'search_index': search_index})
+            bucket = get_bucket(self.kvalue, bucket_type, bucket_name)
             user = Map(bucket, riak_key)
-            for key in struct:
-                if key not in IGNORE_ME:
-                    if type(struct.get(key)) == list:
-                        user.reload()
-                        old_value = user.registers['{0}'.format(key)].value
-                        if old_value:
-                            old_list = json.loads(old_value.replace("'",'"'))
-                            for thing in struct.get(key):
-                                old_list.append(thing)
-                            user.registers['{0}'.format(key)].assign(str(old_list))
-                        else:
-                            new_list = []
-                            for thing in struct.get(key):
-                                new_list.append(thing)
-                            user.registers['{0}'.format(key)].assign(str(new_list))
-                    else:
-                        user.registers['{0}'.format(key)].assign(str(struct.get(key)))
-                    user.update()
-            update_complete = True
-            message['update_complete'] = True
+            # one update carrying every change
+            message['update_complete'] = yield run_storage(
+                update_struct, user, struct, IGNORE_ME, codec=ACCOUNT_CODEC)
         except Exception as error:
             logging.exception(error)
+        # drop cached copies, reloads stay short until the index catches up
+        yield self.cache.invalidate([
+            'users:{0}'.format(user_uuid.rstrip('/')),
+            'orgs:{0}'.format(user_uuid.rstrip('/'))])
         return message.get('update_complete', False)
 
     @gen.coroutine
@@ -227,49 +295,22 @@ class Accounts(object):
         bucket_type = 'mango_account'
         bucket_name = 'accounts'
         try:
-            event = accounts.Org(struct)
-            event.validate()
-            event = clean_structure(event)
+            event = ORG_VALIDATOR.clean(struct)
         except Exception as error:
             raise error
         try:
             message = event.get('uuid')
-            structure = {
-                "uuid": str(event.get('uuid', str(uuid.uuid4()))),
-                "status": str(event.get('status', '')),
-                "account": str(event.get('account', 'pebkac')),
-                "account_type": str(event.get('account_type', 'org')),
-                "name": str(event.get('name', '')),
-                "description": str(event.get('description', '')),
-                "email": str(event.get('email', '')),
-                "phone_number": str(event.get('phone_number', '')),
-                "extension": str(event.get('extension', '')),
-                "country_code": str(event.get('country_code', '')),
-                "timezone": str(event.get('timezone', '')),
-                "company": str(event.get('company', '')),
-                "location": str(event.get('location', '')),
-                "phones": str(event.get('phones', '')),
-                "emails": str(event.get('emails', '')),
-                "history": str(event.get('history', '')),
-                "labels": str(event.get('labels', '')),
-                "members": str(event.get('members', '')),
-                "teams": str(event.get('teams', '')),
-                "checked": str(event.get('checked', '')),
-                "checked_by": str(event.get('checked_by', '')),
-                "checked_at": str(event.get('checked_at', '')),
-                "created_by": str(event.get('created_by', '')),
-                "created_at": str(event.get('created_at', '')),
-                "last_update_at": str(event.get('last_update_at', '')),
-                "last_update_by": str(event.get('last_update_by', '')),
-            }
-            result = AccountMap(
+            result = yield run_storage(
+                AccountMap,
                 self.kvalue,
                 bucket_name,
                 bucket_type,
                 search_index,
-                structure
+                event
             )
-            message = structure.get('uuid')
+            message = event.get('uuid')
+            yield self.cache.clear_absent('orgs', message, [event.get('account')])
+            yield filters['orgs'].add(message)
         except Exception as error:
             logging.error(error)
             message = str(error)
@@ -284,8 +325,6 @@ class Accounts(object):
         # Please, don't hardcode your shitty domain in here.
         url = 'https://{0}/users/{1}'.format(self.domain, user_uuid)
         logging.warning(url)
-        # got callback response?
-        got_response = []
         # yours trully
         headers = {'content-type':'application/json'}
         # and know for something completly different
@@ -295,27 +334,13 @@ class Accounts(object):
             'last_update_at': arrow.utcnow().timestamp,
             'last_update_by': username,
         }
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
         try:
-            http_client.fetch(
+            yield http_client.fetch(
                 url,
                 method='PATCH',
                 headers=headers,
-                body=json.dumps(message),
-                callback=handle_request
+                body=json.dumps(message)
             )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            #logging.warning(got_response)
         except Exception as error:
             logging.error(error)
             message = str(error)
@@ -331,49 +356,34 @@ class Accounts(object):
         filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
         url = get_search_item(self.solr, search_index, query, filter_query)
         logging.warning(url)
-        # init got response list
-        got_response = []
-        # init crash message
+        # search errors go up, they are no answer about the org
         message = {'message': 'not found'}
-        # ignore riak fields
-        __ignore = [
-            "_yz_id","_yz_rk","_yz_rt","_yz_rb",
-            # CUSTOM FIELDS
-            "nickname_register",
-            "first_name_register",
-            "last_name_register",
-            "middle_name_register",
-            "password_register",
-            "orgs_register"
-        ]
-        # hopefully asynchronous handle function request
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
+        response = yield search_item(url)
+        if response:
+            # user only fields are not in the org codec
+            message = ACCOUNT_CODEC.decode_doc(response)
+        return message
+
+    @gen.coroutine
+    def get_org_batch(self, account, uuids):
+        '''
+            Get (ORG)s by uuid in one search query, {uuid: org}
+        '''
+        search_index = 'mango_account_index'
+        filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
+        url = get_search_batch(self.solr, search_index, uuids, filter_query)
+        message = {}
         try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            stuff = got_response[0]
-            if stuff['response']['numFound']:
-                response = stuff['response']['docs'][0]
-                message = clean_response(response, __ignore)
-        except Exception as error:
+            count, docs = yield search_list(url)
+            for doc in docs:
+                org = ACCOUNT_CODEC.decode_doc(doc)
+                message[org['uuid']] = org
+        except SearchError as error:
             logging.warning(error)
         return message
 
     @gen.coroutine
-    def get_org_list(self, account, start, end, lapse, status, page_num):
+    def get_org_list(self, account, start, end, lapse, status, page_num, cursor=None):
         '''
             Get (ORG) list
         '''
@@ -384,7 +394,6 @@ class Accounts(object):
         # page number
         page_num = int(page_num)
         page_size = self.settings['page_size']
-        start_num = page_size * (page_num - 1)
 
         # yo, tony was here!
         if account is False:
@@ -394,42 +403,24 @@ class Accounts(object):
             filter_account = 'created_by_register:{0}'.format(account.decode('utf-8'))
             filter_query = '(({0})AND({1})AND({2}))'.format(filter_account, filter_status, filter_account_type)
 
-        url = get_search_list(self.solr, search_index, query, filter_query, start_num, page_size)
-        # init got response list
-        got_response = []
         # init crash message
         message = {
             'count': 0,
             'page': page_num,
+            'cursor': None,
             'results': []
         }
-        __ignore = ["_yz_id","_yz_rk","_yz_rt","_yz_rb"]
-
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
         try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            stuff = got_response[0]
-            if stuff['response']['numFound']:
-                message['count'] += stuff['response']['numFound']
-                for doc in stuff['response']['docs']:
-                    message['results'].append(clean_response(doc, __ignore))
+            url, cursor_mark = get_search_page(self.solr, search_index, query, filter_query,
+                                               page_num, page_size, cursor)
+            stuff, message['cursor'] = yield search_page(url, cursor_mark)
+            if stuff['numFound']:
+                message['count'] += stuff['numFound']
+                for doc in stuff['docs']:
+                    message['results'].append(ACCOUNT_CODEC.decode_doc(doc))
             else:
                 logging.error('there is probably something wrong! get list orgs')
-        except Exception as error:
+        except (SearchError, ValueError) as error:
             logging.warning(error)
         return message
 
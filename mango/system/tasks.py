@@ -9,21 +9,80 @@
 __author__ = 'Team Machine'
 
 
-import uuid
 import logging
 import ujson as json
+from collections import OrderedDict
 from tornado import gen
 from schematics.types import compound
+from mango.system import update_struct, remove_struct, set_things
 from mango.schemas import tasks
 from mango.schemas import BaseResult
-from mango.schemas.tasks import TaskMap
+from mango.schemas.tasks import TaskMap, TASK_CODEC, TASK_VALIDATOR
 from riak.datatypes import Map
-from mango.tools import clean_structure, clean_results, get_search_item
-from tornado import httpclient as _http_client
+from mango.tools import clean_response, clean_results, make_etag
+from mango.tools.search import IGNORE_ME, SearchError
+from mango.tools.buckets import get_bucket
+from mango.tools.exists import filters
+from mango.tools.storage import run_storage
+from mango.tools.search import get_search_item, get_search_page, get_search_batch, quick_search_item
+from mango.tools.search import search_item, search_list, search_page, search_request
+from mango.tools.search import search_key_docs, search_uuid_docs
 
 
-_http_client.AsyncHTTPClient.configure('tornado.curl_httpclient.CurlAsyncHTTPClient')
-http_client = _http_client.AsyncHTTPClient()
+# task settings, overwritten by configure_tasks from mango options
+_settings = {
+    'legacy_watchers': True,
+}
+
+
+def owner_or_watcher(account):
+    '''
+        Filter query matching tasks owned or watched by account
+
+        One filter means one search round trip, owner and watcher
+        matches come back deduplicated and paginate as a single set.
+        Until the sets backfill has run, watchers still kept in the
+        register of older tasks match too, like task_visible does.
+    '''
+    account = account.decode('utf-8')
+    filter_account = 'account_register:{0}'.format(account)
+    # watchers is a multi-valued set field, exact term lookup
+    filter_watchers = 'watchers_set:{0}'.format(account)
+    if _settings['legacy_watchers']:
+        # pre-set registers hold python reprs, "['bob', 'eve']"
+        filter_watchers = "{0} OR watchers_register:*'{1}'*".format(filter_watchers, account)
+    return '(({0})OR({1}))'.format(filter_account, filter_watchers)
+
+
+def task_visible(task, account):
+    '''
+        Python side of owner_or_watcher, for cached tasks
+
+        Decoded tasks merge legacy watchers in, both sides agree as
+        long as legacy_watchers stays on until the backfill has run.
+    '''
+    if isinstance(account, bytes):
+        account = account.decode('utf-8')
+    return task.get('account') == account or account in task.get('watchers', [])
+
+
+def task_readers(*stuff):
+    '''
+        Every account that can read these tasks, owners and watchers
+    '''
+    readers = set()
+    for task in stuff:
+        readers.update(x for x in (task.get('watchers') or ()) if isinstance(x, str))
+        if task.get('account'):
+            readers.add(task['account'])
+    return readers
+
+
+def list_versions(readers):
+    '''
+        Task list version names of readers
+    '''
+    return ['tasks:{0}'.format(x) for x in readers]
 
 
 class TasksResult(BaseResult):
@@ -55,44 +114,21 @@ class Tasks(object):
             fields = '{0}'.format(fields.decode('utf-8'))
 
         url = quick_search_item(self.solr, search_index, query, start_num, page_size, fields).replace(' ', '')
-        
-        logging.warning('check this url')
-        logging.warning(url)
-        
-        IGNORE_ME = ["_yz_id","_yz_rk","_yz_rt","_yz_rb"]
-        got_response = []
         # clean response message
         message = {
             'count': 0,
             'page': page_num,
             'results': []
         }
-
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
         try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            stuff = got_response[0]
-            if stuff['response']['numFound']:
-                message['count'] += stuff['response']['numFound']
-                for doc in stuff['response']['docs']:
-                    message['results'].append(clean_response_test(doc, IGNORE_ME))
+            stuff = yield search_request(url)
+            if stuff['numFound']:
+                message['count'] += stuff['numFound']
+                for doc in stuff['docs']:
+                    message['results'].append(clean_response(doc, IGNORE_ME))
             else:
                 logging.error('there is probably something wrong!')
-        except Exception as error:
+        except SearchError as error:
             logging.warning(error)
         return message
 
@@ -103,118 +139,85 @@ class Tasks(object):
         '''
         search_index = 'mango_task_index'
         query = 'uuid_register:{0}'.format(task_uuid)
-        filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
-        # note where the hack change ' to %27 for the url string!
-        fq_watchers = "watchers_register:*'{0}'*".format(account.decode('utf8')).replace("'",'%27')
-        urls = set()
-        urls.add(get_search_item(self.solr, search_index, query, filter_query))
-        urls.add(get_search_item(self.solr, search_index, query, fq_watchers))
-        # init got response list
-        got_response = []
-        # init crash message
+        filter_query = owner_or_watcher(account)
+        url = get_search_item(self.solr, search_index, query, filter_query)
+        # search errors go up, they are no answer about the task
         message = {'message': 'not found'}
-        # ignore riak fields
-        IGNORE_ME = ["_yz_id","_yz_rk","_yz_rt","_yz_rb"]
-        # hopefully asynchronous handle function request
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
+        response = yield search_item(url)
+        if response:
+            message = TASK_CODEC.decode_doc(response)
+        else:
+            logging.error('there is probably something wrong!')
+        return message
+
+    @gen.coroutine
+    def get_task_batch(self, account, uuids):
+        '''
+            Get tasks by uuid in one search query, {uuid: task}
+        '''
+        search_index = 'mango_task_index'
+        url = get_search_batch(self.solr, search_index, uuids, owner_or_watcher(account))
+        message = {}
         try:
-            # and know for something completly different!
-            for url in urls:
-                http_client.fetch(
-                    url,
-                    callback=handle_request
-                )
-            while len(got_response) <= 1:
-                # Yo, don't be careless with the time!
-                yield gen.sleep(0.0010)
-            # get stuff from response
-            stuff = got_response[0]
-            # get it from watchers list
-            watchers = got_response[1]
-            if stuff['response']['numFound']:
-                response = stuff['response']['docs'][0]
-                message = clean_response(response, IGNORE_ME)
-            elif watchers['response']['numFound']:
-                response = watchers['response']['docs'][0]
-                message = clean_response(response, IGNORE_ME)
-            else:
-                logging.error('there is probably something wrong!')
-        except Exception as error:
+            count, docs = yield search_list(url)
+            for doc in docs:
+                task = TASK_CODEC.decode_doc(doc)
+                message[task['uuid']] = task
+        except SearchError as error:
             logging.warning(error)
         return message
 
     @gen.coroutine
-    def get_task_list(self, account, start, end, lapse, status, page_num):
+    def get_task_list(self, account, start, end, lapse, status, page_num, cursor=None):
         '''
             Get task list
+
+            Pages are cached under the account tasks version, writes
+            that change what an account lists bump it.
         '''
-        search_index = 'mango_task_index'
-        query = 'uuid_register:*'
-        filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
-        # note where the hack change ' to %27 for the url string!
-        fq_watchers = "watchers_register:*'{0}'*".format(account.decode('utf8')).replace("'",'%27')
         # page number
         page_num = int(page_num)
         page_size = self.settings['page_size']
-        start_num = page_size * (page_num - 1)
-        # set of urls
-        urls = set()
-        urls.add(get_search_list(self.solr, search_index, query, filter_query, start_num, page_size))
-        urls.add(get_search_list(self.solr, search_index, query, fq_watchers, start_num, page_size))
-        # init got response list
-        got_response = []
-        # init crash message
+        key = yield self.cache.page_key('tasks', account.decode('utf-8'),
+                                        start, end, lapse, status, page_num, page_size, cursor)
+        try:
+            message, self.etag = yield self.cache.read_tagged(
+                key, lambda: self.search_task_list(account, page_num, page_size, cursor),
+                make_etag, settle='versions:tasks:{0}'.format(account.decode('utf-8')))
+        except (SearchError, ValueError) as error:
+            logging.warning(error)
+            # init crash message
+            message = {
+                'count': 0,
+                'page': page_num,
+                'cursor': None,
+                'results': []
+            }
+        return message
+
+    @gen.coroutine
+    def search_task_list(self, account, page_num, page_size, cursor=None):
+        '''
+            Task list page from the search index
+        '''
+        search_index = 'mango_task_index'
+        query = 'uuid_register:*'
+        filter_query = owner_or_watcher(account)
         message = {
             'count': 0,
             'page': page_num,
+            'cursor': None,
             'results': []
         }
-        # ignore riak fields
-        IGNORE_ME = ["_yz_id","_yz_rk","_yz_rt","_yz_rb"]
-        # hopefully asynchronous handle function request
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
-        try:
-            # and know for something completly different!
-            for url in urls:
-                http_client.fetch(
-                    url,
-                    callback=handle_request
-                )
-            while len(got_response) <= 1:
-                # Yo, don't be careless with the time!
-                yield gen.sleep(0.0010)
-            # get stuff from response
-            stuff = got_response[0]
-            # get it from watchers list
-            watchers = got_response[1]
-            if stuff['response']['numFound']:
-                message['count'] += stuff['response']['numFound']
-                for doc in stuff['response']['docs']:
-                    message['results'].append(clean_response(doc, IGNORE_ME))
-            if watchers['response']['numFound']:
-                message['count'] += watchers['response']['numFound']
-                for doc in watchers['response']['docs']:
-                    message['results'].append(clean_response(doc, IGNORE_ME))
-            else:
-                logging.error('there is probably something wrong!')
-        except Exception as error:
-            logging.warning(error)
+        url, cursor_mark = get_search_page(self.solr, search_index, query, filter_query,
+                                           page_num, page_size, cursor)
+        stuff, message['cursor'] = yield search_page(url, cursor_mark)
+        if stuff['numFound']:
+            message['count'] = stuff['numFound']
+            for doc in stuff['docs']:
+                message['results'].append(TASK_CODEC.decode_doc(doc))
+        else:
+            logging.error('there is probably something wrong!')
         return message
 
     @gen.coroutine
@@ -226,52 +229,77 @@ class Tasks(object):
         bucket_type = 'mango_task'
         bucket_name = 'tasks'
         try:
-            event = tasks.Task(struct)
-            event.validate()
-            event = clean_structure(event)
+            event = TASK_VALIDATOR.clean(struct)
         except Exception as error:
             raise error
         try:
-            structure = {
-                "uuid": str(event.get('uuid', str(uuid.uuid4()))),
-                "account": str(event.get('account', 'pebkac')),
-                "subject": str(event.get('subject', '')),
-                "description": str(event.get('description', '')),
-                "data": str(event.get('data', '')),
-                "assign": str(event.get('assign', '')),
-                "public": str(event.get('public', '')),
-                "source ": str(event.get('source', '')),
-                "destination": str(event.get('destination', '')),
-                "labels": str(event.get('labels', '')),
-                "start_time": str(event.get('start_time', '')),
-                "ack_time": str(event.get('ack_time', '')),
-                "stop_time": str(event.get('stop_time', '')),
-                "deadline": str(event.get('deadline', '')),
-                "duration": str(event.get('duration', '')),
-                "comments": str(event.get('comments', '')),
-                "history": str(event.get('history', '')),
-                "status": str(event.get('status', '')),
-                "checked": str(event.get('checked', '')),
-                "checked_by": str(event.get('checked_by', '')),
-                "checked_at": str(event.get('checked_at', '')),
-                "created_by": str(event.get('created_by', '')),
-                "created_at": str(event.get('created_at', '')),
-                "last_update_by": str(event.get('last_update_by', '')),
-                "last_update_at": str(event.get('last_update_at', '')),
-            }
-            result = TaskMap(
+            result = yield run_storage(
+                TaskMap,
                 self.kvalue,
                 bucket_name,
                 bucket_type,
                 search_index,
-                structure
+                event
             )
-            message = structure.get('uuid')
+            message = event.get('uuid')
+            readers = task_readers(event)
+            yield self.cache.bump(list_versions(readers))
+            yield self.cache.clear_absent('tasks', message, readers)
+            yield filters['tasks'].add(message)
         except Exception as error:
             logging.error(error)
             message = str(error)
         return message
 
+    @gen.coroutine
+    def new_task_bulk(self, structs):
+        '''
+            New tasks in bulk
+
+            Every item is validated before anything is written, valid
+            ones are stored by bulk_concurrency workers without reading
+            the map back. One result per item, in request order.
+        '''
+        search_index = 'mango_task_index'
+        bucket_type = 'mango_task'
+        bucket_name = 'tasks'
+        results = []
+        events = []
+        for index, struct in enumerate(structs):
+            try:
+                events.append((index, TASK_VALIDATOR.clean(struct)))
+                results.append(None)
+            except Exception as error:
+                results.append({'index': index, 'status': 400, 'error': str(error)})
+        pending = iter(events)
+
+        @gen.coroutine
+        def worker():
+            for index, event in pending:
+                try:
+                    yield run_storage(
+                        TaskMap,
+                        self.kvalue,
+                        bucket_name,
+                        bucket_type,
+                        search_index,
+                        event,
+                        False
+                    )
+                    results[index] = {'index': index, 'status': 201, 'uuid': event.get('uuid')}
+                except Exception as error:
+                    logging.error(error)
+                    results[index] = {'index': index, 'status': 500, 'error': str(error)}
+        concurrency = min(self.settings.get('bulk_concurrency', 16), len(events))
+        yield [worker() for _ in range(concurrency)]
+        stored = [event for index, event in events if results[index]['status'] == 201]
+        yield self.cache.bump(list_versions(task_readers(*stored)))
+        # one memcached call each, not one per stored task
+        yield [self.cache.clear_absent_multi(
+                   'tasks', dict((x['uuid'], task_readers(x)) for x in stored)),
+               filters['tasks'].add_multi([x['uuid'] for x in stored])]
+        return results
+
     @gen.coroutine
     def modify_task(self, account, task_uuid, struct):
         '''
@@ -288,63 +316,109 @@ class Tasks(object):
         # filter query
         filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
         # search query url
-        url = "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}".format(
-            self.solr, search_index, query, filter_query
-        )
+        url = get_search_item(self.solr, search_index, query, filter_query)
         # pretty please, ignore this list of fields from database.
         # if you want to include something in here, remember the _register.
         # example: labels_register.
         IGNORE_ME = ("_yz_id","_yz_rk","_yz_rt","_yz_rb")
-        # got callback response?
-        got_response = []
         # yours truly
         message = {'update_complete':False}
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
+        readers = []
         try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0010)
-            response = got_response[0].get('response')['docs'][0]
+            response = yield search_item(url)
             riak_key = str(response['_yz_rk'])
-            bucket = self.kvalue.bucket_type(bucket_type).bucket('{0}'.format(bucket_name))
-            bucket.set_properties({'search_index': search_index})
+            # listings before and after the change
+            readers = task_readers(TASK_CODEC.decode_doc(response), struct)
+            bucket = get_bucket(self.kvalue, bucket_type, bucket_name)
             task = Map(bucket, riak_key)
-            for key in struct:
-                if key not in IGNORE_ME:
-                    if type(struct.get(key)) == list:
-                        task.reload()
-                        old_value = task.registers['{0}'.format(key)].value
-                        if old_value:
-                            old_list = json.loads(old_value.replace("'",'"'))
-                            for thing in struct.get(key):
-                                old_list.append(thing)
-                            task.registers['{0}'.format(key)].assign(str(old_list))
-                        else:
-                            new_list = []
-                            for thing in struct.get(key):
-                                new_list.append(thing)
-                            task.registers['{0}'.format(key)].assign(str(new_list))
-                    else:
-                        task.registers['{0}'.format(key)].assign(str(struct.get(key)))
-                    task.update()
-            update_complete = True
-            message['update_complete'] = True
+            # one update carrying every change
+            message['update_complete'] = yield run_storage(
+                update_struct, task, struct, IGNORE_ME, codec=TASK_CODEC)
         except Exception as error:
             logging.exception(error)
+        # drop cached copies, reloads stay short until the index catches up
+        yield self.cache.invalidate(['tasks:{0}'.format(task_uuid.rstrip('/'))])
+        yield self.cache.bump(list_versions(readers))
+        yield self.cache.clear_absent('tasks', task_uuid.rstrip('/'), readers)
         return message.get('update_complete', False)
 
+    @gen.coroutine
+    def modify_task_bulk(self, account, struct, uuids=None, query=None, remove=False):
+        '''
+            Modify tasks in bulk
+
+            Tasks come from a uuid list or a search query, both limited
+            to the account. Riak keys are resolved with batched search
+            queries, changes are applied by bulk_concurrency workers.
+            One result per task: 200, 404 when not found, 400 when the
+            changes have nothing to apply and 500 on error.
+            Raises ValueError (or TypeError) on invalid changes and
+            SearchError when keys can't be resolved.
+        '''
+        # riak search index
+        search_index = 'mango_task_index'
+        # riak bucket type
+        bucket_type = 'mango_task'
+        # riak bucket name
+        bucket_name = 'tasks'
+        # every change a known field with a valid value, checked once,
+        # the converted values are the ones applied
+        changes = {}
+        for key, value in struct.items():
+            field = tasks.ModifyTask._fields.get(key)
+            if field is None or key in ('uuid', 'account'):
+                raise ValueError('{0} can not be modified in bulk'.format(key))
+            if isinstance(field, compound.ListType):
+                # a lone value is one element, not a string of them
+                value = set_things(value)
+            value = field.to_native(value)
+            field.validate(value)
+            changes[key] = field.to_primitive(value)
+        filter_query = 'account_register:{0}'.format(account)
+        # watchers of before the change, their listings change too
+        fields = ('watchers_set', 'watchers_register')
+        if uuids is not None:
+            # repeated uuids once, concurrent updates of one key race
+            targets = list(OrderedDict.fromkeys(uuids))
+            docs = yield search_uuid_docs(self.solr, search_index, targets, filter_query, fields)
+        else:
+            limit = self.settings.get('bulk_max_items', 5000)
+            docs = yield search_key_docs(self.solr, search_index, query, filter_query, limit,
+                                         fields=fields)
+            targets = sorted(docs)
+        keys = dict((key, doc['_yz_rk']) for key, doc in docs.items())
+        results = [{'uuid': x, 'status': 404} for x in targets]
+        pending = iter([(i, keys[x]) for i, x in enumerate(targets) if x in keys])
+        apply_struct = (remove_struct if remove else update_struct)
+        bucket = get_bucket(self.kvalue, bucket_type, bucket_name)
+
+        @gen.coroutine
+        def worker():
+            for index, riak_key in pending:
+                try:
+                    applied = yield run_storage(apply_struct, Map(bucket, riak_key),
+                                                changes, IGNORE_ME, codec=TASK_CODEC)
+                    if applied:
+                        results[index]['status'] = 200
+                    else:
+                        # nothing in changes applies, e.g. remove without lists
+                        results[index].update({'status': 400, 'error': 'nothing to change'})
+                except Exception as error:
+                    logging.error(error)
+                    results[index].update({'status': 500, 'error': str(error)})
+        concurrency = min(self.settings.get('bulk_concurrency', 16), len(keys))
+        yield [worker() for _ in range(concurrency)]
+        yield self.cache.invalidate(
+            [x['uuid'] for x in results if x['status'] == 200], key_prefix='tasks:')
+        readers = task_readers({'account': account}, changes, *[
+            TASK_CODEC.decode_doc(docs[x['uuid']]) for x in results if x['status'] == 200])
+        yield self.cache.bump(list_versions(readers))
+        added = task_readers({'watchers': changes.get('watchers')}) if not remove else ()
+        if added:
+            yield self.cache.clear_absent_multi('tasks', dict(
+                (x['uuid'], added) for x in results if x['status'] == 200))
+        return results
+
     @gen.coroutine
     def modify_remove(self, account, task_uuid, struct):
         '''
@@ -361,54 +435,30 @@ class Tasks(object):
         # filter query
         filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
         # search query url
-        url = "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}".format(
-            self.solr, search_index, query, filter_query
-        )
+        url = get_search_item(self.solr, search_index, query, filter_query)
         # pretty please, ignore this list of fields from database.
         # if you want to include something in here, remember the _register.
         # example: labels_register.
         IGNORE_ME = ("_yz_id","_yz_rk","_yz_rt","_yz_rb")
-        # got callback response?
-        got_response = []
         # yours truly
         message = {'update_complete':False}
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
+        readers = []
         try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # Please, don't be careless with the time.
-                yield gen.sleep(0.0010)
-            response = got_response[0].get('response')['docs'][0]
+            response = yield search_item(url)
             riak_key = str(response['_yz_rk'])
-            bucket = self.kvalue.bucket_type(bucket_type).bucket('{0}'.format(bucket_name))
-            bucket.set_properties({'search_index': search_index})
+            # listings before and after the change
+            readers = task_readers(TASK_CODEC.decode_doc(response), struct)
+            bucket = get_bucket(self.kvalue, bucket_type, bucket_name)
             task = Map(bucket, riak_key)
-            for key in struct:
-                if key not in IGNORE_ME:
-                    if type(struct.get(key)) == list:
-                        task.reload()
-                        old_value = task.registers['{0}'.format(key)].value
-                        if old_value:
-                            old_list = json.loads(old_value.replace("'",'"'))
-                            new_list = [x for x in old_list if x not in struct.get(key)]
-                            task.registers['{0}'.format(key)].assign(str(new_list))
-                            task.update()
-                            message['update_complete'] = True
-                    else:
-                        message['update_complete'] = False
+            # one fetch for the context, one update
+            message['update_complete'] = yield run_storage(
+                remove_struct, task, struct, IGNORE_ME, codec=TASK_CODEC)
         except Exception as error:
             logging.exception(error)
+        # drop cached copies, reloads stay short until the index catches up
+        yield self.cache.invalidate(['tasks:{0}'.format(task_uuid.rstrip('/'))])
+        yield self.cache.bump(list_versions(readers))
+        yield self.cache.clear_absent('tasks', task_uuid.rstrip('/'), readers)
         return message.get('update_complete', False)
 
     @gen.coroutine
@@ -421,3 +471,10 @@ class Tasks(object):
         struct['status'] = 'deleted'
         message = yield self.modify_task(account, task_uuid, struct)
         return message
+
+
+def configure_tasks(opts):
+    '''
+        Configure task search filters from mango options
+    '''
+    _settings['legacy_watchers'] = opts.legacy_watchers
@@ -10,7 +10,6 @@ __author__ = 'Team Machine'
 
 
 import arrow
-import uuid
 import logging
 import ujson as json
 from tornado import gen
@@ -18,15 +17,15 @@ from schematics.types import compound
 from mango.system import update_struct, remove_struct
 from mango.schemas import teams
 from mango.schemas import BaseResult
-from mango.schemas.teams import TeamMap
+from mango.schemas.teams import TeamMap, TEAM_CODEC, TEAM_VALIDATOR
 from riak.datatypes import Map
-from mango.tools import clean_response, clean_structure
-from mango.tools import get_search_item, get_search_list
-from tornado import httpclient as _http_client
-
-
-_http_client.AsyncHTTPClient.configure('tornado.curl_httpclient.CurlAsyncHTTPClient')
-http_client = _http_client.AsyncHTTPClient()
+from mango.tools import clean_response, make_etag
+from mango.tools.http import http_client
+from mango.tools.search import IGNORE_ME, SearchError
+from mango.tools.buckets import get_bucket
+from mango.tools.storage import run_storage
+from mango.tools.search import get_search_item, get_search_page, get_search_batch
+from mango.tools.search import search_item, search_list, search_page
 
 
 class TeamsResult(BaseResult):
@@ -49,93 +48,86 @@ class Teams(object):
         query = 'uuid_register:{0}'.format(team_uuid)
         filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
         url = get_search_item(self.solr, search_index, query, filter_query)
-        # init got response list
-        got_response = []
-        # init crash message
+        # search errors go up, they are no answer about the team
         message = {'message': 'not found'}
-        # ignore riak fields
-        __ignore = ["_yz_id","_yz_rk","_yz_rt","_yz_rb"]
-        # hopefully asynchronous handle function request
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
+        response = yield search_item(url)
+        if response:
+            message = TEAM_CODEC.decode_doc(response)
+        return message
+
+    @gen.coroutine
+    def get_team_batch(self, account, uuids):
+        '''
+            Get teams by uuid in one search query, {uuid: team}
+        '''
+        search_index = 'mango_team_index'
+        filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
+        url = get_search_batch(self.solr, search_index, uuids, filter_query)
+        message = {}
         try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            stuff = got_response[0]
-            if stuff['response']['numFound']:
-                response = stuff['response']['docs'][0]
-                message = clean_response(response, __ignore)
-        except Exception as error:
+            count, docs = yield search_list(url)
+            for doc in docs:
+                team = TEAM_CODEC.decode_doc(doc)
+                message[team['uuid']] = team
+        except SearchError as error:
             logging.warning(error)
         return message
 
     @gen.coroutine
-    def get_team_list(self, account, start, end, lapse, status, page_num):
+    def get_team_list(self, account, start, end, lapse, status, page_num, cursor=None):
         '''
             Get team list
-        '''
-        search_index = 'mango_team_index'
-        query = 'uuid_register:*'
-        filter_status = 'status_register:active'
-        filter_account = 'account_register:{0}'.format(account.decode('utf-8'))
 
+            Pages are cached under the account teams version, writes
+            on the account teams bump it.
+        '''
         # page number
         page_num = int(page_num)
         page_size = self.settings['page_size']
-        start_num = page_size * (page_num - 1)
+        key = yield self.cache.page_key('teams', account.decode('utf-8'),
+                                        start, end, lapse, status, page_num, page_size, cursor)
+        try:
+            message, self.etag = yield self.cache.read_tagged(
+                key, lambda: self.search_team_list(account, page_num, page_size, cursor),
+                make_etag, settle='versions:teams:{0}'.format(account.decode('utf-8')))
+        except (SearchError, ValueError) as error:
+            logging.warning(error)
+            # clean response message
+            message = {
+                'count': 0,
+                'page': page_num,
+                'cursor': None,
+                'results': []
+            }
+        return message
 
+    @gen.coroutine
+    def search_team_list(self, account, page_num, page_size, cursor=None):
+        '''
+            Team list page from the search index
+        '''
+        search_index = 'mango_team_index'
+        query = 'uuid_register:*'
+        filter_status = 'status_register:active'
+        filter_account = 'account_register:{0}'.format(account.decode('utf-8'))
         filter_query = '(({0})AND({1}))'.format(filter_status, filter_account)
-        url = get_search_list(self.solr, search_index, query, filter_query, start_num, page_size)
-
-        # init got response list
-        got_response = []
-        # clean response message
         message = {
             'count': 0,
             'page': page_num,
+            'cursor': None,
             'results': []
         }
-        __ignore = ["_yz_id","_yz_rk","_yz_rt","_yz_rb"]
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
-        try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            stuff = got_response[0]
-            if stuff['response']['numFound']:
-                message['count'] += stuff['response']['numFound']
-                for doc in stuff['response']['docs']:
-                    message['results'].append(clean_response(doc, __ignore))
-            else:
-                logging.error('there is probably something wrong! get list campaign')
-        except Exception as error:
-            logging.warning(error)
+        url, cursor_mark = get_search_page(self.solr, search_index, query, filter_query,
+                                           page_num, page_size, cursor)
+        stuff, message['cursor'] = yield search_page(url, cursor_mark)
+        if stuff['numFound']:
+            message['count'] += stuff['numFound']
+            for doc in stuff['docs']:
+                message['results'].append(TEAM_CODEC.decode_doc(doc))
+        else:
+            logging.error('there is probably something wrong! get list campaign')
         return message
-    
+
     @gen.coroutine
     def uuid_from_account(self, username):
         '''
@@ -146,44 +138,23 @@ class Teams(object):
         filter_query = 'account_register:{0}'.format(username)
 
         url = get_search_item(self.solr, search_index, query, filter_query)
-        # init got response list
-        got_response = []
         # init crash message
         message = {'message': 'not found'}
         # ignore riak fields
-        __ignore = [
-            "_yz_id","_yz_rk","_yz_rt","_yz_rb",
+        __ignore = IGNORE_ME + (
             # CUSTOM FIELDS
             "name_register",
             "description_register",
             "teams_register",
             "members_register"
-        ]
-        # hopefully asynchronous handle function request
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
+        )
         try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)
-            stuff = got_response[0]
-            if stuff['response']['numFound']:
-                response = stuff['response']['docs'][0]
+            response = yield search_item(url)
+            if response:
                 message = clean_response(response, __ignore)
-        except Exception as error:
-            logging.warning(error)        
-        return message['uuid']
+        except SearchError as error:
+            logging.warning(error)
+        return message.get('uuid')
 
     @gen.coroutine
     def add_team(self, username, org_account, org_uuid, team_name, team_uuid):
@@ -193,8 +164,6 @@ class Teams(object):
         user_uuid = yield self.uuid_from_account(username)
         orgs_url = 'https://{0}/orgs/{1}'.format(self.domain, org_uuid)
         user_url = 'https://{0}/users/{1}'.format(self.domain, user_uuid)
-        # got callback response?
-        got_response = []
         # yours truly
         headers = {'content-type':'application/json'}
         # and know for something completly different
@@ -213,35 +182,23 @@ class Teams(object):
             'last_update_at': arrow.utcnow().timestamp,
             'last_update_by': username,
         }
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
+        message = {'error': True}
         try:
-            http_client.fetch(
-                orgs_url,
-                method='PATCH',
-                headers=headers,
-                body=json.dumps(orgs),
-                callback=handle_request
-            )
-            http_client.fetch(
-                user_url,
-                method='PATCH',
-                headers=headers,
-                body=json.dumps(users),
-                callback=handle_request
-            )
-            while len(got_response) <= 1:
-                # don't be careless with the time.
-                yield gen.sleep(0.0021)            
+            responses = yield [
+                http_client.fetch(orgs_url,
+                                  method='PATCH',
+                                  headers=headers,
+                                  body=json.dumps(orgs)),
+                http_client.fetch(user_url,
+                                  method='PATCH',
+                                  headers=headers,
+                                  body=json.dumps(users)),
+            ]
+            message = json.loads(responses[0].body)
         except Exception as error:
             logging.error(error)
-        return got_response[0]
+            message['message'] = str(error)
+        return message
 
     @gen.coroutine
     def new_team(self, struct):
@@ -252,40 +209,21 @@ class Teams(object):
         bucket_type = 'mango_team'
         bucket_name = 'teams'
         try:
-            event = teams.Team(struct)
-            event.validate()
-            event = clean_structure(event)
+            event = TEAM_VALIDATOR.clean(struct)
         except Exception as error:
             raise error
         try:
             message = event.get('uuid')
-            structure = {
-                "uuid": str(event.get('uuid', str(uuid.uuid4()))),
-                "account": str(event.get('account', 'pebkac')),
-                "status": str(event.get('status', '')),
-                "name": str(event.get('name', '')),
-                "permission": str(event.get('permission', '')),
-                "members": str(event.get('members', '')),
-                "resources": str(event.get('resources', '')),
-                "labels": str(event.get('labels', '')),
-                "history": str(event.get('history', '')),
-                "checked": str(event.get('checked', '')),
-                "checked_by": str(event.get('checked_by', '')),
-                "checked_at": str(event.get('checked_at', '')),
-                "created_by": str(event.get('created_by', '')),
-                "created_at": str(event.get('created_at', '')),
-                "last_update_by": str(event.get('last_update_by', '')),
-                "last_update_at": str(event.get('last_update_at', '')),
-                "description": str(event.get('description', '')),
-            }
-            result = TeamMap(
+            result = yield run_storage(
+                TeamMap,
                 self.kvalue,
                 bucket_name,
                 bucket_type,
                 search_index,
-                structure
+                event
             )
-            message = structure.get('uuid')
+            message = event.get('uuid')
+            yield self.cache.bump(['teams:{0}'.format(event.get('account'))])
         except Exception as error:
             logging.error(error)
             message = str(error)
@@ -307,43 +245,25 @@ class Teams(object):
         # filter query
         filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
         # search query url
-        url = "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}".format(
-            self.solr, search_index, query, filter_query
-        )
+        url = get_search_item(self.solr, search_index, query, filter_query)
         logging.warning(url)
         
         # pretty please, ignore this list of fields from database.
         IGNORE_ME = ("_yz_id","_yz_rk","_yz_rt","_yz_rb","checked","keywords")
-        # got http callback response
-        got_response = []
         # default return message
         message = {'update_complete':False}
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
         try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # don't be careless with the time.
-                yield gen.sleep(0.0010)
-            response = got_response[0].get('response')['docs'][0]
+            response = yield search_item(url)
             riak_key = str(response['_yz_rk'])
-            bucket = self.kvalue.bucket_type(bucket_type).bucket('{0}'.format(bucket_name))
-            bucket.set_properties({'search_index': search_index})
+            bucket = get_bucket(self.kvalue, bucket_type, bucket_name)
             team = Map(bucket, riak_key)
-            # TODO: measure if there is value on make update_struct a yielding coroutine!
-            message['update_complete'] = update_struct(team, struct, IGNORE_ME)
+            message['update_complete'] = yield run_storage(
+                update_struct, team, struct, IGNORE_ME, codec=TEAM_CODEC)
         except Exception as error:
             logging.exception(error)
+        # drop cached copies, reloads stay short until the index catches up
+        yield self.cache.invalidate(['teams:{0}'.format(team_uuid.rstrip('/'))])
+        yield self.cache.bump(['teams:{0}'.format(account.decode('utf-8'))])
         return message.get('update_complete', False)
 
     @gen.coroutine
@@ -362,52 +282,24 @@ class Teams(object):
         # filter query
         filter_query = 'account_register:{0}'.format(account.decode('utf-8'))
         # search query url
-        url = "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}".format(
-            self.solr, search_index, query, filter_query
-        )
+        url = get_search_item(self.solr, search_index, query, filter_query)
         # pretty please, ignore this list of fields from database.
         IGNORE_ME = ("_yz_id","_yz_rk","_yz_rt","_yz_rb","checked","keywords")
-        # got callback response?
-        got_response = []
         # yours truly
         message = {'update_complete':False}
-        def handle_request(response):
-            '''
-                Request Async Handler
-            '''
-            if response.error:
-                logging.error(response.error)
-                got_response.append({'error':True, 'message': response.error})
-            else:
-                got_response.append(json.loads(response.body))
         try:
-            http_client.fetch(
-                url,
-                callback=handle_request
-            )
-            while len(got_response) == 0:
-                # Please, don't be careless with the time.
-                yield gen.sleep(0.0010)
-            response = got_response[0].get('response')['docs'][0]
+            response = yield search_item(url)
             riak_key = str(response['_yz_rk'])
-            bucket = self.kvalue.bucket_type(bucket_type).bucket('{0}'.format(bucket_name))
-            bucket.set_properties({'search_index': search_index})
+            bucket = get_bucket(self.kvalue, bucket_type, bucket_name)
             team = Map(bucket, riak_key)
-            for key in struct:
-                if key not in IGNORE_ME:
-                    if type(struct.get(key)) == list:
-                        team.reload()
-                        old_value = team.registers['{0}'.format(key)].value
-                        if old_value:
-                            old_list = json.loads(old_value.replace("'",'"'))
-                            new_list = [x for x in old_list if x not in struct.get(key)]
-                            team.registers['{0}'.format(key)].assign(str(new_list))
-                            team.update()
-                            message['update_complete'] = True
-                    else:
-                        message['update_complete'] = False
+            # one fetch for the context, one update
+            message['update_complete'] = yield run_storage(
+                remove_struct, team, struct, IGNORE_ME, codec=TEAM_CODEC)
         except Exception as error:
             logging.exception(error)
+        # drop cached copies, reloads stay short until the index catches up
+        yield self.cache.invalidate(['teams:{0}'.format(team_uuid.rstrip('/'))])
+        yield self.cache.bump(['teams:{0}'.format(account.decode('utf-8'))])
         return message.get('update_complete', False)
 
     @gen.coroutine
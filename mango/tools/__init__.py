@@ -6,33 +6,40 @@
 __author__ = 'Jean Chassoul'
 
 
+import re
 import arrow
+import hashlib
 import ujson as json
 import logging
-import uuid
 from tornado import gen
+from mango.tools.search import get_search_item, get_search_list
 
 
-def get_search_item():
-    pass
-
-def get_search_list():
-    pass
+# the canonical form str(uuid.uuid4()) gives, version 4 and rfc 4122 variant
+UUID4 = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}\Z')
 
 
 def validate_uuid4(uuid_string):
     '''
         Validate that a UUID string is in fact a valid uuid4.
 
-        Happily, the uuid module does the actual checking.
+        Canonical lowercase form only, checked without parsing so
+        malformed ids are turned down before any I/O.
     '''
-    try:
-        val = uuid.UUID(uuid_string, version=4)
-    except ValueError:
-        # If it's a value error, then the string
-        # is not a valid hex code for a UUID.
-        return False
-    return str(val) == uuid_string
+    return isinstance(uuid_string, str) and UUID4.match(uuid_string) is not None
+
+
+def make_etag(message):
+    '''
+        Strong etag of a response, last_update_at and a content hash
+
+        Lists have no last_update_at of their own, their count and
+        hash are used instead.
+    '''
+    stamp = message.get('last_update_at', message.get('count', 0))
+    body = json.dumps(message, sort_keys=True).encode('utf-8')
+    digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+    return '"{0}-{1}"'.format(str(stamp).replace('"', '').replace(' ', 'T'), digest)
 
 
 def get_average(total, marks):
@@ -63,6 +70,23 @@ def check_json(struct):
     return message
 
 
+@gen.coroutine
+def check_bulk(body):
+    '''
+        Bulk body as a list, from a JSON array or NDJSON lines
+
+        Raises ValueError on malformed input.
+    '''
+    body = body.strip()
+    if body.startswith(b'['):
+        message = json.loads(body)
+    else:
+        message = [json.loads(line) for line in body.splitlines() if line.strip()]
+    if not all(isinstance(item, dict) for item in message):
+        raise ValueError('bulk items must be JSON objects')
+    return message
+
+
 @gen.coroutine
 def check_times(start, end):
     '''
@@ -111,47 +135,106 @@ def check_times_get_datetime(start, end):
     return message
 
 
+# compiled field converters by model class and format
+_converters = {}
+
+
+def field_converters(model, native=False):
+    '''
+        (name, converter) of every model field, compiled once per model
+
+        Primitive converters are the fields own to_primitive, native
+        values are already native except for compound fields.
+    '''
+    key = (model, native)
+    converters = _converters.get(key)
+    if converters is None:
+        if native:
+            converters = tuple(
+                (name, field.to_native if field.is_compound else None)
+                for name, field in model._fields.items())
+        else:
+            converters = tuple(
+                (name, field.to_primitive) for name, field in model._fields.items())
+        _converters[key] = converters
+    return converters
+
+
+def serialize(struct, native=False):
+    '''
+        One pass over a model instance data, nulls dropped
+    '''
+    data = struct._data
+    message = {}
+    for name, convert in field_converters(type(struct), native):
+        value = data.get(name)
+        if value is None:
+            continue
+        if convert is not None:
+            value = convert(value)
+            if value is None:
+                continue
+        message[name] = value
+    return message
+
+
+def encode_json(message):
+    '''
+        UTF-8 json bytes of a response, slashes left alone
+    '''
+    return json.dumps(message, ensure_ascii=False,
+                      escape_forward_slashes=False).encode('utf-8')
+
+
 def clean_message(struct):
     '''
         clean message
     '''
-    struct = struct.to_native()
-    struct = {
-        key: struct[key] for key in struct
-        if struct[key] is not None
-    }
-    return struct
+    return serialize(struct, native=True)
 
 
 def clean_structure(struct):
     '''
         clean structure
     '''
-    struct = struct.to_primitive()
-    struct = {
-        key: struct[key] for key in struct
-        if struct[key] is not None
-    }
-    return struct
+    return serialize(struct)
 
 
 def clean_results(results):
     '''
         clean results
     '''
-    results = results.to_primitive()
-    results = results.get('results')
-    results = [
-        {
-            key: dic[key] for key in dic
-            if dic[key] is not None
-        } for dic in results
-    ]
-    return {'results': results}
+    return {'results': [serialize(x) for x in (results._data.get('results') or [])]}
 
 
-def clean_response():
-    pass
+def clean_field(key):
+    '''
+        Drop the riak datatype suffix from a search field name
+    '''
+    for suffix in ('_register', '_set'):
+        if key.endswith(suffix):
+            return key[:-len(suffix)]
+    return key
+
+
+def clean_response(response, ignore):
+    '''
+        clean response
+    '''
+    return dict(
+        (clean_field(key), value)
+        for (key, value) in response.items()
+        if key not in ignore
+    )
+
+
+def owned_by(stuff, account):
+    '''
+        Python side of the account_register filter, for cached resources
+    '''
+    if isinstance(account, bytes):
+        account = account.decode('utf-8')
+    return stuff.get('account') == account
 
 
 def str2bool(boo):
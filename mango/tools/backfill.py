@@ -0,0 +1,80 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+import logging
+from tornado import gen
+from tornado import ioloop
+from riak.datatypes import Map
+from mango.system import backfill_struct
+from mango.schemas.accounts import ACCOUNT_CODEC
+from mango.schemas.tasks import TASK_CODEC
+from mango.schemas.teams import TEAM_CODEC
+from mango.tools import options
+from mango.tools.buckets import get_bucket
+from mango.tools.cluster import riak_client
+from mango.tools.http import configure_client
+from mango.tools.search import KEY_BATCH, get_search_keys, search_body
+from mango.tools.storage import configure_executor, run_storage
+
+
+# bucket type, bucket name, search index and codec of every map with sets
+SETS = (
+    ('mango_account', 'accounts', 'mango_account_index', ACCOUNT_CODEC),
+    ('mango_task', 'tasks', 'mango_task_index', TASK_CODEC),
+    ('mango_team', 'teams', 'mango_team_index', TEAM_CODEC),
+)
+
+
+@gen.coroutine
+def backfill_sets(kvalue, solr, bucket_type, bucket_name, search_index, codec,
+                  page_size=KEY_BATCH):
+    '''
+        Move the set and log fields of one bucket out of their legacy registers
+
+        Walks the objects with any of those registers indexed, a page
+        at a time, returns how many objects were updated.
+    '''
+    bucket = get_bucket(kvalue, bucket_type, bucket_name)
+    query = ' OR '.join('{0}_register:[* TO *]'.format(x)
+                        for x in codec.set_names + codec.log_names)
+    cursor_mark = '*'
+    moved = 0
+    while True:
+        url = get_search_keys(solr, search_index, query, '*:*', cursor_mark, page_size)
+        stuff = yield search_body(url)
+        done = yield [run_storage(backfill_struct, Map(bucket, doc['_yz_rk']), codec=codec)
+                      for doc in stuff['response']['docs']]
+        moved += sum(1 for x in done if x)
+        next_mark = stuff.get('nextCursorMark')
+        if not next_mark or next_mark == cursor_mark:
+            break
+        cursor_mark = next_mark
+    logging.info('{0} {1} objects moved to sets'.format(moved, bucket_name))
+    return moved
+
+
+def main():
+    '''
+        One-off backfill, run before turning legacy_watchers off
+    '''
+    opts = options.options()
+    configure_client(opts)
+    configure_executor(opts)
+    kvalue = riak_client(opts)
+    solr = '{0}:{1}'.format(opts.riak_host, opts.riak_http_port)
+
+    @gen.coroutine
+    def run():
+        for bucket_type, bucket_name, search_index, codec in SETS:
+            yield backfill_sets(kvalue, solr, bucket_type, bucket_name, search_index, codec)
+
+    ioloop.IOLoop.current().run_sync(run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+import logging
+
+
+# bucket type, bucket name and search index of every map bucket we write
+BINDINGS = (
+    ('mango_account', 'accounts', 'mango_account_index'),
+    ('mango_task', 'tasks', 'mango_task_index'),
+    ('mango_team', 'teams', 'mango_team_index'),
+)
+
+# resolved bucket handles by (bucket_type, bucket_name)
+_registry = {}
+
+
+class BindingError(Exception):
+    '''
+        Bucket not bound to the search index we expect
+    '''
+
+
+def get_bucket(client, bucket_type, bucket_name):
+    '''
+        Resolved bucket handle, built once per process
+    '''
+    key = (bucket_type, bucket_name)
+    bucket = _registry.get(key)
+    if bucket is None:
+        bucket = client.bucket_type(bucket_type).bucket('{0}'.format(bucket_name))
+        _registry[key] = bucket
+    return bucket
+
+
+def verify_buckets(client, bindings=BINDINGS):
+    '''
+        Check every search index binding once at startup
+
+        Writes never set bucket properties, so a bucket without its
+        search index would silently drop out of search, raise instead.
+    '''
+    for bucket_type, bucket_name, search_index in bindings:
+        bucket = get_bucket(client, bucket_type, bucket_name)
+        bound = bucket.get_properties().get('search_index')
+        if bound != search_index:
+            raise BindingError(
+                'bucket {0}/{1} search_index is {2}, expected {3}'.format(
+                    bucket_type, bucket_name, bound, search_index))
+        logging.info('bucket {0}/{1} bound to {2}'.format(
+            bucket_type, bucket_name, search_index))
+    return True
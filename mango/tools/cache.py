@@ -0,0 +1,584 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+import math
+import time
+import uuid
+import hashlib
+import random
+import logging
+import pylibmc
+from datetime import timedelta
+from tornado import gen
+from tornado.ioloop import IOLoop
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# list versions outlive the pages cached under them
+VERSION_TTL = 86400
+
+# memcached calls waiting or blocked per pooled client before reads
+# are skipped, writes and deletes always queue, they carry invalidations
+PENDING_PER_CLIENT = 4
+
+# memcached calls answered as a miss when skipped
+READS = frozenset(['get', 'get_multi'])
+
+# cache settings, overwritten by configure_cache from mango options
+_settings = {
+    'servers': [],
+    'pool_size': 16,
+    'timeout': 0.5,
+    'lru_size': 10000,
+    'local_ttl': 2,
+    'default_ttl': 30,
+    'ttls': {},
+    'stale_ttl': 30,
+    'early_beta': 1.0,
+    'negative_ttl': 5,
+    'settle_ttl': 3,
+}
+
+
+# memcached executor state, apart from the riak storage executor
+_state = {
+    'executor': None,
+    'pending': 0,
+}
+
+
+def get_executor():
+    '''
+        Thread pool for blocking memcached calls, one per pooled client
+
+        A slow or down memcached holds these threads only, riak calls
+        keep their own executor.
+    '''
+    if _state['executor'] is None:
+        _state['executor'] = ThreadPoolExecutor(
+            max_workers=_settings['pool_size'],
+            thread_name_prefix='mango-memcached')
+    return _state['executor']
+
+
+def _done(future):
+    '''
+        Count finished memcached work, runs back on the IOLoop
+    '''
+    _state['pending'] -= 1
+
+
+class LRU(object):
+    '''
+        Bounded in-process LRU with per entry expiry
+    '''
+
+    def __init__(self, size=10000):
+        self.size = size
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl):
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class Cache(object):
+    '''
+        Two tier read-through cache, in-process LRU in front of memcached
+
+        Keys are '<resource>:<id>', the resource picks the ttl. Local
+        entries live at most local_ttl seconds, that bounds how long a
+        process can miss an invalidation done by another one. Without
+        memcached servers only the local tier is used.
+
+        The local tier is read and written on the IOLoop, memcached
+        calls run on their own executor and give up after timeout
+        seconds, so every method touching it returns a future. Reads
+        piling up behind a stuck memcached are skipped as misses.
+
+        Both tiers keep (value, expires, delta, tag) envelopes, delta is
+        how long the value took to load and tag an optional etag computed
+        once per load. Plain gets only return fresh values,
+        read_through also coalesces concurrent loads of a key, refreshes
+        early with a probability growing near expiry (xfetch) and serves
+        stale values for stale_ttl seconds while a refresh runs.
+
+        Writes reach the search index about a second later. Keys
+        invalidated and versions bumped are marked settling for
+        settle_ttl seconds, values loaded meanwhile may predate the
+        write and are only kept for settle_ttl.
+    '''
+
+    def __init__(self):
+        self.lru = LRU(_settings['lru_size'])
+        self._pool = None
+        self._flights = {}
+        self.hits = 0
+        self.local_hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.deletes = 0
+        self.errors = 0
+        self.loads = 0
+        self.coalesced = 0
+        self.early_refreshes = 0
+        self.stale_hits = 0
+
+    @property
+    def pool(self):
+        if self._pool is None and _settings['servers']:
+            client = pylibmc.Client(_settings['servers'], binary=True,
+                                    behaviors={'tcp_nodelay': True,
+                                               'ketama': True,
+                                               'connect_timeout': 250,
+                                               'send_timeout': 250000,
+                                               'receive_timeout': 250000})
+            self._pool = pylibmc.ClientPool(client, _settings['pool_size'])
+            logging.info('memcached pool ready {0}'.format(_settings['servers']))
+        return self._pool
+
+    @property
+    def settle_ttl(self):
+        return _settings['settle_ttl']
+
+    def ttl(self, key):
+        '''
+            Seconds to keep key, from its resource prefix
+        '''
+        resource = key.split(':', 1)[0]
+        return _settings['ttls'].get(resource, _settings['default_ttl'])
+
+    @gen.coroutine
+    def _remote(self, method, *args, **kwargs):
+        '''
+            Memcached call off the IOLoop, None on errors and timeouts
+        '''
+        pool = self.pool
+        if pool is None:
+            return None
+        if (method in READS and
+                _state['pending'] >= _settings['pool_size'] * PENDING_PER_CLIENT):
+            # timed out calls still hold their threads, a miss is cheaper
+            self.errors += 1
+            return None
+
+        def call():
+            with pool.reserve() as client:
+                return getattr(client, method)(*args, **kwargs)
+        _state['pending'] += 1
+        future = IOLoop.current().run_in_executor(get_executor(), call)
+        future.add_done_callback(_done)
+        try:
+            result = yield gen.with_timeout(timedelta(seconds=_settings['timeout']), future)
+        except gen.TimeoutError:
+            self.errors += 1
+            logging.warning('memcached {0} timed out'.format(method))
+            return None
+        except pylibmc.Error as error:
+            self.errors += 1
+            logging.warning('memcached {0} {1}'.format(method, error))
+            return None
+        return result
+
+    def _keep(self, key, entry):
+        '''
+            Keep an envelope locally, at most local_ttl seconds
+        '''
+        remaining = entry[1] + _settings['stale_ttl'] - time.time()
+        if remaining > 0:
+            self.lru.set(key, entry, min(remaining, _settings['local_ttl']))
+
+    @gen.coroutine
+    def _entry(self, key):
+        '''
+            Envelope of key from the first tier that has it, fresh or stale
+        '''
+        entry = self.lru.get(key)
+        if entry is not None:
+            self.local_hits += 1
+            return entry
+        entry = yield self._remote('get', key)
+        if entry is not None:
+            self._keep(key, entry)
+        return entry
+
+    def _envelope(self, key, value, ttl=None, delta=0.0, tag=None):
+        ttl = (ttl if ttl else self.ttl(key))
+        return (value, time.time() + ttl, delta, tag), ttl + _settings['stale_ttl']
+
+    @gen.coroutine
+    def get(self, key):
+        entry = yield self._entry(key)
+        if entry is None or entry[1] <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    @gen.coroutine
+    def get_multi(self, keys, key_prefix=''):
+        '''
+            Fresh values by key without prefix, one remote call for the rest
+        '''
+        entries = {}
+        missing = []
+        for key in keys:
+            entry = self.lru.get(key_prefix + key)
+            if entry is None:
+                missing.append(key)
+            else:
+                entries[key] = entry
+        self.local_hits += len(entries)
+        if missing:
+            remote = (yield self._remote('get_multi', missing, key_prefix=key_prefix)) or {}
+            for key, entry in remote.items():
+                self._keep(key_prefix + key, entry)
+            entries.update(remote)
+        now = time.time()
+        found = dict((key, x[0]) for key, x in entries.items() if x[1] > now)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    @gen.coroutine
+    def set(self, key, value, ttl=None, delta=0.0, tag=None):
+        entry, remote_ttl = self._envelope(key, value, ttl, delta, tag)
+        self.sets += 1
+        self._keep(key, entry)
+        yield self._remote('set', key, entry, time=int(remote_ttl))
+        return True
+
+    @gen.coroutine
+    def add(self, key, value, ttl=None):
+        '''
+            Set key unless a fresh value is already there
+        '''
+        current = yield self.get(key)
+        if current is not None:
+            return False
+        entry, remote_ttl = self._envelope(key, value, ttl)
+        if self.pool is not None:
+            added = yield self._remote('add', key, entry, time=int(remote_ttl))
+            if not added:
+                return False
+        self.sets += 1
+        self._keep(key, entry)
+        return True
+
+    @gen.coroutine
+    def set_multi(self, mapping, ttl=None, key_prefix=''):
+        entries = {}
+        for key, value in mapping.items():
+            entries[key], remote_ttl = self._envelope(key_prefix + key, value, ttl)
+            self._keep(key_prefix + key, entries[key])
+        self.sets += len(mapping)
+        if entries:
+            yield self._remote('set_multi', entries, time=int(remote_ttl),
+                               key_prefix=key_prefix)
+        return True
+
+    @gen.coroutine
+    def delete(self, key):
+        self.lru.delete(key)
+        self.deletes += 1
+        yield self._remote('delete', key)
+        return True
+
+    @gen.coroutine
+    def delete_multi(self, keys, key_prefix=''):
+        for key in keys:
+            self.lru.delete(key_prefix + key)
+        self.deletes += len(keys)
+        if keys:
+            yield self._remote('delete_multi', list(keys), key_prefix=key_prefix)
+        return True
+
+    @gen.coroutine
+    def settle(self, names):
+        '''
+            Mark names as just written, see settling
+        '''
+        names = set(names)
+        if names and _settings['settle_ttl']:
+            yield self.set_multi(dict.fromkeys(names, True), _settings['settle_ttl'],
+                                 key_prefix='settle:')
+        return True
+
+    @gen.coroutine
+    def settling(self, names, key_prefix=''):
+        '''
+            Which of names were written less than settle_ttl seconds ago
+        '''
+        if not _settings['settle_ttl']:
+            return set()
+        prefix = 'settle:' + key_prefix
+        entries = {}
+        missing = []
+        for name in names:
+            entry = self.lru.get(prefix + name)
+            if entry is None:
+                missing.append(name)
+            else:
+                entries[name] = entry
+        if missing:
+            remote = yield self._remote('get_multi', missing, key_prefix=prefix)
+            entries.update(remote or {})
+        now = time.time()
+        return set(name for name, entry in entries.items() if entry[1] > now)
+
+    @gen.coroutine
+    def invalidate(self, keys, key_prefix=''):
+        '''
+            Drop keys after a write, loads in the next settle_ttl stay short
+        '''
+        keys = list(keys)
+        yield [self.delete_multi(keys, key_prefix=key_prefix),
+               self.settle(key_prefix + x for x in keys)]
+        return True
+
+    @gen.coroutine
+    def is_absent(self, resource, uuid, account):
+        '''
+            Did resource uuid come back not found for account lately
+        '''
+        absent = yield self.get('{0}:absent:{1}:{2}'.format(resource, uuid, account))
+        return bool(absent)
+
+    @gen.coroutine
+    def set_absent(self, resource, uuid, account):
+        if _settings['negative_ttl']:
+            yield self.set('{0}:absent:{1}:{2}'.format(resource, uuid, account),
+                           True, _settings['negative_ttl'])
+
+    @gen.coroutine
+    def clear_absent(self, resource, uuid, accounts):
+        '''
+            Forget not found answers of uuid for accounts
+        '''
+        accounts = set(accounts)
+        if accounts:
+            yield self.delete_multi([
+                '{0}:absent:{1}:{2}'.format(resource, uuid, x) for x in accounts])
+
+    @gen.coroutine
+    def clear_absent_multi(self, resource, readers):
+        '''
+            clear_absent of many uuids in one call, readers {uuid: accounts}
+        '''
+        yield self.delete_multi([
+            '{0}:absent:{1}:{2}'.format(resource, uuid, x)
+            for uuid, accounts in readers.items() for x in set(accounts)])
+
+    @gen.coroutine
+    def version(self, name):
+        '''
+            Current version token of name, a new one when there is none
+
+            Tokens are random, a version that expired never comes back
+            and pages cached under it are never read again.
+        '''
+        key = 'versions:{0}'.format(name)
+        token = yield self.get(key)
+        if token is None:
+            token = uuid.uuid4().hex
+            added = yield self.add(key, token, VERSION_TTL)
+            if not added:
+                token = (yield self.get(key)) or token
+        return token
+
+    @gen.coroutine
+    def bump(self, names):
+        '''
+            New version tokens for names, pages under the old ones go cold
+        '''
+        names = set(names)
+        if names:
+            yield [self.set_multi(dict((name, uuid.uuid4().hex) for name in names),
+                                  VERSION_TTL, key_prefix='versions:'),
+                   self.settle('versions:' + x for x in names)]
+        return True
+
+    @gen.coroutine
+    def page_key(self, resource, account, *params):
+        '''
+            List page key under the current account version of resource
+        '''
+        name = '{0}:{1}'.format(resource, account)
+        digest = hashlib.md5(repr(params).encode('utf-8')).hexdigest()
+        version = yield self.version(name)
+        return '{0}:list:{1}:{2}:{3}'.format(resource, account, version, digest)
+
+    @gen.coroutine
+    def _load(self, key, loader, keep, tag, settle=None):
+        '''
+            Run loader and cache what it returns when keep says so
+
+            Values loaded while key, or settle in its place, is
+            settling are kept settle_ttl seconds only.
+        '''
+        self.loads += 1
+        start = time.time()
+        settling = yield self.settling([settle or key])
+        value = yield loader()
+        etag = None
+        if keep(value):
+            etag = (tag(value) if tag else None)
+            ttl = (_settings['settle_ttl'] if settling else None)
+            yield self.set(key, value, ttl, delta=time.time() - start, tag=etag)
+        return value, etag
+
+    def _flight(self, flight, key, loader, keep, tag, settle=None):
+        '''
+            One load per flight key, concurrent callers share its future
+        '''
+        future = self._flights.get(flight)
+        if future is not None:
+            self.coalesced += 1
+            return future
+        future = self._load(key, loader, keep, tag, settle)
+        self._flights[flight] = future
+        future.add_done_callback(lambda done: self._flights.pop(flight, None))
+        return future
+
+    def _refresh(self, key, loader, keep, tag, settle=None):
+        '''
+            Background refresh, one per key
+        '''
+        def done(future):
+            if future.exception() is not None:
+                logging.warning('cache refresh {0} {1}'.format(key, future.exception()))
+        IOLoop.current().add_future(self._flight(key, key, loader, keep, tag, settle), done)
+
+    @gen.coroutine
+    def read_tagged(self, key, loader, tag, keep=None, flight=None, settle=None,
+                    refresh=None):
+        '''
+            Cached (value, etag) of key, loader() on a miss
+
+            tag(value) gives the etag, computed once per load and kept
+            with the value. keep(value) decides what gets cached, flight
+            groups callers that can share a foreground load (defaults
+            to key) and settle names the write marker of key (defaults
+            to key, list pages use their version). refresh(value) says
+            if this caller's loader may refresh the cached value in the
+            background, the refresh is shared by every caller of key.
+        '''
+        keep = (keep if keep else (lambda value: value is not None))
+        refresh = (refresh if refresh else (lambda value: True))
+        entry = yield self._entry(key)
+        now = time.time()
+        if entry is not None:
+            value, expires, delta = entry[:3]
+            etag = (entry[3] if len(entry) > 3 else None)
+            if etag is None and tag:
+                # filled by set_multi or an older envelope
+                etag = tag(value)
+            if now < expires:
+                self.hits += 1
+                # xfetch, -log(random) is exponential, mean 1
+                beta = _settings['early_beta']
+                if (beta and now - delta * beta * math.log(random.random()) >= expires and
+                        refresh(value)):
+                    self.early_refreshes += 1
+                    self._refresh(key, loader, keep, tag, settle)
+                return value, etag
+            if now < expires + _settings['stale_ttl']:
+                self.stale_hits += 1
+                if refresh(value):
+                    self._refresh(key, loader, keep, tag, settle)
+                return value, etag
+        self.misses += 1
+        value, etag = yield self._flight(flight or key, key, loader, keep, tag, settle)
+        if etag is None and tag and keep(value):
+            etag = tag(value)
+        return value, etag
+
+    @gen.coroutine
+    def read_through(self, key, loader, keep=None, flight=None, settle=None,
+                     refresh=None):
+        '''
+            Cached value of key, loader() on a miss
+        '''
+        value, _ = yield self.read_tagged(key, loader, None, keep, flight, settle, refresh)
+        return value
+
+    def stats(self):
+        '''
+            Hit and miss counters, local tier size
+        '''
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'local_hits': self.local_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'stale_hits': self.stale_hits,
+            'early_refreshes': self.early_refreshes,
+            'loads': self.loads,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._flights),
+            'sets': self.sets,
+            'deletes': self.deletes,
+            'errors': self.errors,
+            'local_size': len(self.lru),
+            'local_max': self.lru.size,
+            'remote_pending': _state['pending'],
+            'servers': _settings['servers'],
+        }
+
+
+cache = Cache()
+
+
+def configure_cache(opts):
+    '''
+        Configure the shared cache from mango options
+    '''
+    _settings.update({
+        'servers': list(opts.memcached_servers or []),
+        'pool_size': opts.memcached_pool_size,
+        'timeout': opts.memcached_timeout,
+        'lru_size': opts.cache_lru_size,
+        'local_ttl': opts.cache_local_ttl,
+        'default_ttl': opts.cache_ttl,
+        'stale_ttl': opts.cache_stale_ttl,
+        'early_beta': opts.cache_early_beta,
+        'negative_ttl': opts.cache_negative_ttl,
+        'settle_ttl': opts.cache_settle_ttl,
+        'ttls': {
+            'tasks': opts.cache_ttl_tasks,
+            'teams': opts.cache_ttl_teams,
+            'users': opts.cache_ttl_users,
+            'orgs': opts.cache_ttl_orgs,
+        },
+    })
+    cache.lru.size = opts.cache_lru_size
+    return cache
@@ -0,0 +1,124 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+import riak
+import logging
+from tornado import gen
+from tornado.ioloop import PeriodicCallback
+from mango.tools.storage import run_storage
+
+
+def parse_nodes(opts):
+    '''
+        Riak nodes from mango options
+
+        Each riak_nodes entry is 'host', 'host:pb_port' or
+        'host:pb_port:http_port', without entries we fall back to
+        riak_host, riak_pb_port and riak_http_port.
+    '''
+    nodes = []
+    for entry in (opts.riak_nodes or []):
+        parts = entry.strip().split(':')
+        nodes.append({
+            'host': parts[0],
+            'pb_port': int(parts[1]) if len(parts) > 1 else opts.riak_pb_port,
+            'http_port': int(parts[2]) if len(parts) > 2 else opts.riak_http_port,
+        })
+    if not nodes:
+        nodes.append({
+            'host': opts.riak_host,
+            'pb_port': opts.riak_pb_port,
+            'http_port': opts.riak_http_port,
+        })
+    return nodes
+
+
+def riak_client(opts):
+    '''
+        Protocol buffers riak client over every configured node
+
+        The riak client pb pool has no size limit of its own, what bounds
+        it is our threads: one connection per storage executor worker
+        (riak_workers) plus one per multiget thread
+        (riak_multiget_pool_size).
+    '''
+    nodes = parse_nodes(opts)
+    logging.info('Riak nodes: {0}'.format(
+        ', '.join('{0}:{1}'.format(x['host'], x['pb_port']) for x in nodes)))
+    return riak.RiakClient(protocol='pbc',
+                           nodes=nodes,
+                           multiget_pool_size=opts.riak_multiget_pool_size)
+
+
+class NodeHealth(object):
+    '''
+        Riak node health checker
+
+        Pings every node each interval, a node failing `failures` pings
+        in a row is ejected from the client node list and re-admitted
+        on its first good ping. With every node down we keep them all,
+        the client error rates will pick the least broken one.
+    '''
+
+    def __init__(self, client, interval=5000, failures=3):
+        self.client = client
+        self.interval = interval
+        self.failures = failures
+        self.nodes = list(client.nodes)
+        self._failed = dict((node, 0) for node in self.nodes)
+        self._probes = dict(
+            (node, riak.RiakClient(protocol='pbc', nodes=[{
+                'host': node.host,
+                'pb_port': node.pb_port,
+                'http_port': node.http_port,
+            }])) for node in self.nodes)
+        self._callback = None
+
+    def start(self):
+        self._callback = PeriodicCallback(self.check, self.interval)
+        self._callback.start()
+
+    def stop(self):
+        if self._callback:
+            self._callback.stop()
+
+    def ping(self, node):
+        try:
+            return self._probes[node].ping()
+        except Exception as error:
+            logging.warning('riak node {0}:{1} {2}'.format(node.host, node.pb_port, error))
+            return False
+
+    @gen.coroutine
+    def check(self):
+        '''
+            Ping all nodes and refresh the client node list
+        '''
+        results = yield [run_storage(self.ping, node) for node in self.nodes]
+        for node, alive in zip(self.nodes, results):
+            if alive:
+                if self._failed[node] >= self.failures:
+                    logging.info('riak node {0}:{1} re-admitted'.format(node.host, node.pb_port))
+                self._failed[node] = 0
+            else:
+                self._failed[node] += 1
+                if self._failed[node] == self.failures:
+                    logging.error('riak node {0}:{1} ejected'.format(node.host, node.pb_port))
+        healthy = [x for x in self.nodes if self._failed[x] < self.failures]
+        self.client.nodes = (healthy if healthy else list(self.nodes))
+
+    def stats(self):
+        '''
+            Node status and recent error rate
+        '''
+        return [{
+            'node': '{0}:{1}'.format(node.host, node.pb_port),
+            'healthy': self._failed[node] < self.failures,
+            'failed_pings': self._failed[node],
+            'error_rate': round(node.error_rate.value(), 4),
+        } for node in self.nodes]
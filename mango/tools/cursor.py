@@ -0,0 +1,42 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+import base64
+import binascii
+
+
+def encode_cursor(kind, token):
+    '''
+        Wrap a backend pagination token into an opaque url safe cursor
+
+        kind is 'solr' for search cursorMarks or 'riak' for 2i
+        continuations, returns None when there is nothing left to walk.
+    '''
+    if not token:
+        return None
+    if isinstance(token, bytes):
+        token = token.decode('utf-8')
+    raw = '{0}:{1}'.format(kind, token).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(kind, cursor):
+    '''
+        Unwrap an opaque cursor, raises ValueError on foreign or bad cursors
+    '''
+    if isinstance(cursor, bytes):
+        cursor = cursor.decode('utf-8')
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(cursor + padding).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError) as error:
+        raise ValueError('invalid cursor {0}'.format(error))
+    prefix, _, token = raw.partition(':')
+    if prefix != kind or not token:
+        raise ValueError('invalid {0} cursor'.format(kind))
+    return token
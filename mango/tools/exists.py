@@ -0,0 +1,221 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+import math
+import time
+import hashlib
+import logging
+from collections import deque
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+from mango.tools.cache import cache
+from mango.tools.search import SearchError, get_search_keys, search_body
+
+
+# uuids per page while rebuilding from the search index
+REBUILD_BATCH = 1000
+
+# seconds a local add is carried into the next rebuilds, well past
+# the search index commit lag
+RECENT_WINDOW = 60
+
+# existence filter settings, overwritten by configure_filters
+_settings = {
+    'enabled': True,
+    'capacity': 1000000,
+    'error_rate': 0.01,
+    'interval': 600,
+}
+
+
+class BloomFilter(object):
+    '''
+        Bloom filter over strings, no false negatives
+
+        Sized for capacity items at error_rate false positives, the k
+        bit positions come from one blake2b digest (double hashing).
+    '''
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def __len__(self):
+        return self.count
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.bits for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self._array[x >> 3] & (1 << (x & 7)) for x in self._positions(item))
+
+
+class ExistenceFilter(object):
+    '''
+        Which uuids may exist in a search index
+
+        Rebuilt from the index every interval and fed by local writes,
+        writes of other processes leave a marker in the shared cache
+        that outlives the next rebuild. Local adds of the last
+        RECENT_WINDOW seconds go in every new filter, the index may not
+        show them yet. Until the first rebuild, or when disabled,
+        everything may exist.
+    '''
+
+    def __init__(self, name, search_index):
+        self.name = name
+        self.search_index = search_index
+        self.bloom = None
+        self.rebuilt = None
+        self.rejected = 0
+        self._pending = None
+        self._recent = deque()
+        self._callback = None
+
+    def _marker(self, uuid):
+        return 'exists:{0}:{1}'.format(self.name, uuid)
+
+    def add(self, uuid):
+        '''
+            Record a new uuid, locally and for the other processes
+
+            Returns the future of the shared cache marker.
+        '''
+        return self.add_multi([uuid])
+
+    def add_multi(self, uuids):
+        '''
+            Record new uuids, their shared markers go in one cache call
+        '''
+        now = time.time()
+        for uuid in uuids:
+            if self.bloom is not None:
+                self.bloom.add(uuid)
+            if self._pending is not None:
+                self._pending.append(uuid)
+            self._recent.append((now, uuid))
+        while self._recent and self._recent[0][0] < now - RECENT_WINDOW:
+            self._recent.popleft()
+        return cache.set_multi(dict.fromkeys(uuids, True), 2 * _settings['interval'],
+                               key_prefix=self._marker(''))
+
+    @gen.coroutine
+    def might_exist(self, uuid):
+        '''
+            False only when uuid is surely not in the index
+        '''
+        if not _settings['enabled'] or self.bloom is None or uuid in self.bloom:
+            return True
+        marker = yield cache.get(self._marker(uuid))
+        if marker:
+            return True
+        self.rejected += 1
+        return False
+
+    @gen.coroutine
+    def walk(self, solr, bloom):
+        '''
+            Add every uuid of the index to bloom, cursorMark pages
+        '''
+        cursor_mark = '*'
+        while True:
+            url = get_search_keys(solr, self.search_index, 'uuid_register:*', '*:*',
+                                  cursor_mark, REBUILD_BATCH)
+            stuff = yield search_body(url)
+            for doc in stuff['response']['docs']:
+                bloom.add(doc['uuid_register'])
+            next_mark = stuff.get('nextCursorMark')
+            if not next_mark or next_mark == cursor_mark:
+                break
+            cursor_mark = next_mark
+
+    @gen.coroutine
+    def rebuild(self, solr):
+        '''
+            Walk every uuid of the index into a new filter, then swap
+        '''
+        if self._pending is not None:
+            # still walking the index
+            return False
+        bloom = BloomFilter(_settings['capacity'], _settings['error_rate'])
+        start = time.time()
+        # recent adds may miss the walk, adds during it surely do
+        self._pending = [uuid for added, uuid in self._recent
+                         if added >= start - RECENT_WINDOW]
+        try:
+            yield self.walk(solr, bloom)
+        except SearchError as error:
+            logging.warning('{0} filter rebuild {1}'.format(self.name, error))
+            return False
+        finally:
+            pending, self._pending = self._pending, None
+        for uuid in pending:
+            bloom.add(uuid)
+        if bloom.count > _settings['capacity']:
+            logging.warning('{0} filter over capacity, raise exists_capacity'.format(self.name))
+        self.bloom = bloom
+        self.rebuilt = time.time()
+        logging.info('{0} filter rebuilt, {1} uuids in {2:.1f}s'.format(
+            self.name, bloom.count, self.rebuilt - start))
+        return True
+
+    def start(self, solr):
+        if not _settings['enabled']:
+            return
+        rebuild = lambda: IOLoop.current().spawn_callback(self.rebuild, solr)
+        self._callback = PeriodicCallback(rebuild, _settings['interval'] * 1000)
+        self._callback.start()
+        rebuild()
+
+    def stop(self):
+        if self._callback:
+            self._callback.stop()
+
+    def stats(self):
+        return {
+            'ready': self.bloom is not None,
+            'uuids': self.bloom.count if self.bloom is not None else 0,
+            'rejected': self.rejected,
+            'rebuilt': self.rebuilt,
+        }
+
+
+# not-found lookups of these resources check their filter first
+filters = {
+    'tasks': ExistenceFilter('tasks', 'mango_task_index'),
+    'orgs': ExistenceFilter('orgs', 'mango_account_index'),
+}
+
+
+def configure_filters(opts):
+    '''
+        Configure the existence filters from mango options
+
+        Other processes only learn about new uuids through memcached,
+        without servers the filters stay off.
+    '''
+    enabled = bool(opts.exists_filter and opts.memcached_servers)
+    if opts.exists_filter and not enabled:
+        logging.warning('exists filters need memcached_servers, disabled')
+    _settings.update({
+        'enabled': enabled,
+        'capacity': opts.exists_capacity,
+        'error_rate': opts.exists_error_rate,
+        'interval': opts.exists_rebuild_interval,
+    })
+    return filters
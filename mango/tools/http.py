@@ -0,0 +1,133 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+import pycurl
+import logging
+from tornado import gen
+from tornado import httpclient as _http_client
+
+
+_curl_client = 'tornado.curl_httpclient.CurlAsyncHTTPClient'
+
+# client settings, overwritten by configure_client from mango options
+_settings = {
+    'max_clients': 100,
+    'max_host_connections': 0,
+    'keep_alive': True,
+    'connect_timeout': 5.0,
+    'request_timeout': 20.0,
+    'dns_cache_timeout': 120,
+}
+
+
+def _prepare_curl(curl):
+    '''
+        Per handle curl tuning, keep-alive and dns caching
+    '''
+    curl.setopt(pycurl.DNS_CACHE_TIMEOUT, _settings['dns_cache_timeout'])
+    if _settings['keep_alive']:
+        curl.setopt(pycurl.TCP_KEEPALIVE, 1)
+        curl.setopt(pycurl.FORBID_REUSE, 0)
+    else:
+        curl.setopt(pycurl.FORBID_REUSE, 1)
+
+
+class PooledClient(object):
+    '''
+        Shared pooled http client used by all system mixins
+
+        The curl client is built lazily on first fetch so the
+        configuration from mango options is in place by then.
+    '''
+
+    def __init__(self):
+        self._client = None
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            _http_client.AsyncHTTPClient.configure(
+                _curl_client,
+                max_clients=_settings['max_clients'],
+                defaults={
+                    'connect_timeout': _settings['connect_timeout'],
+                    'request_timeout': _settings['request_timeout'],
+                    'prepare_curl_callback': _prepare_curl,
+                }
+            )
+            self._client = _http_client.AsyncHTTPClient()
+            # curl multi handle is tornado internals, skip the cap if it moves
+            multi = getattr(self._client, '_multi', None)
+            if _settings['max_host_connections'] and multi is not None:
+                multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS,
+                             _settings['max_host_connections'])
+            logging.info('http client pool ready {0}'.format(_settings))
+        return self._client
+
+    @gen.coroutine
+    def fetch(self, request, **kwargs):
+        '''
+            Fetch keeping track of in-flight requests
+        '''
+        client = self.client
+        self.in_flight += 1
+        try:
+            response = yield client.fetch(request, **kwargs)
+            self.completed += 1
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        return response
+
+    def stats(self):
+        '''
+            Pool sizing stats, queue depth and in-flight counts
+        '''
+        message = {
+            'max_clients': _settings['max_clients'],
+            'in_flight': self.in_flight,
+            'queued': 0,
+            'active': 0,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+        if self._client is not None:
+            # private curl client state, read defensively so a tornado
+            # upgrade only loses the split, never the whole /stats
+            requests = getattr(self._client, '_requests', None)
+            curls = getattr(self._client, '_curls', None)
+            free_list = getattr(self._client, '_free_list', None)
+            if requests is not None:
+                # requests waiting for a free curl handle
+                message['queued'] = len(requests)
+            if curls is not None and free_list is not None:
+                message['active'] = len(curls) - len(free_list)
+        return message
+
+
+http_client = PooledClient()
+
+
+def configure_client(opts):
+    '''
+        Configure the shared http client from mango options
+    '''
+    _settings.update({
+        'max_clients': opts.http_max_clients,
+        'max_host_connections': opts.http_max_host_connections,
+        'keep_alive': opts.http_keep_alive,
+        'connect_timeout': opts.http_connect_timeout,
+        'request_timeout': opts.http_request_timeout,
+        'dns_cache_timeout': opts.http_dns_cache_timeout,
+    })
+    return http_client
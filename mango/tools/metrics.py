@@ -0,0 +1,64 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+from tornado.ioloop import IOLoop
+from tornado.ioloop import PeriodicCallback
+
+
+class LoopLag(object):
+    '''
+        Event loop lag monitor
+
+        Wakes up every interval and measures how late it was, anything
+        blocking the IOLoop shows up as lag.
+    '''
+
+    def __init__(self, interval=500):
+        # interval in milliseconds
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+        self.average = 0.0
+        self.samples = 0
+        self._expected = None
+        self._callback = None
+
+    def start(self):
+        self._expected = IOLoop.current().time() + self.interval / 1000.0
+        self._callback = PeriodicCallback(self.sample, self.interval)
+        self._callback.start()
+
+    def stop(self):
+        if self._callback:
+            self._callback.stop()
+
+    def sample(self):
+        now = IOLoop.current().time()
+        lag = max(0.0, now - self._expected) * 1000.0
+        self._expected = now + self.interval / 1000.0
+        self.last = lag
+        self.max = max(self.max, lag)
+        # exponentially weighted moving average
+        self.average = (lag if not self.samples else
+                        self.average * 0.9 + lag * 0.1)
+        self.samples += 1
+
+    def stats(self):
+        '''
+            Loop lag in milliseconds
+        '''
+        return {
+            'interval': self.interval,
+            'last': round(self.last, 3),
+            'average': round(self.average, 3),
+            'max': round(self.max, 3),
+            'samples': self.samples,
+        }
+
+
+loop_lag = LoopLag()
@@ -63,11 +63,180 @@ def options():
         'riak_host',
         default='127.0.0.1', type=str,
         help=('Riak cluster node'))
-    # Riak kvalue port
+    # Riak kvalue protocol buffers port
     tornado.options.define(
-        'riak_port',
+        'riak_pb_port',
         default=8087, type=int,
-        help=('Riak cluster port'))
+        help=('Riak cluster protocol buffers port'))
+    # Riak kvalue cluster nodes
+    tornado.options.define(
+        'riak_nodes',
+        default=[], type=str, multiple=True,
+        help=('Riak cluster nodes, host[:pb_port[:http_port]] comma separated'))
+    # Riak node health checks
+    tornado.options.define(
+        'riak_health_interval',
+        default=5000, type=int,
+        help=('Riak node ping interval in milliseconds'))
+    # Riak node ejection
+    tornado.options.define(
+        'riak_health_failures',
+        default=3, type=int,
+        help=('Failed pings in a row before a riak node is ejected'))
+    # Riak kvalue http port (search queries)
+    tornado.options.define(
+        'riak_http_port',
+        default=8098, type=int,
+        help=('Riak cluster http port, used for search queries'))
+    # HTTP client max connections
+    tornado.options.define(
+        'http_max_clients',
+        default=100, type=int,
+        help=('Max concurrent connections of the shared http client'))
+    # HTTP client per host connections
+    tornado.options.define(
+        'http_max_host_connections',
+        default=0, type=int,
+        help=('Max connections per host, 0 means no limit'))
+    # HTTP client keep-alive
+    tornado.options.define(
+        'http_keep_alive',
+        default=True, type=bool,
+        help=('Reuse http connections with tcp keep-alive'))
+    # HTTP client connect timeout
+    tornado.options.define(
+        'http_connect_timeout',
+        default=5.0, type=float,
+        help=('Http connect timeout in seconds'))
+    # HTTP client request timeout
+    tornado.options.define(
+        'http_request_timeout',
+        default=20.0, type=float,
+        help=('Http request timeout in seconds'))
+    # HTTP client dns cache
+    tornado.options.define(
+        'http_dns_cache_timeout',
+        default=120, type=int,
+        help=('Seconds to keep resolved names in the dns cache'))
+    # Riak multiget fan-out
+    tornado.options.define(
+        'riak_multiget_pool_size',
+        default=16, type=int,
+        help=('Threads used to fetch riak keys in parallel'))
+    # Riak storage executor
+    tornado.options.define(
+        'riak_workers',
+        default=32, type=int,
+        help=('Threads running blocking riak calls off the IOLoop, the pb '
+              'connections in use are at most riak_workers plus '
+              'riak_multiget_pool_size'))
+    # Event loop lag sampling
+    tornado.options.define(
+        'loop_lag_interval',
+        default=500, type=int,
+        help=('Event loop lag sampling interval in milliseconds'))
+    # Memcached servers
+    tornado.options.define(
+        'memcached_servers',
+        default=[], type=str, multiple=True,
+        help=('Memcached servers host[:port] comma separated, none for local cache only'))
+    # Memcached client pool
+    tornado.options.define(
+        'memcached_pool_size',
+        default=16, type=int,
+        help=('Pooled memcached clients, also the threads running memcached calls'))
+    # Memcached call timeout
+    tornado.options.define(
+        'memcached_timeout',
+        default=0.5, type=float,
+        help=('Seconds to wait on a memcached call before treating it as a miss'))
+    # In-process cache size
+    tornado.options.define(
+        'cache_lru_size',
+        default=10000, type=int,
+        help=('Max entries of the in-process LRU cache'))
+    # In-process cache ttl
+    tornado.options.define(
+        'cache_local_ttl',
+        default=2, type=int,
+        help=('Max seconds an entry lives in the in-process cache'))
+    # Default cache ttl
+    tornado.options.define(
+        'cache_ttl',
+        default=30, type=int,
+        help=('Cache ttl in seconds of resources without their own'))
+    # Stale while revalidate window
+    tornado.options.define(
+        'cache_stale_ttl',
+        default=30, type=int,
+        help=('Seconds an expired entry is still served while a refresh runs, 0 disables'))
+    # Probabilistic early refresh
+    tornado.options.define(
+        'cache_early_beta',
+        default=1.0, type=float,
+        help=('Early refresh eagerness, higher refreshes sooner, 0 disables'))
+    # Negative cache
+    tornado.options.define(
+        'cache_negative_ttl',
+        default=5, type=int,
+        help=('Seconds a not found lookup is remembered per account'))
+    # Search index commit lag
+    tornado.options.define(
+        'cache_settle_ttl',
+        default=3, type=int,
+        help=('Seconds after a write during which loads may still see the old '
+              'search index, they are cached this long only'))
+    # UUID existence filters
+    tornado.options.define(
+        'exists_filter',
+        default=True, type=bool,
+        help=('Answer lookups of unknown task and org uuids without the search index, '
+              'needs memcached_servers'))
+    tornado.options.define(
+        'exists_capacity',
+        default=1000000, type=int,
+        help=('Expected uuids per existence filter'))
+    tornado.options.define(
+        'exists_error_rate',
+        default=0.01, type=float,
+        help=('Existence filter false positive rate'))
+    tornado.options.define(
+        'exists_rebuild_interval',
+        default=600, type=int,
+        help=('Seconds between existence filter rebuilds from the search index'))
+    # Per resource cache ttls
+    tornado.options.define(
+        'cache_ttl_tasks',
+        default=30, type=int,
+        help=('Cache ttl in seconds of tasks'))
+    tornado.options.define(
+        'cache_ttl_teams',
+        default=60, type=int,
+        help=('Cache ttl in seconds of teams'))
+    tornado.options.define(
+        'cache_ttl_users',
+        default=60, type=int,
+        help=('Cache ttl in seconds of users'))
+    tornado.options.define(
+        'cache_ttl_orgs',
+        default=120, type=int,
+        help=('Cache ttl in seconds of orgs'))
+    # Bulk request size
+    tornado.options.define(
+        'bulk_max_items',
+        default=5000, type=int,
+        help=('Max items in a single bulk request'))
+    # Bulk write fan-out
+    tornado.options.define(
+        'bulk_concurrency',
+        default=16, type=int,
+        help=('Riak writes in flight per bulk request, keep it under riak_workers'))
+    # Watchers of tasks stored before they were sets
+    tornado.options.define(
+        'legacy_watchers',
+        default=True, type=bool,
+        help=('Match watchers still in pre-set registers, turn it off once '
+              'python -m mango.tools.backfill has run'))
     # Page size
     tornado.options.define(
         'page_size',
@@ -0,0 +1,274 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+import logging
+import ujson as json
+from urllib.parse import quote
+from tornado import gen
+from tornado import httpclient as _http_client
+from mango.tools.http import http_client
+from mango.tools.cursor import encode_cursor, decode_cursor
+
+
+# per-call timeout in seconds for search requests, None leaves the
+# http_request_timeout option of the pooled client in charge
+SEARCH_TIMEOUT = None
+
+# riak yokozuna fields we never return to clients
+IGNORE_ME = ("_yz_id", "_yz_rk", "_yz_rt", "_yz_rb")
+
+# list sort on the unique key, stable pages and required by cursorMark
+SORT_UNIQUE = quote('_yz_id asc')
+
+# key resolution fields, riak key and uuid only
+KEY_FIELDS = quote('_yz_rk,uuid_register')
+
+# uuids per key resolution query, keeps urls short
+KEY_BATCH = 100
+
+
+class SearchError(Exception):
+    '''
+        Search backend error
+    '''
+
+    def __init__(self, message, url=None, code=None):
+        super(SearchError, self).__init__(message)
+        self.url = url
+        self.code = code
+
+
+class SearchTimeout(SearchError):
+    '''
+        Search backend did not answer in time (or was unreachable)
+    '''
+
+
+class SearchHTTPError(SearchError):
+    '''
+        Search backend answered with an http error
+    '''
+
+
+class SearchDecodeError(SearchError):
+    '''
+        Search backend answered with a body we can't understand
+    '''
+
+
+def get_search_item(solr, search_index, query, filter_query):
+    '''
+        Build single item search url
+    '''
+    return "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}&rows=1".format(
+        solr, search_index, query, filter_query
+    )
+
+
+def get_search_list(solr, search_index, query, filter_query, start_num, page_size):
+    '''
+        Build paginated list search url
+    '''
+    return "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}&start={4}&rows={5}&sort={6}".format(
+        solr, search_index, query, filter_query, start_num, page_size, SORT_UNIQUE
+    )
+
+
+def get_search_cursor(solr, search_index, query, filter_query, cursor_mark, page_size):
+    '''
+        Build cursorMark list search url
+    '''
+    return "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}&rows={4}&sort={5}&cursorMark={6}".format(
+        solr, search_index, query, filter_query, page_size, SORT_UNIQUE, quote(cursor_mark, safe='')
+    )
+
+
+def get_search_page(solr, search_index, query, filter_query, page_num, page_size, cursor=None):
+    '''
+        Build list search url and return it with the cursorMark in use
+
+        Cursor walks and first pages use solr cursorMark, any other
+        page number falls back to offsets and has no cursorMark.
+        Raises ValueError on invalid cursors.
+    '''
+    if cursor:
+        cursor_mark = decode_cursor('solr', cursor)
+    elif page_num == 1:
+        cursor_mark = '*'
+    else:
+        start_num = page_size * (page_num - 1)
+        url = get_search_list(solr, search_index, query, filter_query, start_num, page_size)
+        return url, None
+    url = get_search_cursor(solr, search_index, query, filter_query, cursor_mark, page_size)
+    return url, cursor_mark
+
+
+def get_search_keys(solr, search_index, query, filter_query, cursor_mark, page_size, fields=()):
+    '''
+        Build key resolution url, cursorMark walk over keys and uuids
+
+        fields are returned along with them.
+    '''
+    fl = (quote(','.join(('_yz_rk', 'uuid_register') + tuple(fields))) if fields else KEY_FIELDS)
+    return "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}&rows={4}&sort={5}&cursorMark={6}&fl={7}".format(
+        solr, search_index, quote(query), quote(filter_query), page_size,
+        SORT_UNIQUE, quote(cursor_mark, safe=''), fl
+    )
+
+
+def uuid_query(uuids):
+    '''
+        Search query matching any of the uuids
+    '''
+    return 'uuid_register:({0})'.format(' OR '.join(uuids))
+
+
+def get_search_batch(solr, search_index, uuids, filter_query):
+    '''
+        Build one search url fetching every uuid
+    '''
+    return "https://{0}/search/query/{1}?wt=json&q={2}&fq={3}&rows={4}".format(
+        solr, search_index, quote(uuid_query(uuids)), quote(filter_query), len(uuids)
+    )
+
+
+def quick_search_item(solr, search_index, query, start_num, page_size, fields):
+    '''
+        Build quick search url with field list
+    '''
+    return "https://{0}/search/query/{1}?wt=json&q={2}&start={3}&rows={4}&fl={5}".format(
+        solr, search_index, query, start_num, page_size, fields
+    )
+
+
+@gen.coroutine
+def search_body(url, request_timeout=None):
+    '''
+        Fetch a search url and return the whole decoded solr body
+
+        Raises SearchTimeout, SearchHTTPError or SearchDecodeError,
+        all of them are SearchError.
+    '''
+    timeout = (request_timeout if request_timeout else SEARCH_TIMEOUT)
+    kwargs = ({'request_timeout': timeout} if timeout else {})
+    try:
+        response = yield http_client.fetch(url, **kwargs)
+    except _http_client.HTTPError as error:
+        # curl reports timeouts and unreachable hosts as 599
+        if error.code == 599:
+            raise SearchTimeout(str(error), url=url, code=error.code)
+        raise SearchHTTPError(str(error), url=url, code=error.code)
+    try:
+        stuff = json.loads(response.body)
+        stuff['response']
+    except (ValueError, KeyError, TypeError) as error:
+        raise SearchDecodeError(str(error), url=url, code=response.code)
+    return stuff
+
+
+@gen.coroutine
+def search_request(url, request_timeout=None):
+    '''
+        Fetch a search url and return the decoded solr response
+    '''
+    stuff = yield search_body(url, request_timeout)
+    return stuff['response']
+
+
+@gen.coroutine
+def search_page(url, cursor_mark=None, request_timeout=None):
+    '''
+        Fetch a list search url, return the solr response and next cursor
+
+        The next cursor is None on offset pages and once the walk is over.
+    '''
+    stuff = yield search_body(url, request_timeout)
+    next_mark = stuff.get('nextCursorMark')
+    cursor = None
+    if cursor_mark and next_mark and next_mark != cursor_mark:
+        cursor = encode_cursor('solr', next_mark)
+    return stuff['response'], cursor
+
+
+@gen.coroutine
+def search_item(url, request_timeout=None):
+    '''
+        Get the first raw document that match the search url or None
+    '''
+    stuff = yield search_request(url, request_timeout)
+    if stuff['numFound']:
+        return stuff['docs'][0]
+    logging.info('search item not found {0}'.format(url))
+    return None
+
+
+@gen.coroutine
+def search_list(url, request_timeout=None):
+    '''
+        Get the count and raw documents that match the search url
+    '''
+    stuff = yield search_request(url, request_timeout)
+    return stuff['numFound'], stuff['docs']
+
+
+@gen.coroutine
+def search_key_docs(solr, search_index, query, filter_query, limit, page_size=KEY_BATCH,
+                    fields=()):
+    '''
+        Resolve up to limit matching documents to {uuid: doc}
+
+        Docs hold _yz_rk, uuid_register and the requested fields.
+    '''
+    docs = {}
+    cursor_mark = '*'
+    while len(docs) < limit:
+        rows = min(page_size, limit - len(docs))
+        url = get_search_keys(solr, search_index, query, filter_query, cursor_mark, rows, fields)
+        stuff = yield search_body(url)
+        for doc in stuff['response']['docs']:
+            docs[doc['uuid_register']] = doc
+        next_mark = stuff.get('nextCursorMark')
+        if not next_mark or next_mark == cursor_mark:
+            break
+        cursor_mark = next_mark
+    return docs
+
+
+@gen.coroutine
+def search_keys(solr, search_index, query, filter_query, limit, page_size=KEY_BATCH):
+    '''
+        Resolve up to limit matching documents to {uuid: riak_key}
+    '''
+    docs = yield search_key_docs(solr, search_index, query, filter_query, limit, page_size)
+    return dict((key, doc['_yz_rk']) for key, doc in docs.items())
+
+
+@gen.coroutine
+def search_uuid_docs(solr, search_index, uuids, filter_query, fields=()):
+    '''
+        Resolve uuids to {uuid: doc}, KEY_BATCH uuids per query
+    '''
+    batches = [uuids[i:i + KEY_BATCH] for i in range(0, len(uuids), KEY_BATCH)]
+    found = yield [
+        search_key_docs(solr, search_index, uuid_query(batch), filter_query, len(batch),
+                        fields=fields)
+        for batch in batches
+    ]
+    docs = {}
+    for batch in found:
+        docs.update(batch)
+    return docs
+
+
+@gen.coroutine
+def search_uuid_keys(solr, search_index, uuids, filter_query):
+    '''
+        Resolve uuids to {uuid: riak_key}, KEY_BATCH uuids per query
+    '''
+    docs = yield search_uuid_docs(solr, search_index, uuids, filter_query)
+    return dict((key, doc['_yz_rk']) for key, doc in docs.items())
@@ -0,0 +1,110 @@
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+
+
+__author__ = 'Jean Chassoul'
+
+
+import logging
+import functools
+from tornado.ioloop import IOLoop
+from concurrent.futures import ThreadPoolExecutor
+
+
+# storage executor settings, overwritten by configure_executor
+_settings = {
+    'workers': 32,
+}
+
+# storage executor state
+_state = {
+    'executor': None,
+    'in_flight': 0,
+    'completed': 0,
+    'failed': 0,
+}
+
+
+def get_executor():
+    '''
+        Dedicated thread pool for blocking riak client calls
+    '''
+    if _state['executor'] is None:
+        _state['executor'] = ThreadPoolExecutor(
+            max_workers=_settings['workers'],
+            thread_name_prefix='mango-storage')
+        logging.info('storage executor ready {0}'.format(_settings))
+    return _state['executor']
+
+
+def configure_executor(opts):
+    '''
+        Configure the storage executor from mango options
+    '''
+    _settings['workers'] = opts.riak_workers
+    return get_executor()
+
+
+def _done(future):
+    '''
+        Count finished storage work, runs back on the IOLoop
+    '''
+    _state['in_flight'] -= 1
+    if future.exception() is None:
+        _state['completed'] += 1
+    else:
+        _state['failed'] += 1
+
+
+def run_storage(fn, *args, **kwargs):
+    '''
+        Run a blocking riak call off the IOLoop, returns a future
+    '''
+    _state['in_flight'] += 1
+    future = IOLoop.current().run_in_executor(
+        get_executor(), functools.partial(fn, *args, **kwargs))
+    future.add_done_callback(_done)
+    return future
+
+
+def stats():
+    '''
+        Storage executor stats, queued and in-flight riak calls
+    '''
+    executor = _state['executor']
+    return {
+        'workers': _settings['workers'],
+        'in_flight': _state['in_flight'],
+        'queued': (executor._work_queue.qsize() if executor else 0),
+        'completed': _state['completed'],
+        'failed': _state['failed'],
+    }
+
+
+def multiget(bucket, keys):
+    '''
+        Fetch many keys of a bucket in parallel, keeping keys order
+
+        Uses the riak client multiget worker pool, its fan-out is the
+        riak_multiget_pool_size option. Failed or missing keys are None.
+    '''
+    keys = list(keys)
+    if not keys:
+        return []
+    found = {}
+    for result in bucket.multiget(keys):
+        if isinstance(result, tuple):
+            # bucket type, bucket, key and the exception raised
+            logging.warning('multiget {0} failed {1}'.format(result[2], result[3]))
+            continue
+        if result.exists:
+            found[result.key] = result
+    return [found.get(key) for key in keys]
+
+
+def multiget_data(bucket, keys):
+    '''
+        Data of many keys of a bucket in keys order, skipping missing ones
+    '''
+    return [x.data for x in multiget(bucket, keys) if x is not None]
@@ -9,12 +9,19 @@ __author__ = 'Jean Chassoul'
 
 
 import uuid
-import riak
 import logging
 from tornado import ioloop
 from tornado import web
-from mango.handlers import accounts, teams, tasks
+from mango.handlers import accounts, teams, tasks, stats
 from mango.tools import options
+from mango.tools.http import configure_client
+from mango.tools.storage import configure_executor
+from mango.tools.metrics import loop_lag
+from mango.tools.cluster import NodeHealth, riak_client
+from mango.tools.buckets import verify_buckets
+from mango.tools.cache import configure_cache
+from mango.tools.exists import configure_filters
+from mango.system.tasks import configure_tasks
 
 
 def main():
@@ -23,8 +30,24 @@ def main():
     '''
     # mango daemon options
     opts = options.options()
+    # shared pooled http client
+    configure_client(opts)
+    # blocking riak calls run on their own thread pool
+    configure_executor(opts)
+    # in-process LRU in front of memcached
+    cache = configure_cache(opts)
+    # unknown uuids answered without the search index
+    filters = configure_filters(opts)
+    # task filters, legacy watcher registers until the backfill ran
+    configure_tasks(opts)
     # Riak key-value storage
-    kvalue = riak.RiakClient(host=opts.riak_host, pb_port=8087)
+    kvalue = riak_client(opts)
+    # fail fast on missing search index bindings, writes never set them
+    verify_buckets(kvalue)
+    # eject and re-admit riak nodes on health checks
+    node_health = NodeHealth(kvalue,
+                             opts.riak_health_interval,
+                             opts.riak_health_failures)
     # Our current db
     db = kvalue
     # Our system uuid
@@ -32,9 +55,11 @@ def main():
     # logging system spawned
     logging.info('Mango system {0} spawned'.format(system_uuid))
     # logging riak settings
-    logging.info('Riak server: {0}:{1}'.format(opts.riak_host, opts.riak_port))
+    logging.info('Riak cluster: {0} nodes'.format(len(kvalue.nodes)))
     # streaming daemonic setup
     logging.info('Streams spawn at: {0}:{1}'.format(opts.spaceboard_host, opts.spaceboard_port))
+    # riak search endpoint
+    solr = '{0}:{1}'.format(opts.riak_host, opts.riak_http_port)
     # application web daemon
     application = web.Application(
         [
@@ -52,18 +77,32 @@ def main():
             (r'/users/?', accounts.UsersHandler),
             # Tasks for humans and non-humans alike!
             (r'/tasks/page/(?P<page_num>\d+)/?', tasks.Handler),
+            (r'/tasks/bulk/?', tasks.BulkHandler),
             (r'/tasks/(?P<task_uuid>.+)/?', tasks.Handler),
             (r'/tasks/?', tasks.Handler),
+            # System stats
+            (r'/stats/?', stats.Handler),
         ],
         db=db,
         kvalue=kvalue,
+        cache=cache,
+        solr=solr,
         debug=opts.debug,
         domain=opts.domain,
         page_size=opts.page_size,
+        bulk_max_items=opts.bulk_max_items,
+        bulk_concurrency=opts.bulk_concurrency,
+        node_health=node_health,
     )
     # Setting up the application server process
     application.listen(opts.port)
     logging.info('Listening on http://{0}:{1}'.format(opts.host, opts.port))
+    # watch the event loop for blocking calls
+    loop_lag.interval = opts.loop_lag_interval
+    loop_lag.start()
+    node_health.start()
+    for uuid_filter in filters.values():
+        uuid_filter.start(solr)
     ioloop.IOLoop.current().start()
 
 
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+'''
+    Bucket registry tests
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import unittest
+from mango.tools import buckets
+
+
+class FakeBucket(object):
+
+    def __init__(self, props):
+        self.props = props
+
+    def get_properties(self):
+        return self.props
+
+
+class FakeClient(object):
+    '''
+        Riak client look-alike counting bucket resolutions
+    '''
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+        self.resolved = 0
+
+    def bucket_type(self, bucket_type):
+        self.current = bucket_type
+        return self
+
+    def bucket(self, bucket_name):
+        self.resolved += 1
+        return FakeBucket({'search_index': self.indexes.get(self.current)})
+
+
+class BucketsTestCase(unittest.TestCase):
+    '''
+        Bucket registry Test Case
+    '''
+
+    def setUp(self):
+        buckets._registry.clear()
+
+    def test_resolve_once(self):
+        client = FakeClient({})
+        bucket = buckets.get_bucket(client, 'mango_task', 'tasks')
+        self.assertIs(buckets.get_bucket(client, 'mango_task', 'tasks'), bucket)
+        self.assertEqual(client.resolved, 1)
+
+    def test_verify(self):
+        client = FakeClient({'mango_account': 'mango_account_index',
+                             'mango_task': 'mango_task_index',
+                             'mango_team': 'mango_team_index'})
+        self.assertTrue(buckets.verify_buckets(client))
+
+    def test_missing_binding(self):
+        client = FakeClient({'mango_account': 'mango_account_index'})
+        self.assertRaises(buckets.BindingError, buckets.verify_buckets, client)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+'''
+    Bulk task tests, riak and search left out
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import uuid
+from collections import defaultdict
+from tornado import gen, testing
+from mango.system import tasks
+from mango.tools import exists, check_bulk
+from mango.tools.cache import Cache
+
+
+class FakeRegister(object):
+    value = None
+
+    def assign(self, value):
+        self.value = value
+
+
+class FakeSet(object):
+
+    def __init__(self):
+        self.value = frozenset()
+
+    def add(self, thing):
+        self.value = self.value | {thing}
+
+    def discard(self, thing):
+        self.value = self.value - {thing}
+
+
+class FakeMap(object):
+    '''
+        Riak map look-alike, one per key
+    '''
+    stored = {}
+
+    def __new__(cls, bucket, key):
+        if key not in cls.stored:
+            riak_map = object.__new__(cls)
+            riak_map.registers = defaultdict(FakeRegister)
+            riak_map.sets = defaultdict(FakeSet)
+            cls.stored[key] = riak_map
+        return cls.stored[key]
+
+    def __init__(self, bucket, key):
+        pass
+
+    def reload(self):
+        return self
+
+    def update(self):
+        return self
+
+
+class CountingCache(Cache):
+    '''
+        Local only cache counting the memcached calls it would make
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.remote = []
+
+    @gen.coroutine
+    def _remote(self, method, *args, **kwargs):
+        self.remote.append(method)
+        return None
+
+
+class PatchedTestCase(testing.AsyncTestCase):
+    '''
+        Module attributes swapped for the length of a test
+    '''
+
+    def patch(self, module, name, value):
+        self.addCleanup(setattr, module, name, getattr(module, name))
+        setattr(module, name, value)
+
+
+class CheckBulkTestCase(testing.AsyncTestCase):
+    '''
+        check_bulk Test Case
+    '''
+
+    @testing.gen_test
+    def test_array(self):
+        structs = yield check_bulk(b' [{"subject": "a"}, {"subject": "b"}] ')
+        self.assertEqual(structs, [{'subject': 'a'}, {'subject': 'b'}])
+
+    @testing.gen_test
+    def test_ndjson(self):
+        structs = yield check_bulk(b'{"subject": "a"}\n\n{"subject": "b"}\n')
+        self.assertEqual(structs, [{'subject': 'a'}, {'subject': 'b'}])
+
+    @testing.gen_test
+    def test_invalid(self):
+        for body in (b'[{"subject": "a"}, 1]', b'{"subject": "a"}\n"b"', b'[{"subject": ',
+                     b'{"subject": "a"}\nnope'):
+            with self.assertRaises(ValueError):
+                yield check_bulk(body)
+
+
+class NewBulkTestCase(PatchedTestCase):
+    '''
+        new_task_bulk Test Case
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.stored = []
+        self.cache = CountingCache()
+
+        @gen.coroutine
+        def run_storage(fn, *args, **kwargs):
+            return fn(*args, **kwargs)
+
+        self.patch(tasks, 'run_storage', run_storage)
+        self.patch(tasks, 'TaskMap', lambda *args: self.stored.append(args[4]))
+        self.patch(exists, 'cache', self.cache)
+        self.tasks = tasks.Tasks()
+        self.tasks.kvalue = None
+        self.tasks.cache = self.cache
+        self.tasks.settings = {'bulk_concurrency': 4}
+
+    @testing.gen_test
+    def test_results(self):
+        structs = [{'account': 'alice', 'watchers': ['bob']} for _ in range(50)]
+        structs.insert(3, {'account': 'alice', 'status': 'nope'})
+        results = yield self.tasks.new_task_bulk(structs)
+        self.assertEqual([x['index'] for x in results], list(range(51)))
+        self.assertEqual(results[3]['status'], 400)
+        self.assertEqual(sum(1 for x in results if x['status'] == 201), 50)
+        self.assertEqual(len(self.stored), 50)
+        # absent markers and existence markers, one call each for the batch
+        self.assertEqual(self.cache.remote.count('delete_multi'), 1)
+        self.assertLessEqual(len(self.cache.remote), 4)
+
+
+class ModifyBulkTestCase(PatchedTestCase):
+    '''
+        modify_task_bulk Test Case
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.uuids = [str(uuid.uuid4()) for _ in range(3)]
+        FakeMap.stored = {}
+
+        @gen.coroutine
+        def search_uuid_docs(solr, index, uuids, filter_query, fields=()):
+            return dict((x, {'_yz_rk': 'key-' + x}) for x in uuids)
+
+        @gen.coroutine
+        def run_storage(fn, *args, **kwargs):
+            return fn(*args, **kwargs)
+
+        self.patch(tasks, 'search_uuid_docs', search_uuid_docs)
+        self.patch(tasks, 'run_storage', run_storage)
+        self.patch(tasks, 'get_bucket', lambda *args: None)
+        self.patch(tasks, 'Map', FakeMap)
+        self.tasks = tasks.Tasks()
+        self.tasks.solr = 'solr'
+        self.tasks.kvalue = None
+        self.tasks.cache = CountingCache()
+        self.tasks.settings = {'bulk_concurrency': 2}
+
+    @testing.gen_test
+    def test_converted_changes(self):
+        results = yield self.tasks.modify_task_bulk('alice', {'watchers': 'bob'},
+                                                   uuids=self.uuids)
+        self.assertEqual([x['status'] for x in results], [200] * 3)
+        for riak_map in FakeMap.stored.values():
+            self.assertEqual(riak_map.sets['watchers'].value, frozenset(['bob']))
+        # not found answers of the new watcher dropped in one call
+        self.assertEqual(self.tasks.cache.remote.count('delete_multi'), 2)
+
+    @testing.gen_test
+    def test_nothing_to_remove(self):
+        results = yield self.tasks.modify_task_bulk('alice', {'status': 'done'},
+                                                   uuids=self.uuids, remove=True)
+        self.assertEqual([x['status'] for x in results], [400] * 3)
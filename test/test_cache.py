@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+'''
+    Cache tests
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import time
+import unittest
+from tornado import gen
+from tornado.ioloop import IOLoop
+from contextlib import contextmanager
+from mango.tools import cache as cache_module
+from mango.tools.cache import LRU, Cache
+from mango.tools.storage import run_storage
+
+
+class SlowClient(object):
+    '''
+        Memcached client look-alike that blocks its thread
+    '''
+    calls = []
+
+    def get(self, key):
+        self.calls.append(key)
+        time.sleep(0.3)
+        return ('remote', time.time() + 10, 0.0)
+
+    def delete(self, key):
+        self.calls.append('delete:' + key)
+        time.sleep(0.3)
+        return True
+
+
+class SlowPool(object):
+
+    @contextmanager
+    def reserve(self):
+        yield SlowClient()
+
+
+class RemoteCache(Cache):
+    pool = SlowPool()
+
+
+class LRUTestCase(unittest.TestCase):
+    '''
+        LRU Test Case
+    '''
+
+    def test_bounded(self):
+        lru = LRU(2)
+        lru.set('a', 1, 10)
+        lru.set('b', 2, 10)
+        lru.get('a')
+        lru.set('c', 3, 10)
+        self.assertEqual(len(lru), 2)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), 1)
+
+    def test_expiry(self):
+        lru = LRU(2)
+        lru.set('a', 1, -1)
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(len(lru), 0)
+
+
+class CacheTestCase(unittest.TestCase):
+    '''
+        Local tier only Cache Test Case
+    '''
+
+    def test_counters(self):
+        cache = Cache()
+
+        @gen.coroutine
+        def run():
+            self.assertIsNone((yield cache.get('tasks:a')))
+            yield cache.set('tasks:a', {'uuid': 'a'})
+            self.assertEqual((yield cache.get('tasks:a')), {'uuid': 'a'})
+            found = yield cache.get_multi(['a', 'b'], key_prefix='tasks:')
+            self.assertEqual(found, {'a': {'uuid': 'a'}})
+            yield cache.delete('tasks:a')
+            self.assertIsNone((yield cache.get('tasks:a')))
+
+        IOLoop.current().run_sync(run)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 3))
+
+    def test_add(self):
+        cache = Cache()
+
+        @gen.coroutine
+        def run():
+            self.assertTrue((yield cache.add('orgs:a', 1)))
+            self.assertFalse((yield cache.add('orgs:a', 2)))
+            self.assertEqual((yield cache.get('orgs:a')), 1)
+
+        IOLoop.current().run_sync(run)
+
+    def test_remote_off_the_loop(self):
+        cache = RemoteCache()
+        ticks = []
+        timeout = cache_module._settings['timeout']
+        cache_module._settings['timeout'] = 0.1
+
+        @gen.coroutine
+        def tick():
+            while len(ticks) < 5:
+                ticks.append(time.time())
+                yield gen.sleep(0.01)
+
+        @gen.coroutine
+        def run():
+            value, _ = yield [cache.get('tasks:a'), tick()]
+            return value
+
+        try:
+            start = time.time()
+            self.assertIsNone(IOLoop.current().run_sync(run))
+        finally:
+            cache_module._settings['timeout'] = timeout
+        # the loop kept ticking and the slow call was given up on
+        self.assertEqual(len(ticks), 5)
+        self.assertLess(time.time() - start, 0.25)
+        self.assertEqual(cache.stats()['errors'], 1)
+
+    def test_remote_apart_from_storage(self):
+        cache = RemoteCache()
+        saved = dict(cache_module._settings)
+        cache_module._settings.update({'timeout': 0.05, 'pool_size': 1})
+        cache_module._state.update({'executor': None, 'pending': 0})
+        SlowClient.calls = []
+
+        @gen.coroutine
+        def run():
+            gets = [cache.get('tasks:{0}'.format(x)) for x in range(6)]
+            # riak calls don't wait behind the stuck memcached threads
+            start = time.time()
+            riak = yield run_storage(lambda: 'riak')
+            lag = time.time() - start
+            yield gets
+            return riak, lag
+
+        try:
+            riak, lag = IOLoop.current().run_sync(run)
+        finally:
+            cache_module._state['executor'].shutdown(wait=True)
+            cache_module._state.update({'executor': None, 'pending': 0})
+            cache_module._settings.update(saved)
+        self.assertEqual(riak, 'riak')
+        self.assertLess(lag, 0.1)
+        # one client, four calls in the executor, the last two skipped
+        self.assertEqual(cache.stats()['errors'], 6)
+        self.assertEqual(len(SlowClient.calls), 4)
+
+    def test_remote_writes_queue(self):
+        cache = RemoteCache()
+        saved = dict(cache_module._settings)
+        cache_module._settings.update({'timeout': 0.05, 'pool_size': 1})
+        cache_module._state.update({'executor': None, 'pending': 4})
+        SlowClient.calls = []
+
+        @gen.coroutine
+        def run():
+            yield [cache.get('tasks:a'), cache.delete('tasks:a')]
+
+        try:
+            IOLoop.current().run_sync(run)
+        finally:
+            cache_module._state['executor'].shutdown(wait=True)
+            cache_module._state.update({'executor': None, 'pending': 0})
+            cache_module._settings.update(saved)
+        # the read was skipped, the invalidation still went out
+        self.assertEqual(SlowClient.calls, ['delete:tasks:a'])
+
+    def test_single_flight(self):
+        cache = Cache()
+        calls = []
+
+        @gen.coroutine
+        def loader():
+            calls.append(1)
+            yield gen.sleep(0.01)
+            return {'uuid': 'a'}
+
+        @gen.coroutine
+        def run():
+            results = yield [cache.read_through('tasks:a', loader) for _ in range(10)]
+            return results
+
+        results = IOLoop.current().run_sync(run)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'uuid': 'a'}] * 10)
+        self.assertEqual(cache.stats()['coalesced'], 9)
+
+    def test_stale_while_revalidate(self):
+        cache = Cache()
+        cache.lru.set('tasks:a', ('old', time.time() - 1, 0.0), 10)
+
+        @gen.coroutine
+        def loader():
+            return 'new'
+
+        @gen.coroutine
+        def run():
+            stale = yield cache.read_through('tasks:a', loader)
+            yield gen.moment
+            fresh = yield cache.read_through('tasks:a', loader)
+            return stale, fresh
+
+        self.assertEqual(IOLoop.current().run_sync(run), ('old', 'new'))
+        self.assertEqual(cache.stats()['stale_hits'], 1)
+
+    def test_refresh_by_readers(self):
+        cache = Cache()
+        cache.lru.set('tasks:a', ('old', time.time() - 1, 0.0), 10)
+        loads = []
+
+        def loader(account):
+            @gen.coroutine
+            def load():
+                loads.append(account)
+                return 'new'
+            return load
+
+        @gen.coroutine
+        def read(account):
+            value = yield cache.read_through('tasks:a', loader(account),
+                                             refresh=lambda x: account == 'alice')
+            yield gen.moment
+            return value
+
+        @gen.coroutine
+        def run():
+            # bob can't see it, his loader never refreshes alice's copy
+            self.assertEqual((yield read('bob')), 'old')
+            self.assertEqual(loads, [])
+            self.assertEqual((yield read('alice')), 'old')
+            self.assertEqual((yield read('bob')), 'new')
+
+        IOLoop.current().run_sync(run)
+        self.assertEqual(loads, ['alice'])
+
+    def test_versions(self):
+        cache = Cache()
+
+        @gen.coroutine
+        def run():
+            key = yield cache.page_key('tasks', 'alice', 1, None)
+            self.assertEqual((yield cache.page_key('tasks', 'alice', 1, None)), key)
+            self.assertNotEqual((yield cache.page_key('tasks', 'alice', 2, None)), key)
+            other = yield cache.page_key('tasks', 'bob', 1, None)
+            yield cache.bump(['tasks:alice'])
+            self.assertNotEqual((yield cache.page_key('tasks', 'alice', 1, None)), key)
+            self.assertEqual((yield cache.page_key('tasks', 'bob', 1, None)), other)
+
+        IOLoop.current().run_sync(run)
+
+    def test_settling(self):
+        cache = Cache()
+
+        @gen.coroutine
+        def loader():
+            return {'uuid': 'a'}
+
+        @gen.coroutine
+        def run():
+            yield cache.read_through('tasks:b', loader)
+            yield cache.invalidate(['a'], key_prefix='tasks:')
+            yield cache.read_through('tasks:a', loader)
+            yield cache.bump(['tasks:alice'])
+            key = yield cache.page_key('tasks', 'alice', 1)
+            yield cache.read_through(key, loader, settle='versions:tasks:alice')
+            return key
+
+        key = IOLoop.current().run_sync(run)
+        now = time.time()
+        settle_ttl = cache_module._settings['settle_ttl']
+        # loaded right after a write, kept only while the index catches up
+        self.assertLessEqual(cache.lru.get('tasks:a')[1], now + settle_ttl)
+        self.assertLessEqual(cache.lru.get(key)[1], now + settle_ttl)
+        self.assertGreater(cache.lru.get('tasks:b')[1], now + settle_ttl)
+
+    def test_read_tagged(self):
+        cache = Cache()
+        tags = []
+
+        def tag(value):
+            tags.append(value)
+            return '"{0}"'.format(value['uuid'])
+
+        @gen.coroutine
+        def loader():
+            return {'uuid': 'a'}
+
+        @gen.coroutine
+        def run():
+            first = yield cache.read_tagged('tasks:a', loader, tag)
+            second = yield cache.read_tagged('tasks:a', loader, tag)
+            return first, second
+
+        first, second = IOLoop.current().run_sync(run)
+        self.assertEqual(first, second)
+        self.assertEqual(second[1], '"a"')
+        self.assertEqual(len(tags), 1)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+'''
+    Riak map codec tests
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import unittest
+from collections import defaultdict
+from mango.schemas.tasks import Task, TASK_CODEC
+from mango.schemas.teams import TEAM_CODEC
+from mango.schemas.codecs import MapCodec
+from mango.system import update_struct, remove_struct, backfill_struct
+from mango.tools import clean_structure
+from mango.tools.search import IGNORE_ME
+
+
+class FakeRegister(object):
+    value = None
+
+    def assign(self, value):
+        self.value = value
+
+
+class FakeSet(object):
+
+    def __init__(self):
+        self.value = frozenset()
+
+    def add(self, thing):
+        self.value = self.value | {thing}
+
+    def discard(self, thing):
+        self.value = self.value - {thing}
+
+
+class FakeMap(object):
+
+    def __init__(self):
+        self.registers = defaultdict(FakeRegister)
+        self.sets = defaultdict(FakeSet)
+        self.reloads = 0
+
+    def reload(self):
+        self.reloads += 1
+        return self
+
+    def update(self):
+        return self
+
+    @property
+    def value(self):
+        value = dict(((key, 'register'), x.value) for key, x in self.registers.items())
+        value.update(((key, 'set'), x.value) for key, x in self.sets.items())
+        return value
+
+
+class CodecTestCase(unittest.TestCase):
+    '''
+        Map codec Test Case
+    '''
+
+    def test_round_trip(self):
+        struct = {'uuid': 'u', 'account': 'a', 'public': True,
+                  'created_at': 1500000000, 'labels': {'k': 'v'},
+                  'source': 's', 'watchers': ['bob', 'ann']}
+        task = TASK_CODEC.encode(FakeMap(), struct)
+        self.assertEqual(task.registers['public'].value, 'true')
+        self.assertEqual(task.registers['created_at'].value, '1500000000')
+        self.assertIn('source', task.registers)
+        result = TASK_CODEC.decode(task.value)
+        self.assertEqual(result['public'], True)
+        self.assertEqual(result['created_at'], 1500000000)
+        self.assertEqual(result['labels'], {'k': 'v'})
+        self.assertEqual(result['watchers'], ['ann', 'bob'])
+        self.assertNotIn('subject', result)
+
+    def test_decode_doc(self):
+        doc = {'_yz_rk': 'k', 'uuid_register': 'u', 'checked_register': 'True',
+               'labels_register': "['a', 'b']", 'members_set': ['bob']}
+        result = TEAM_CODEC.decode_doc(doc)
+        self.assertEqual(result['uuid'], 'u')
+        self.assertEqual(result['checked'], True)
+        self.assertEqual(result['labels'], ['a', 'b'])
+        self.assertEqual(result['members'], ['bob'])
+        self.assertNotIn('_yz_rk', result)
+
+    def test_legacy_registers(self):
+        task = FakeMap()
+        task.registers['watchers'].assign("['bob', 'ann']")
+        task.registers['comments'].assign('[{"text": "b"}, {"text": "a"}, {"text": "b"}]')
+        task.sets['watchers'].add('eve')
+        task.sets['watchers'].add('ann')
+        result = TASK_CODEC.decode(task.value)
+        self.assertEqual(result['watchers'], ['bob', 'ann', 'eve'])
+        # ordered lists with repeats come first, kept as stored
+        self.assertEqual([x['text'] for x in result['comments']], ['b', 'a', 'b'])
+        doc = {'uuid_register': 'u', 'members_register': "['bob']", 'members_set': ['ann']}
+        self.assertEqual(TEAM_CODEC.decode_doc(doc)['members'], ['bob', 'ann'])
+
+    def test_logs(self):
+        task = TASK_CODEC.encode(FakeMap(), {'comments': ['b', 'a', 'b']})
+        self.assertNotIn('comments', task.registers)
+        self.assertEqual(TASK_CODEC.decode(task.value)['comments'], ['b', 'a', 'b'])
+        # appends need no read and go after what is there
+        update_struct(task, {'comments': ['c', 'a'], 'history': 'moved'}, IGNORE_ME,
+                      codec=TASK_CODEC)
+        self.assertEqual(task.reloads, 0)
+        result = TASK_CODEC.decode(task.value)
+        self.assertEqual(result['comments'], ['b', 'a', 'b', 'c', 'a'])
+        self.assertEqual(result['history'], ['moved'])
+        # search returns set values in any order
+        doc = {'comments_set': sorted(task.sets['comments'].value, reverse=True)}
+        self.assertEqual(TASK_CODEC.decode_doc(doc)['comments'], ['b', 'a', 'b', 'c', 'a'])
+        remove_struct(task, {'comments': ['a']}, IGNORE_ME, codec=TASK_CODEC)
+        self.assertEqual(TASK_CODEC.decode(task.value)['comments'], ['b', 'b', 'c'])
+
+    def test_backfill_logs(self):
+        task = FakeMap()
+        task.registers['history'].assign("['created', 'moved']")
+        update_struct(task, {'history': ['done']}, IGNORE_ME, codec=TASK_CODEC)
+        backfill_struct(task, codec=TASK_CODEC)
+        self.assertEqual(task.registers['history'].value, '')
+        self.assertEqual(TASK_CODEC.decode(task.value)['history'],
+                         ['created', 'moved', 'done'])
+
+    def test_sets_must_be_lists(self):
+        self.assertRaises(ValueError, MapCodec, Task, ('status',))
+        self.assertRaises(ValueError, MapCodec, Task, (), ('status',))
+
+    def test_clean_structure(self):
+        task = Task({'account': 'a', 'subject': 's', 'watchers': ['bob'],
+                     'labels': {'k': 'v'}, 'start_time': 1500000000})
+        task.validate()
+        expected = dict((key, value) for key, value in task.to_primitive().items()
+                        if value is not None)
+        self.assertEqual(clean_structure(task), expected)
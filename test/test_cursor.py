@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+'''
+    Opaque pagination cursor tests
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import unittest
+from mango.tools.cursor import encode_cursor, decode_cursor
+
+
+class CursorTestCase(unittest.TestCase):
+    '''
+        Cursor Test Case
+    '''
+
+    def test_round_trip(self):
+        '''
+            Solr cursorMarks survive the trip, even with + / and =
+        '''
+        cursor = encode_cursor('solr', 'AoE/abc+==')
+        self.assertNotIn('/', cursor)
+        self.assertNotIn('+', cursor)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor('solr', cursor.encode('utf-8')), 'AoE/abc+==')
+
+    def test_end_of_walk(self):
+        '''
+            No token, no cursor
+        '''
+        self.assertIsNone(encode_cursor('riak', None))
+        self.assertIsNone(encode_cursor('riak', b''))
+
+    def test_foreign_cursor(self):
+        '''
+            A riak cursor is not a solr cursor
+        '''
+        cursor = encode_cursor('riak', b'g2gCbQAAAAR1c2Vy')
+        self.assertRaises(ValueError, decode_cursor, 'solr', cursor)
+        self.assertRaises(ValueError, decode_cursor, 'solr', '%%%not-base64')
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+'''
+    Existence filter tests
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import uuid
+import unittest
+from tornado import gen
+from tornado.ioloop import IOLoop
+from mango.tools import validate_uuid4
+from mango.tools import exists as exists_module
+from mango.tools.exists import BloomFilter, ExistenceFilter, configure_filters
+
+
+class IndexFilter(ExistenceFilter):
+    '''
+        Existence filter over a fixed list of indexed uuids
+    '''
+    indexed = ()
+    during = ()
+
+    @gen.coroutine
+    def walk(self, solr, bloom):
+        for x in self.indexed:
+            bloom.add(x)
+        # writes landing while the index is walked
+        for x in self.during:
+            self.add(x)
+
+
+class BloomFilterTestCase(unittest.TestCase):
+    '''
+        Bloom Filter Test Case
+    '''
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        uuids = [str(uuid.uuid4()) for _ in range(1000)]
+        for x in uuids:
+            bloom.add(x)
+        self.assertTrue(all(x in bloom for x in uuids))
+        others = sum(str(uuid.uuid4()) in bloom for _ in range(10000))
+        self.assertLess(others, 300)
+
+
+class ExistenceFilterTestCase(unittest.TestCase):
+    '''
+        Existence Filter Test Case
+    '''
+
+    def might_exist(self, exists, value):
+        return IOLoop.current().run_sync(lambda: exists.might_exist(value))
+
+    def test_not_ready(self):
+        exists = ExistenceFilter('tasks', 'mango_task_index')
+        self.assertTrue(self.might_exist(exists, str(uuid.uuid4())))
+        exists.bloom = BloomFilter(100)
+        known = str(uuid.uuid4())
+        IOLoop.current().run_sync(lambda: exists.add(known))
+        self.assertTrue(self.might_exist(exists, known))
+        self.assertFalse(self.might_exist(exists, str(uuid.uuid4())))
+
+    def test_rebuild_keeps_recent(self):
+        exists = IndexFilter('tasks', 'mango_task_index')
+        exists.indexed = [str(uuid.uuid4()) for _ in range(10)]
+        exists.during = [str(uuid.uuid4())]
+        # added but not yet searchable when the walk starts
+        recent = str(uuid.uuid4())
+        IOLoop.current().run_sync(lambda: exists.add(recent))
+        self.assertTrue(IOLoop.current().run_sync(lambda: exists.rebuild('solr')))
+        for x in exists.indexed + exists.during + [recent]:
+            self.assertIn(x, exists.bloom)
+        self.assertFalse(self.might_exist(exists, str(uuid.uuid4())))
+
+    def test_needs_shared_cache(self):
+        opts = type('Options', (object,), {
+            'exists_filter': True,
+            'memcached_servers': [],
+            'exists_capacity': 1000,
+            'exists_error_rate': 0.01,
+            'exists_rebuild_interval': 600,
+        })
+        settings = dict(exists_module._settings)
+        try:
+            configure_filters(opts)
+            self.assertFalse(exists_module._settings['enabled'])
+            opts.memcached_servers = ['127.0.0.1:11211']
+            configure_filters(opts)
+            self.assertTrue(exists_module._settings['enabled'])
+        finally:
+            exists_module._settings.update(settings)
+
+
+class ValidateUUIDTestCase(unittest.TestCase):
+    '''
+        validate_uuid4 Test Case
+    '''
+
+    def test_canonical_only(self):
+        value = str(uuid.uuid4())
+        self.assertTrue(validate_uuid4(value))
+        self.assertFalse(validate_uuid4(value.upper()))
+        self.assertFalse(validate_uuid4(value.replace('-', '')))
+        self.assertFalse(validate_uuid4(str(uuid.uuid1())))
+        self.assertFalse(validate_uuid4(value + '\n'))
+        self.assertFalse(validate_uuid4(None))
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+'''
+    Request level handler tests, search backend left out
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import uuid
+import ujson as json
+from tornado import gen, web
+from tornado.testing import AsyncHTTPTestCase
+from mango.handlers import tasks, teams, accounts
+from mango.tools.cache import Cache
+from mango.tools.cursor import encode_cursor, decode_cursor
+from mango.tools.search import SearchTimeout
+
+
+ALICE = 'alice'
+
+
+def fake_task(task_uuid, account=ALICE):
+    return {
+        'uuid': task_uuid,
+        'account': account,
+        'title': 'task {0}'.format(task_uuid[:8]),
+        'watchers': [],
+        'last_update_at': 1500000000.0,
+    }
+
+
+def fake_get(stored, account, stuff_uuid):
+    stuff = stored.get(stuff_uuid)
+    if stuff is None or stuff['account'] != account.decode('utf-8'):
+        return {'message': 'not found'}
+    return stuff
+
+
+def fake_page(stored, account, page_size, cursor):
+    '''
+        Cursor walk over stored by uuid, the token is the last uuid seen
+    '''
+    account = account.decode('utf-8')
+    last = (decode_cursor('solr', cursor) if cursor else '')
+    found = sorted((x for x in stored.values() if x['account'] == account),
+                   key=lambda x: x['uuid'])
+    page = [x for x in found if x['uuid'] > last][:page_size]
+    more = page and page[-1]['uuid'] != found[-1]['uuid']
+    return {
+        'count': len(found),
+        'page': 1,
+        'cursor': encode_cursor('solr', page[-1]['uuid']) if more else None,
+        'results': page,
+    }
+
+
+class TasksHandler(tasks.Handler):
+    '''
+        Tasks handler over an in-memory backend
+    '''
+    stored = {}
+    batches = []
+    loads = []
+    failures = 0
+
+    @gen.coroutine
+    def get_task(self, account, task_uuid):
+        self.loads.append(task_uuid)
+        if TasksHandler.failures:
+            TasksHandler.failures -= 1
+            raise SearchTimeout('timed out')
+        return fake_get(self.stored, account, task_uuid)
+
+    @gen.coroutine
+    def search_task_list(self, account, page_num, page_size, cursor=None):
+        self.loads.append(cursor)
+        return fake_page(self.stored, account, page_size, cursor)
+
+    @gen.coroutine
+    def get_task_batch(self, account, uuids):
+        self.batches.append(list(uuids))
+        account = account.decode('utf-8')
+        return dict((x, self.stored[x]) for x in uuids
+                    if x in self.stored and self.stored[x]['account'] == account)
+
+
+class TasksTestCase(AsyncHTTPTestCase):
+    '''
+        GET /tasks through the real routing and base handler
+    '''
+
+    def get_app(self):
+        return web.Application([
+            (r'/tasks/(?P<task_uuid>.+)/?', TasksHandler),
+            (r'/tasks/?', TasksHandler),
+        ], cache=Cache(), page_size=2, solr='127.0.0.1:8098')
+
+    def setUp(self):
+        super(TasksTestCase, self).setUp()
+        self.uuids = sorted(str(uuid.uuid4()) for _ in range(3))
+        TasksHandler.stored = dict((x, fake_task(x)) for x in self.uuids)
+        TasksHandler.batches = []
+        TasksHandler.loads = []
+        TasksHandler.failures = 0
+
+    def test_get_ids(self):
+        missing = str(uuid.uuid4())
+        ids = ','.join(self.uuids[:1] + [missing])
+        response = self.fetch('/tasks?account={0}&ids={1}'.format(ALICE, ids))
+        self.assertEqual(response.code, 200)
+        message = json.loads(response.body)
+        self.assertEqual([x['uuid'] for x in message['results']], self.uuids[:1])
+        self.assertEqual(message['missing'], [missing])
+        self.assertEqual(TasksHandler.batches, [self.uuids[:1] + [missing]])
+        # second time around the found ones come from the cache
+        response = self.fetch('/tasks?account={0}&ids={1}'.format(ALICE, ids))
+        self.assertEqual(json.loads(response.body)['count'], 1)
+        self.assertEqual(TasksHandler.batches[-1], [missing])
+
+    def test_get_invalid_ids(self):
+        response = self.fetch('/tasks?account={0}&ids=nope'.format(ALICE))
+        self.assertEqual(response.code, 400)
+        self.assertIn('invalid ids', json.loads(response.body)['message'])
+
+    def test_not_modified(self):
+        url = '/tasks/{0}?account={1}'.format(self.uuids[0], ALICE)
+        response = self.fetch(url)
+        self.assertEqual(response.code, 200)
+        etag = response.headers['Etag']
+        response = self.fetch(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.body, b'')
+        self.assertEqual(TasksHandler.loads, [self.uuids[0]])
+        # somebody else's copy gets the body
+        response = self.fetch(url, headers={'If-None-Match': '"0-stale"'})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Etag'], etag)
+
+    def test_search_error(self):
+        TasksHandler.failures = 1
+        url = '/tasks/{0}?account={1}'.format(self.uuids[0], ALICE)
+        response = self.fetch(url)
+        self.assertEqual(response.code, 502)
+        self.assertNotIn('Etag', response.headers)
+        # no not found remembered, the next read goes to the backend
+        response = self.fetch(url)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)['uuid'], self.uuids[0])
+
+    def test_slashes(self):
+        TasksHandler.stored[self.uuids[0]]['title'] = 'to/do'
+        response = self.fetch('/tasks/{0}?account={1}'.format(self.uuids[0], ALICE))
+        self.assertIn(b'"to/do"', response.body)
+        # options bodies go through the same encoder
+        response = self.fetch('/tasks', method='OPTIONS')
+        self.assertIn(b'"array/string"', response.body)
+
+    def test_cursor_walk(self):
+        url = '/tasks?account={0}'.format(ALICE)
+        response = self.fetch(url)
+        first = json.loads(response.body)
+        self.assertEqual([x['uuid'] for x in first['results']], self.uuids[:2])
+        self.assertTrue(first['cursor'])
+        next_url = '{0}&cursor={1}'.format(url, first['cursor'])
+        response = self.fetch(next_url)
+        second = json.loads(response.body)
+        self.assertEqual([x['uuid'] for x in second['results']], self.uuids[2:])
+        self.assertIsNone(second['cursor'])
+        # pages are cached per cursor, each with its own etag
+        response = self.fetch(next_url, headers={'If-None-Match': response.headers['Etag']})
+        self.assertEqual(response.code, 304)
+        response = self.fetch(url, headers={'If-None-Match': response.headers['Etag']})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(TasksHandler.loads, [None, first['cursor'].encode('utf-8')])
+
+    def test_foreign_cursor(self):
+        cursor = encode_cursor('riak', 'continuation')
+        response = self.fetch('/tasks?account={0}&cursor={1}'.format(ALICE, cursor))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)['results'], [])
+
+
+class BulkHandler(tasks.BulkHandler):
+    '''
+        Bulk handler recording what reaches the system layer
+    '''
+    calls = []
+    status = 200
+
+    @gen.coroutine
+    def new_task_bulk(self, structs):
+        self.calls.append(structs)
+        return [{'index': i, 'status': x.get('result', 201)} for i, x in enumerate(structs)]
+
+    @gen.coroutine
+    def modify_task_bulk(self, account, struct, uuids=None, query=None, remove=False):
+        self.calls.append(uuids)
+        return [{'uuid': x, 'status': self.status} for x in uuids]
+
+
+class BulkTestCase(AsyncHTTPTestCase):
+    '''
+        PATCH /tasks/bulk
+    '''
+
+    def get_app(self):
+        return web.Application([
+            (r'/tasks/bulk/?', BulkHandler),
+        ], cache=Cache(), bulk_max_items=3)
+
+    def setUp(self):
+        super(BulkTestCase, self).setUp()
+        BulkHandler.calls = []
+        BulkHandler.status = 200
+
+    def patch(self, body):
+        return self.fetch('/tasks/bulk?account={0}'.format(ALICE), method='PATCH',
+                          body=json.dumps(body))
+
+    def post(self, body):
+        return self.fetch('/tasks/bulk', method='POST', body=body)
+
+    def test_post_status(self):
+        for results, code in (([201, 201], 201), ([201, 400], 207), ([400, 400], 400),
+                              ([400, 500], 500)):
+            body = '\n'.join(json.dumps({'result': x}) for x in results)
+            response = self.post(body)
+            self.assertEqual(response.code, code)
+            self.assertEqual(json.loads(response.body)['created'], results.count(201))
+
+    def test_post_invalid(self):
+        self.assertEqual(self.post('[1, 2]').code, 400)
+        self.assertEqual(self.post('[]').code, 400)
+        self.assertEqual(self.post(json.dumps([{}] * 4)).code, 413)
+        self.assertEqual(BulkHandler.calls, [])
+
+    def test_repeated_uuids(self):
+        first, second = str(uuid.uuid4()), str(uuid.uuid4())
+        response = self.patch({'uuids': [first, second, first], 'changes': {'status': 'done'}})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)['count'], 2)
+        self.assertEqual(BulkHandler.calls, [[first, second]])
+
+    def test_nothing_to_change(self):
+        BulkHandler.status = 400
+        response = self.fetch('/tasks/bulk?account={0}&remove=1'.format(ALICE), method='PATCH',
+                              body=json.dumps({'uuids': [str(uuid.uuid4())],
+                                               'changes': {'status': 'done'}}))
+        self.assertEqual(response.code, 400)
+
+    def test_invalid_uuids(self):
+        for uuids in ({'a': 1}, 7, [str(uuid.uuid4())] * 4):
+            response = self.patch({'uuids': uuids, 'changes': {'status': 'done'}})
+            self.assertEqual(response.code, 413 if isinstance(uuids, list) else 400)
+        self.assertEqual(BulkHandler.calls, [])
+
+
+class TeamsHandler(teams.Handler):
+    '''
+        Teams handler over an in-memory backend
+    '''
+    stored = {}
+
+    @gen.coroutine
+    def get_team(self, account, team_uuid):
+        return fake_get(self.stored, account, team_uuid)
+
+    @gen.coroutine
+    def search_team_list(self, account, page_num, page_size, cursor=None):
+        return fake_page(self.stored, account, page_size, cursor)
+
+
+class TeamsTestCase(AsyncHTTPTestCase):
+    '''
+        GET /orgs/<org>/teams, single teams and cursor pages
+    '''
+
+    def get_app(self):
+        return web.Application([
+            (r'/orgs/(?P<org_uuid>.+)/teams/(?P<team_uuid>.+)/?', TeamsHandler),
+            (r'/orgs/(?P<org_uuid>.+)/teams/?', TeamsHandler),
+        ], cache=Cache(), page_size=2, solr='127.0.0.1:8098')
+
+    def setUp(self):
+        super(TeamsTestCase, self).setUp()
+        self.org = str(uuid.uuid4())
+        self.uuids = sorted(str(uuid.uuid4()) for _ in range(3))
+        TeamsHandler.stored = dict((x, fake_task(x)) for x in self.uuids)
+
+    def test_not_modified(self):
+        url = '/orgs/{0}/teams/{1}?account={2}'.format(self.org, self.uuids[1], ALICE)
+        response = self.fetch(url)
+        self.assertEqual(response.code, 200)
+        response = self.fetch(url, headers={'If-None-Match': response.headers['Etag']})
+        self.assertEqual(response.code, 304)
+        response = self.fetch(url, method='HEAD',
+                              headers={'If-None-Match': response.headers['Etag']})
+        self.assertEqual(response.code, 304)
+
+    def test_cursor_walk(self):
+        url = '/orgs/{0}/teams?account={1}'.format(self.org, ALICE)
+        first = json.loads(self.fetch(url).body)
+        second = json.loads(self.fetch('{0}&cursor={1}'.format(url, first['cursor'])).body)
+        self.assertEqual([x['uuid'] for x in first['results'] + second['results']], self.uuids)
+        self.assertIsNone(second['cursor'])
+
+
+class OrgsHandler(accounts.OrgsHandler):
+    '''
+        Orgs handler over an in-memory backend
+    '''
+    stored = {}
+
+    @gen.coroutine
+    def get_org(self, account, org_uuid):
+        return fake_get(self.stored, account, org_uuid)
+
+
+class OrgsTestCase(AsyncHTTPTestCase):
+    '''
+        GET /orgs/<uuid> etags
+    '''
+
+    def get_app(self):
+        return web.Application([
+            (r'/orgs/(?P<org_uuid>.+)/?', OrgsHandler),
+        ], cache=Cache(), page_size=2, solr='127.0.0.1:8098')
+
+    def setUp(self):
+        super(OrgsTestCase, self).setUp()
+        self.uuid = str(uuid.uuid4())
+        OrgsHandler.stored = {self.uuid: fake_task(self.uuid)}
+
+    def test_not_modified(self):
+        url = '/orgs/{0}?account={1}'.format(self.uuid, ALICE)
+        response = self.fetch(url)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)['uuid'], self.uuid)
+        etag = response.headers['Etag']
+        response = self.fetch(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.code, 304)
+        # the cached org is not bob's, neither is its etag
+        response = self.fetch('/orgs/{0}?account=bob'.format(self.uuid),
+                              headers={'If-None-Match': etag})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), {'message': 'not found'})
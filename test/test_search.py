@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''
+    Search key resolution tests
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import uuid
+from tornado import gen, testing
+from mango.tools import search
+
+
+class SearchKeysTestCase(testing.AsyncTestCase):
+    '''
+        Search keys Test Case
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.urls = []
+        self.search_body = search.search_body
+
+        @gen.coroutine
+        def fake_body(url, request_timeout=None):
+            self.urls.append(url)
+            return {'response': {'docs': []}, 'nextCursorMark': '*'}
+        search.search_body = fake_body
+
+    def tearDown(self):
+        search.search_body = self.search_body
+        super().tearDown()
+
+    @testing.gen_test
+    def test_batches(self):
+        uuids = [str(uuid.uuid4()) for _ in range(search.KEY_BATCH * 2 + 1)]
+        keys = yield search.search_uuid_keys('solr', 'index', uuids, 'account_register:a')
+        self.assertEqual(keys, {})
+        self.assertEqual(len(self.urls), 3)
+        self.assertIn('fl=_yz_rk%2Cuuid_register', self.urls[0])
+        self.assertIn('rows=1&', self.urls[2])
+
+    @testing.gen_test
+    def test_extra_fields(self):
+        uuids = [str(uuid.uuid4())]
+        docs = yield search.search_uuid_docs('solr', 'index', uuids, 'account_register:a',
+                                             ('watchers_set',))
+        self.assertEqual(docs, {})
+        self.assertIn('fl=_yz_rk%2Cuuid_register%2Cwatchers_set', self.urls[0])
+
+
+class SearchTimeoutTestCase(testing.AsyncTestCase):
+    '''
+        Search timeout Test Case
+    '''
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        self.fetch = search.http_client.fetch
+
+        @gen.coroutine
+        def fake_fetch(url, **kwargs):
+            self.calls.append(kwargs)
+            return type('Response', (), {'code': 200, 'body': '{"response": {}}'})()
+        search.http_client.fetch = fake_fetch
+
+    def tearDown(self):
+        del search.http_client.fetch
+        super().tearDown()
+
+    @testing.gen_test
+    def test_option_default(self):
+        yield search.search_body('url')
+        yield search.search_body('url', request_timeout=2.0)
+        self.assertEqual(self.calls, [{}, {'request_timeout': 2.0}])
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+'''
+    Storage helpers tests
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import unittest
+from mango.tools.storage import multiget, multiget_data
+
+
+class FakeObject(object):
+    '''
+        Riak object look-alike
+    '''
+
+    def __init__(self, key, exists=True):
+        self.key = key
+        self.exists = exists
+        self.data = {'uuid': key}
+
+
+class FakeBucket(object):
+    '''
+        Answers multiget in completion order, not request order
+    '''
+
+    def multiget(self, keys):
+        results = [FakeObject(key) for key in reversed(keys)
+                   if key not in ('gone', 'broken')]
+        results.append(('mango_account', 'accounts', 'broken', Exception('boom')))
+        if 'gone' in keys:
+            results.append(FakeObject('gone', exists=False))
+        return results
+
+
+class MultigetTestCase(unittest.TestCase):
+    '''
+        Multiget Test Case
+    '''
+
+    def test_keeps_order(self):
+        '''
+            Results come back in keys order
+        '''
+        keys = ['a', 'b', 'c', 'd']
+        self.assertEqual([x.key for x in multiget(FakeBucket(), keys)], keys)
+
+    def test_missing_and_failed(self):
+        '''
+            Missing and failed keys are None, data skips them
+        '''
+        keys = ['a', 'gone', 'broken', 'b']
+        self.assertEqual([x and x.key for x in multiget(FakeBucket(), keys)],
+                         ['a', None, None, 'b'])
+        self.assertEqual(multiget_data(FakeBucket(), iter(keys)),
+                         [{'uuid': 'a'}, {'uuid': 'b'}])
+
+    def test_no_keys(self):
+        '''
+            No keys, no round trip
+        '''
+        self.assertEqual(multiget(None, []), [])
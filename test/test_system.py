@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+'''
+    System helpers tests
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import unittest
+from collections import defaultdict
+from mango.system import update_struct, remove_struct, backfill_struct
+
+
+class FakeRegister(object):
+    value = None
+
+    def assign(self, value):
+        self.value = value
+
+
+class FakeSet(object):
+
+    def __init__(self):
+        self.value = frozenset()
+        self.removed = []
+
+    def add(self, thing):
+        self.value = self.value | {thing}
+
+    def discard(self, thing):
+        self.removed.append(thing)
+
+
+class FakeMap(object):
+    '''
+        Riak map look-alike counting round trips
+    '''
+
+    def __init__(self):
+        self.reloads = 0
+        self.updates = 0
+        self.registers = defaultdict(FakeRegister)
+        self.sets = defaultdict(FakeSet)
+
+    def reload(self):
+        self.reloads += 1
+        return self
+
+    def update(self):
+        self.updates += 1
+        return self
+
+
+IGNORE_ME = ("_yz_id", "_yz_rk", "_yz_rt", "_yz_rb")
+
+
+class UpdateStructTestCase(unittest.TestCase):
+    '''
+        Update struct Test Case
+    '''
+
+    def test_single_update(self):
+        '''
+            Many fields, one fetch and one update
+        '''
+        task = FakeMap()
+        task.registers['history'].assign("['created']")
+        struct = {'subject': 'x', 'status': 'now', 'history': ['moved'],
+                  'comments': ['hi'], 'watchers': ['bob'], '_yz_rk': 'k'}
+        self.assertTrue(update_struct(task, struct, IGNORE_ME, ('watchers',)))
+        self.assertEqual((task.reloads, task.updates), (1, 1))
+        self.assertEqual(task.registers['history'].value, "['created', 'moved']")
+        self.assertEqual(task.registers['comments'].value, "['hi']")
+        self.assertEqual(task.sets['watchers'].value, frozenset(['bob']))
+        self.assertNotIn('_yz_rk', task.registers)
+
+    def test_no_read_without_lists(self):
+        '''
+            Registers and sets only, no fetch
+        '''
+        task = FakeMap()
+        update_struct(task, {'status': 'done', 'watchers': ['bob']}, IGNORE_ME, ('watchers',))
+        self.assertEqual((task.reloads, task.updates), (0, 1))
+
+    def test_nothing_to_do(self):
+        '''
+            Nothing to change, no round trips
+        '''
+        task = FakeMap()
+        self.assertFalse(update_struct(task, {'_yz_rk': 'k'}, IGNORE_ME))
+        self.assertFalse(remove_struct(task, {'status': 'done'}, IGNORE_ME))
+        self.assertEqual((task.reloads, task.updates), (0, 0))
+
+    def test_remove(self):
+        '''
+            Removals, one fetch and one update
+        '''
+        task = FakeMap()
+        task.registers['assign'].assign("['ann', 'bob']")
+        task.sets['watchers'].add('bob')
+        struct = {'assign': ['bob'], 'watchers': ['bob', 'eve']}
+        self.assertTrue(remove_struct(task, struct, IGNORE_ME, ('watchers',)))
+        self.assertEqual((task.reloads, task.updates), (1, 1))
+        self.assertEqual(task.registers['assign'].value, "['ann']")
+        self.assertEqual(task.sets['watchers'].removed, ['bob'])
+
+    def test_remove_legacy_register(self):
+        '''
+            Set keys stored as registers before are cleaned too
+        '''
+        task = FakeMap()
+        task.registers['watchers'].assign("['ann', 'bob']")
+        task.sets['watchers'].add('eve')
+        remove_struct(task, {'watchers': ['bob', 'eve']}, IGNORE_ME, ('watchers',))
+        self.assertEqual(task.registers['watchers'].value, "['ann']")
+        self.assertEqual(task.sets['watchers'].removed, ['eve'])
+
+    def test_lone_values(self):
+        '''
+            A string is one element, not one per character
+        '''
+        task = FakeMap()
+        update_struct(task, {'watchers': 'bob', 'assign': 'alice'}, IGNORE_ME,
+                      ('assign', 'watchers'))
+        self.assertEqual(task.sets['watchers'].value, frozenset(['bob']))
+        self.assertEqual(task.sets['assign'].value, frozenset(['alice']))
+        self.assertTrue(remove_struct(task, {'watchers': 'bob'}, IGNORE_ME, ('watchers',)))
+        self.assertEqual(task.sets['watchers'].removed, ['bob'])
+
+    def test_set_objects(self):
+        '''
+            Objects go in and out of sets as sorted json
+        '''
+        user = FakeMap()
+        team = {'uuid': 'u', 'name': 'n'}
+        update_struct(user, {'teams': [team]}, IGNORE_ME, ('teams',))
+        self.assertEqual(user.sets['teams'].value, frozenset(['{"name":"n","uuid":"u"}']))
+        remove_struct(user, {'teams': [{'name': 'n', 'uuid': 'u'}]}, IGNORE_ME, ('teams',))
+        self.assertEqual(user.sets['teams'].removed, ['{"name":"n","uuid":"u"}'])
+
+    def test_backfill(self):
+        '''
+            Legacy register values end up in the set, register emptied
+        '''
+        task = FakeMap()
+        task.registers['watchers'].assign("['ann', 'bob']")
+        task.sets['watchers'].add('eve')
+        self.assertTrue(backfill_struct(task, ('watchers', 'assign')))
+        self.assertEqual(task.sets['watchers'].value, frozenset(['ann', 'bob', 'eve']))
+        self.assertEqual(task.registers['watchers'].value, '')
+        self.assertEqual((task.reloads, task.updates), (1, 1))
+        # second time around there's nothing left to move
+        self.assertFalse(backfill_struct(task, ('watchers', 'assign')))
+        self.assertEqual(task.updates, 1)
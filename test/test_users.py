@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+'''
+    User list 2i paging tests
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import time
+from tornado import gen, testing
+from mango.system import accounts
+
+
+class FakePage(object):
+
+    def __init__(self, results, continuation):
+        self.results = results
+        self.continuation = continuation
+
+
+class FakeBucket(object):
+    '''
+        Riak bucket look-alike with a slow user 2i
+    '''
+
+    def __init__(self, users):
+        self.users = users
+        self.reads = 0
+
+    def get_index(self, index, value, max_results=None, continuation=None):
+        self.reads += 1
+        time.sleep(0.01)
+        start = int(continuation or 0)
+        end = start + max_results
+        return FakePage(self.users[start:end], str(end) if end < len(self.users) else None)
+
+    def stream_index(self, index, value):
+        yield self.users
+
+
+class UserIndexTestCase(testing.AsyncTestCase):
+    '''
+        User index continuations Test Case
+    '''
+
+    def setUp(self):
+        super().setUp()
+        accounts._user_index.update({'pages': {}, 'pages_at': 0, 'page_size': None,
+                                     'count': None, 'count_at': 0})
+        self.bucket = FakeBucket(['user{0}'.format(x) for x in range(25)])
+        self.users = accounts.Accounts()
+
+    @testing.gen_test
+    def test_concurrent_pages(self):
+        pages = yield [self.users.user_index_continuation(self.bucket, x % 4 + 2, 5)
+                       for x in range(12)]
+        self.assertEqual(pages[:4], ['5', '10', '15', '20'])
+        self.assertEqual(pages[4:8], pages[:4])
+        last = yield self.users.user_index_continuation(self.bucket, 6, 5)
+        self.assertIs(last, False)
+        self.assertEqual((yield self.users.user_index_count(self.bucket)), 25)
+
+    @testing.gen_test
+    def test_first_page(self):
+        for page_num in (1, 0, -3):
+            continuation = yield self.users.user_index_continuation(self.bucket, page_num, 5)
+            self.assertIsNone(continuation)
+        self.assertEqual(self.bucket.reads, 0)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+'''
+    Compiled validation tests
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import unittest
+from schematics.exceptions import DataError
+from mango.schemas.tasks import Task, TASK_VALIDATOR
+from mango.schemas.teams import TEAM_VALIDATOR
+from mango.tools import clean_structure
+
+
+def model_clean(model, struct):
+    event = model(struct)
+    event.validate()
+    return clean_structure(event)
+
+
+class ValidatorTestCase(unittest.TestCase):
+    '''
+        Validator Test Case
+    '''
+
+    def test_fast_matches_model(self):
+        struct = {'uuid': 'a5f2b5c4-1d0e-4f6a-9b8c-7d6e5f4a3b2c', 'account': 'alice',
+                  'subject': 'report', 'watchers': ['bob'], 'labels': {'k': 'v'},
+                  'start_time': 1500000000, 'status': 'now'}
+        fast = TASK_VALIDATOR.fast
+        self.assertEqual(TASK_VALIDATOR.clean(struct), model_clean(Task, struct))
+        self.assertEqual(TASK_VALIDATOR.fast, fast + 1)
+
+    def test_defaults(self):
+        message = TASK_VALIDATOR.clean({'account': 'alice'})
+        self.assertEqual(message['status'], 'new')
+        self.assertIs(message['public'], False)
+        self.assertEqual(len(message['uuid']), 36)
+
+    def test_same_errors(self):
+        for struct in ({'subject': 'no account'},
+                       {'account': 'alice', 'status': 'maybe'},
+                       {'account': 'alice', 'rogue': 1},
+                       {'account': 'alice', 'public': 'maybe'}):
+            with self.assertRaises(DataError) as fast:
+                TASK_VALIDATOR.clean(struct)
+            with self.assertRaises(DataError) as slow:
+                model_clean(Task, struct)
+            self.assertEqual(str(fast.exception), str(slow.exception))
+
+    def test_required_list(self):
+        self.assertRaises(DataError, TEAM_VALIDATOR.clean, {
+            'account': 'acme', 'status': 'active', 'name': 'ops',
+            'permissions': 'write', 'created_by': 'alice'})
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+'''
+    Task watcher filter tests
+'''
+# This file is part of mango.
+
+# Distributed under the terms of the last AGPL License.
+# The full license is in the file LICENCE, distributed as part of this software.
+
+
+import unittest
+from mango.schemas.tasks import TASK_CODEC
+from mango.system import tasks
+
+
+class WatchersTestCase(unittest.TestCase):
+    '''
+        owner_or_watcher and task_visible agree
+    '''
+
+    def tearDown(self):
+        tasks._settings['legacy_watchers'] = True
+
+    def test_legacy_watchers(self):
+        task = TASK_CODEC.decode_doc({'account_register': 'alice',
+                                      'watchers_register': "['bob']"})
+        self.assertTrue(tasks.task_visible(task, b'bob'))
+        self.assertIn("watchers_register:*'bob'*", tasks.owner_or_watcher(b'bob'))
+
+    def test_after_backfill(self):
+        tasks._settings['legacy_watchers'] = False
+        self.assertEqual(tasks.owner_or_watcher(b'bob'),
+                         '((account_register:bob)OR(watchers_set:bob))')